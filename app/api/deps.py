@@ -2,9 +2,9 @@
 from fastapi import FastAPI, HTTPException, Query, Security, Depends
 from fastapi.security.api_key import APIKeyHeader
 from sqlalchemy.orm import Session
-from app.db.session import get_db
+from app.db.session import get_db, get_async_db
 from app.core.config import settings
-from app.services.minhash import shared_lsh
+from app.services.minhash import get_shared_lsh, get_shared_signatures, get_shared_forest
 
 API_KEY_NAME = "X-API-Key"
 api_key_header = APIKeyHeader(name=API_KEY_NAME, auto_error=True)
@@ -17,5 +17,23 @@ async def get_api_key(api_key_header: str = Security(api_key_header)):
         )
     return api_key_header
 
+optional_api_key_header = APIKeyHeader(name=API_KEY_NAME, auto_error=False)
+
+# For routes open to anyone that take the API key for some of what they do
+async def get_optional_api_key(api_key_header: str = Security(optional_api_key_header)):
+    if api_key_header is not None and api_key_header != settings.API_KEY:
+        raise HTTPException(
+            status_code=403,
+            detail="Invalid API Key"
+        )
+    return api_key_header
+
 def get_minhash_lsh():
-    return shared_lsh
+    # Resolved per request, since the warm start swaps in a rebuilt index
+    return get_shared_lsh()
+
+def get_minhash_signatures():
+    return get_shared_signatures()
+
+def get_minhash_forest():
+    return get_shared_forest()
@@ -1,20 +1,51 @@
 from fastapi import APIRouter, Depends, HTTPException, Query, status
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import List
-import hashlib
 
-from app.schemas.log import LogInput
-from app.db.models.proof import Proof
-from app.services.proof import get_proof_by_proof_key, create_proof
-from app.api.deps import get_db, get_api_key
+from app.schemas.log import LogInput, LogEntryOutput, LogPageOutput
+from app.services.proof_logs import get_proof_log_buffer, get_proof_logs, decode_log_content, LogBufferFullError
+from app.services.proof_logs import LogEntryTooLargeError
+from app.api.deps import get_async_db, get_api_key
+from app.core.config import settings
 
 
 router = APIRouter()
 
-@router.post("/")
-def log(
+# Buffered and written in batches, so entries show up in GET after up to PROOF_LOG_FLUSH_INTERVAL
+@router.post("/", status_code=status.HTTP_202_ACCEPTED)
+async def log(
     item: LogInput,
     api_key: str = Depends(get_api_key),
 ):
-    print(f"===> PoC Logging for the proof key: {item.proof_key}")
-    print(item.log_content)
+    try:
+        get_proof_log_buffer().add(item.proof_key, item.log_content)
+    except LogEntryTooLargeError as e:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=str(e))
+    except LogBufferFullError as e:
+        raise HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS, detail=str(e))
+
+@router.get("/{proof_key}", response_model=LogPageOutput)
+async def get_logs(
+    proof_key: str,
+    after: int = Query(0, ge=0, description="ID of the last entry of the previous page"),
+    limit: int = Query(100, ge=1),
+    api_key: str = Depends(get_api_key),
+    db: AsyncSession = Depends(get_async_db),
+):
+    if limit > settings.PROOF_LOG_PAGE_MAX_SIZE:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"At most {settings.PROOF_LOG_PAGE_MAX_SIZE} log entries per page"
+        )
+
+    # One extra entry tells whether there is a next page
+    entries = await get_proof_logs(db, proof_key, after_id=after, limit=limit + 1)
+    next_after = entries[limit - 1].id if len(entries) > limit else None
+    return LogPageOutput(
+        proof_key=proof_key,
+        entries=[
+            LogEntryOutput(id=entry.id, created_at=entry.created_at, log_content=decode_log_content(entry))
+            for entry in entries[:limit]
+        ],
+        next_after=next_after,
+    )
@@ -0,0 +1,49 @@
+from fastapi import APIRouter, Depends
+from fastapi.responses import Response
+
+from app.api.deps import get_api_key
+from app.services import geocode, proof
+from app.services.proof_jobs import proof_job_counts
+from app.services.proof_logs import proof_log_buffer_pending
+from app.services.admission import get_memory_budget
+from app.services.minhash import get_shared_signatures, get_shared_forest
+from app.utils.metrics import REGISTRY, CONTENT_TYPE, CallbackMetric
+
+router = APIRouter()
+
+# State kept by other modules, read only when scraped
+
+def _cache_stats(field: str) -> dict:
+    caches = {
+        "geocode": geocode.memory_cache,
+        "proof": proof.proof_cache,
+        "missing_proof": proof.missing_proof_cache,
+    }
+    return {(name,): cache.stats()[field] for name, cache in caches.items()}
+
+def _lsh_entries() -> dict:
+    forest = get_shared_forest()
+    entries = {("signatures",): len(get_shared_signatures())}
+    if forest is not None:
+        entries[("forest",)] = len(forest)
+    return entries
+
+def _proof_jobs() -> dict:
+    return {(status,): count for status, count in proof_job_counts().items()}
+
+CallbackMetric("cache_hits_total", "Cache hits", "counter", lambda: _cache_stats("hits"), ["cache"])
+CallbackMetric("cache_misses_total", "Cache misses", "counter", lambda: _cache_stats("misses"), ["cache"])
+CallbackMetric("cache_evictions_total", "Cache evictions", "counter", lambda: _cache_stats("evictions"), ["cache"])
+CallbackMetric("cache_entries", "Entries held by each cache", "gauge", lambda: _cache_stats("size"), ["cache"])
+CallbackMetric("minhash_index_entries", "Entries held by each in-process MinHash index", "gauge",
+               _lsh_entries, ["index"])
+CallbackMetric("proof_jobs", "Proof jobs known to this worker, by status", "gauge", _proof_jobs, ["status"])
+CallbackMetric("proof_memory_reserved_bytes", "Enclave memory reserved by proof generations in flight", "gauge",
+               lambda: get_memory_budget().reserved)
+CallbackMetric("proof_log_buffer_entries", "Log entries waiting to be written", "gauge", proof_log_buffer_pending)
+
+@router.get("")
+def metrics(
+    api_key: str = Depends(get_api_key),
+):
+    return Response(REGISTRY.render(), media_type=CONTENT_TYPE)
@@ -1,95 +1,339 @@
-from fastapi import APIRouter, Depends, HTTPException, status
+from fastapi import APIRouter, Depends, HTTPException, Request, status
+from fastapi.concurrency import run_in_threadpool
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
+import json
+import logging
 
-from schemas.minhash import MinHashInput, SaveMinHashOutput, QueryMinHashOutputOne, QueryMinHashOutput
+from app.schemas.minhash import MinHashInput, SaveMinHashOutput, QueryMinHashOutputOne, QueryMinHashOutput
+from app.schemas.minhash import MinHashBatchInput, SaveMinHashBatchOutputOne, SaveMinHashBatchOutput
+from app.schemas.minhash import QueryTopMinHashInput, QueryMinHashBatchOutputOne, QueryMinHashBatchOutput
+from app.schemas.minhash import DeleteMinHashOutput
 from app.db.models.proof import Proof
-from app.api.deps import get_db, get_api_key, get_minhash_lsh
-from app.utils.minhash import deserialize_minhash, serialize_minhash
+from app.api.deps import get_db, get_async_db, get_api_key, get_minhash_lsh, get_minhash_signatures, get_minhash_forest
+from app.utils.minhash import deserialize_minhash, serialize_signature, SignatureMatrix, ForestIndex
 from app.core.config import settings
 from app.services.minhash import save_minhash as save_minhash_db
-from app.services.minhash import get_minhash_by_id
+from app.services.minhash import index_minhash, index_minhashes, save_minhashes, score_candidates_batch
+from app.services.minhash import replace_user_minhashes, delete_minhashes, unindex_minhashes
+from app.services.minhash import score_candidates_async, query_top_k_async, query_lsh_async
 from datasketch import MinHashLSH
 
+logger = logging.getLogger(__name__)
+
 router = APIRouter()
 
+# Deserialize the minhash of a request, rejecting malformed signatures
+def parse_minhash_input(item: MinHashInput):
+    try:
+        return deserialize_minhash(item.minhash_data)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid minhash data")
+
+# Serialize a stored signature, or None if a concurrent delete, upsert or
+# compaction removed it since it was scored
+def serialize_stored_signature(signatures: SignatureMatrix, minhash_id: int):
+    entry = signatures.get(minhash_id)
+    if entry is None:
+        return None
+    _, seed, hashvalues = entry
+    return serialize_signature(seed, hashvalues)
+
 # Save a minhash entry
 @router.post("/", response_model=SaveMinHashOutput)
 def save_minhash(
     item: MinHashInput,
+    upsert: bool = False,
     api_key: str = Depends(get_api_key),
     db: Session = Depends(get_db),
     lsh: MinHashLSH = Depends(get_minhash_lsh)
 ):
+    # Deserialize the minhash
+    minhash = parse_minhash_input(item)
+
     try:
-        # Deserialize the minhash
-        minhash = deserialize_minhash(item.minhash_data)
-        if not minhash:
-            raise HTTPException(status_code=400, detail="Invalid minhash data")
-        
-        # Insert the minhash entry into the database
-        minhash_id = save_minhash_db(db, item.user_id, minhash)
+        # Insert the minhash entry into the database, replacing the user's
+        # previous entries when upserting
+        if upsert:
+            [minhash_id], replaced = replace_user_minhashes(db, [(item.user_id, minhash)])
+            unindex_minhashes(lsh, replaced)
+        else:
+            minhash_id = save_minhash_db(db, item.user_id, minhash)
         if not minhash_id:
             raise HTTPException(status_code=500, detail="Failed to save minhash")
         
-        # The key is the user ID and the minhash ID
-        key = f"{item.user_id}_{minhash_id}"
-        
         # Insert it into the LSH
-        lsh.insert(key, minhash)
+        index_minhash(lsh, item.user_id, minhash_id, minhash)
 
         return SaveMinHashOutput(id=minhash_id)
     except Exception as e:
-        print(f"Failed to save minhash: {e}")
+        logger.error(f"Failed to save minhash: {e}")
         raise HTTPException(status_code=500, detail=f"Failed to save minhash")
 
 
+# Save a chunk of minhash entries with one insert and one LSH insertion session.
+# With `upsert`, each user keeps only its last entry of the chunk, and that
+# replaces everything stored for the user before.
+def save_minhash_batch(db: Session, lsh: MinHashLSH, items, upsert: bool = False) -> list:
+    results = [None] * len(items)
+
+    # Deserialize everything up front so one bad item doesn't fail the rest
+    valid = list()
+    for index, item in enumerate(items):
+        if isinstance(item, SaveMinHashBatchOutputOne):
+            results[index] = item
+            continue
+        try:
+            minhash = deserialize_minhash(item.minhash_data)
+            valid.append((index, item.user_id, minhash))
+        except Exception:
+            results[index] = SaveMinHashBatchOutputOne(error="Invalid minhash data")
+
+    if upsert:
+        last = {user_id: index for index, user_id, _ in valid}
+        for index, user_id, _ in valid:
+            if last[user_id] != index:
+                results[index] = SaveMinHashBatchOutputOne(error="Superseded by a later item for the same user")
+        valid = [entry for entry in valid if last[entry[1]] == entry[0]]
+
+    try:
+        # Insert the valid entries into the database and the LSH
+        entries = [(user_id, minhash) for _, user_id, minhash in valid]
+        if upsert:
+            ids, replaced = replace_user_minhashes(db, entries)
+            unindex_minhashes(lsh, replaced)
+        else:
+            ids = save_minhashes(db, entries)
+        index_minhashes(lsh, [
+            (minhash_id, user_id, minhash)
+            for minhash_id, (_, user_id, minhash) in zip(ids, valid)
+        ])
+        for minhash_id, (index, _, _) in zip(ids, valid):
+            results[index] = SaveMinHashBatchOutputOne(id=minhash_id)
+    except Exception as e:
+        logger.error(f"Failed to save minhash batch: {e}")
+        db.rollback()
+        for index, _, _ in valid:
+            results[index] = SaveMinHashBatchOutputOne(error="Failed to save minhash")
+
+    return results
+
+
+# Save many minhash entries at once
+@router.post("/batch", response_model=SaveMinHashBatchOutput)
+def save_minhashes_batch(
+    item: MinHashBatchInput,
+    upsert: bool = False,
+    api_key: str = Depends(get_api_key),
+    db: Session = Depends(get_db),
+    lsh: MinHashLSH = Depends(get_minhash_lsh)
+):
+    if len(item.items) > settings.MINHASH_BATCH_MAX_ITEMS:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"At most {settings.MINHASH_BATCH_MAX_ITEMS} items per batch"
+        )
+    return SaveMinHashBatchOutput(results=save_minhash_batch(db, lsh, item.items, upsert))
+
+
+# Save a stream of minhash entries, one `MinHashInput` JSON object per line
+@router.post("/batch/ndjson", response_model=SaveMinHashBatchOutput)
+async def save_minhashes_ndjson(
+    request: Request,
+    upsert: bool = False,
+    api_key: str = Depends(get_api_key),
+    db: Session = Depends(get_db),
+    lsh: MinHashLSH = Depends(get_minhash_lsh)
+):
+    results = list()
+    chunk = list()
+    buffer = b""
+
+    def parse_line(line: bytes):
+        try:
+            return MinHashInput(**json.loads(line))
+        except Exception:
+            return SaveMinHashBatchOutputOne(error="Invalid JSON line")
+
+    # Write every full chunk while the rest of the body is still arriving
+    async for data in request.stream():
+        buffer += data
+        *lines, buffer = buffer.split(b"\n")
+        for line in lines:
+            if line.strip():
+                chunk.append(parse_line(line))
+            if len(chunk) >= settings.MINHASH_BATCH_MAX_ITEMS:
+                results.extend(await run_in_threadpool(save_minhash_batch, db, lsh, chunk, upsert))
+                chunk = list()
+
+    if buffer.strip():
+        chunk.append(parse_line(buffer))
+    if chunk:
+        results.extend(await run_in_threadpool(save_minhash_batch, db, lsh, chunk, upsert))
+
+    return SaveMinHashBatchOutput(results=results)
+
+
+# Delete the entries in the database and the LSH, 404 if there were none
+def delete_and_unindex(db: Session, lsh: MinHashLSH, **filters) -> DeleteMinHashOutput:
+    try:
+        deleted = delete_minhashes(db, **filters)
+        unindex_minhashes(lsh, deleted)
+    except Exception as e:
+        logger.error(f"Failed to delete minhash: {e}")
+        db.rollback()
+        raise HTTPException(status_code=500, detail="Failed to delete minhash")
+    if not deleted:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Minhash not found")
+    return DeleteMinHashOutput(ids=sorted(minhash_id for minhash_id, _ in deleted))
+
+
+# Delete a minhash entry
+@router.delete("/{minhash_id}", response_model=DeleteMinHashOutput)
+def delete_minhash(
+    minhash_id: int,
+    api_key: str = Depends(get_api_key),
+    db: Session = Depends(get_db),
+    lsh: MinHashLSH = Depends(get_minhash_lsh)
+):
+    return delete_and_unindex(db, lsh, ids=[minhash_id])
+
+
+# Delete every minhash entry of a user
+@router.delete("/user/{user_id}", response_model=DeleteMinHashOutput)
+def delete_user_minhashes(
+    user_id: str,
+    api_key: str = Depends(get_api_key),
+    db: Session = Depends(get_db),
+    lsh: MinHashLSH = Depends(get_minhash_lsh)
+):
+    return delete_and_unindex(db, lsh, user_ids=[user_id])
+
+
 # Query for similar minhash entries
 @router.post("/query", response_model=QueryMinHashOutput)
 async def query_similar_minhashes(
     item: MinHashInput,
     api_key: str = Depends(get_api_key),
-    db: Session = Depends(get_db),
-    lsh: MinHashLSH = Depends(get_minhash_lsh)
+    db: AsyncSession = Depends(get_async_db),
+    lsh: MinHashLSH = Depends(get_minhash_lsh),
+    signatures: SignatureMatrix = Depends(get_minhash_signatures)
 ):
+    # Deserialize the minhash
+    minhash = parse_minhash_input(item)
+
     try:
-        # Deserialize the minhash
-        minhash = deserialize_minhash(item.minhash_data)
-        if not minhash:
-            raise HTTPException(status_code=400, detail="Invalid minhash data")
-        
-        # Get candidates
-        candidate_keys = lsh.query(minhash)
+        # Get candidates, off the event loop when the LSH lives in redis
+        candidate_keys = await query_lsh_async(lsh, minhash)
 
-        # For every candidate,
+        # Score every candidate against the signature matrix in one pass
         results = list()
-        for key in candidate_keys:
-            try:
-                # Split the key into user ID and minhash ID
-                user_id_str, id_str = key.split("_")
-
-                # Make sure the id is an integer
-                id = int(id_str)
-
-                # Get the minhash entry by its ID
-                db_minhash = get_minhash_by_id(db, id)
-
-                # See if we got something
-                if db_minhash:
-                    # Calculate the Jaccard similarity
-                    similarity = db_minhash.jaccard(minhash)
-
-                    # Add it to the list of candidates
-                    results.append(QueryMinHashOutputOne(
-                        id=id,
-                        user_id=user_id_str,
-                        minhash=serialize_minhash(db_minhash),
-                        similarity=similarity,
-                    ))
-            except Exception as e:
-                print(f"Failed to query minhash: {e}")
+        for id, user_id_str, similarity in await score_candidates_async(db, minhash, candidate_keys, signatures):
+            signature = serialize_stored_signature(signatures, id)
+            if signature is None:
                 continue
+
+            # Add it to the list of candidates
+            results.append(QueryMinHashOutputOne(
+                id=id,
+                user_id=user_id_str,
+                minhash=signature,
+                similarity=similarity,
+            ))
         
         return QueryMinHashOutput(candidates=results)
     except Exception as e:
-        print(f"Failed to query minhash: {e}")
+        logger.error(f"Failed to query minhash: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to query minhash")
+
+
+# Query for similar minhash entries of many minhashes at once
+@router.post("/query/batch", response_model=QueryMinHashBatchOutput)
+def query_similar_minhashes_batch(
+    item: MinHashBatchInput,
+    api_key: str = Depends(get_api_key),
+    db: Session = Depends(get_db),
+    lsh: MinHashLSH = Depends(get_minhash_lsh),
+    signatures: SignatureMatrix = Depends(get_minhash_signatures)
+):
+    if len(item.items) > settings.MINHASH_BATCH_MAX_ITEMS:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"At most {settings.MINHASH_BATCH_MAX_ITEMS} items per batch"
+        )
+
+    try:
+        # Deserialize everything and collect the candidates of every query
+        minhashes, candidate_keys_list, errors = list(), list(), dict()
+        for index, query in enumerate(item.items):
+            try:
+                minhash = deserialize_minhash(query.minhash_data)
+            except Exception:
+                errors[index] = "Invalid minhash data"
+                continue
+            minhashes.append(minhash)
+            candidate_keys_list.append(lsh.query(minhash))
+
+        scored = iter(score_candidates_batch(db, minhashes, candidate_keys_list, signatures))
+
+        # Serialize every distinct candidate signature once for the whole batch
+        serialized = dict()
+        results = list()
+        for index in range(len(item.items)):
+            if index in errors:
+                results.append(QueryMinHashBatchOutputOne(candidates=[], error=errors[index]))
+                continue
+            candidates = list()
+            for id, user_id_str, similarity in next(scored):
+                if id not in serialized:
+                    serialized[id] = serialize_stored_signature(signatures, id)
+                if serialized[id] is None:
+                    continue
+                candidates.append(QueryMinHashOutputOne(
+                    id=id,
+                    user_id=user_id_str,
+                    minhash=serialized[id],
+                    similarity=similarity,
+                ))
+            results.append(QueryMinHashBatchOutputOne(candidates=candidates))
+
+        return QueryMinHashBatchOutput(results=results)
+    except Exception as e:
+        logger.error(f"Failed to query minhash batch: {e}")
+        raise HTTPException(status_code=500, detail=f"Failed to query minhash")
+
+
+# Query for the most similar minhash entries, best first
+@router.post("/query/top", response_model=QueryMinHashOutput, response_model_exclude_none=True)
+async def query_top_minhashes(
+    item: QueryTopMinHashInput,
+    api_key: str = Depends(get_api_key),
+    db: AsyncSession = Depends(get_async_db),
+    lsh: MinHashLSH = Depends(get_minhash_lsh),
+    forest: ForestIndex = Depends(get_minhash_forest),
+    signatures: SignatureMatrix = Depends(get_minhash_signatures)
+):
+    # Deserialize the minhash
+    minhash = parse_minhash_input(item)
+
+    try:
+        results = list()
+        for id, user_id_str, similarity in await query_top_k_async(db, lsh, forest, signatures, minhash, item.k, item.min_similarity):
+            # Only pay for serializing signatures when they were asked for
+            signature = None
+            if item.include_signatures:
+                signature = serialize_stored_signature(signatures, id)
+                if signature is None:
+                    continue
+
+            results.append(QueryMinHashOutputOne(
+                id=id,
+                user_id=user_id_str,
+                minhash=signature,
+                similarity=similarity,
+            ))
+
+        return QueryMinHashOutput(candidates=results)
+    except Exception as e:
+        logger.error(f"Failed to query top minhashes: {e}")
         raise HTTPException(status_code=500, detail=f"Failed to query minhash")
@@ -1,64 +1,212 @@
 from fastapi import APIRouter, Depends, HTTPException, Query, status
 from fastapi.responses import FileResponse
-from starlette.background import BackgroundTasks
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from typing import List
 import hashlib
+import logging
 import os
 
-from app.schemas.proof import GenerateProofInput, GenerateProofOutput, GetProofOutput
+from app.schemas.proof import GenerateProofInput, GenerateProofOutput, GetProofOutput, ProofJobOutput
+from app.schemas.proof import ProofLookupInput, ProofLookupOutput
 from app.db.models.proof import Proof
-from app.services.proof import get_proof_by_proof_key, create_proof
-from app.api.deps import get_db, get_api_key
+from app.services.proof import get_proof_by_proof_key, get_data_hashes_by_proof_keys, create_proof
+from app.services.proof_jobs import get_proof_jobs, QueueFullError, JOB_DONE, JOB_FAILED
+from app.services.admission import admit_export, ExportTooLargeError, MemoryBudgetExceededError
+from app.services.order_history import new_order_history_signer, save_export_signature
+from app.api.deps import get_async_db, get_api_key, get_optional_api_key
 from app.utils.misc import is_valid_amazon_link, download_and_modify_zip
+from app.core.config import settings
 
+logger = logging.getLogger(__name__)
 
 router = APIRouter()
 
 @router.get("/{proof_key}", response_model=GetProofOutput)
-def get_proof(
+async def get_proof(
     proof_key: str,
     api_key: str = Depends(get_api_key),
-    db: Session = Depends(get_db)
+    db: AsyncSession = Depends(get_async_db)
 ):
-    proof = get_proof_by_proof_key(db, proof_key=proof_key)
+    proof = await get_proof_by_proof_key(db, proof_key=proof_key)
     if not proof:
         raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Proof not found")
     return GetProofOutput(proof_key=proof_key, data_hash=proof.data_hash)
 
-def remove_file(path: str) -> None:
-    os.unlink(path)
-    print("Deleted temp file:", path)
-    
+# Look up many proofs at once
+@router.post("/lookup", response_model=ProofLookupOutput)
+async def lookup_proofs(
+    item: ProofLookupInput,
+    api_key: str = Depends(get_api_key),
+    db: AsyncSession = Depends(get_async_db)
+):
+    if len(item.proof_keys) > settings.PROOF_LOOKUP_MAX_KEYS:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"At most {settings.PROOF_LOOKUP_MAX_KEYS} proof keys per lookup"
+        )
+
+    data_hashes = await get_data_hashes_by_proof_keys(db, item.proof_keys)
+    return ProofLookupOutput(
+        proofs=[GetProofOutput(proof_key=key, data_hash=data_hash) for key, data_hash in data_hashes.items()],
+        missing=[key for key in dict.fromkeys(item.proof_keys) if key not in data_hashes],
+    )
+
+def remove_file(path: str, admission=None) -> None:
+    try:
+        os.unlink(path)
+        logger.debug(f"Deleted temp file: {path}")
+    finally:
+        if admission is not None:
+            admission.release()
+
+class TempFileResponse(FileResponse):
+    """Sends a redacted export, then deletes it and releases its admission.
+
+    Unlike a background task, this also runs when the client disconnects
+    halfway through the body.
+    """
+    def __init__(self, path: str, admission=None, **kwargs):
+        super().__init__(path, **kwargs)
+        self.admission = admission
+
+    async def __call__(self, scope, receive, send):
+        try:
+            await super().__call__(scope, receive, send)
+        finally:
+            remove_file(self.path, self.admission)
+
+# Check the size of the export before downloading anything
+async def admit_or_reject(link: str):
+    try:
+        return await admit_export(link)
+    except ExportTooLargeError as e:
+        raise HTTPException(status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE, detail=str(e))
+    except MemoryBudgetExceededError as e:
+        raise HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error probing the export: {e}")
+        raise HTTPException(status_code=400, detail="Failed to download or hash data.")
+
+# Anyone can generate a proof, but saving an order history under a user ID
+# writes to the MinHash tables and the LSH, so it takes the API key
+def check_user_id_allowed(item: GenerateProofInput, api_key) -> None:
+    if item.user_id is not None and api_key is None:
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="An API key is required to save the order history of a user_id"
+        )
+
 @router.post("/")
 async def generate_proof(
     item: GenerateProofInput,
-    background_tasks: BackgroundTasks,
-    db: Session = Depends(get_db),
+    api_key: str = Depends(get_optional_api_key),
+    db: AsyncSession = Depends(get_async_db),
 ):
-    print("Amazon link to generate proof:", item.link)
+    check_user_id_allowed(item, api_key)
+    logger.info(f"Amazon link to generate proof: {item.link}")
     if not is_valid_amazon_link(item.link):
         raise HTTPException(status_code=400, detail="Invalid Amazon link")
 
     proof_key = hashlib.sha3_256(item.link.encode('utf-8')).hexdigest()
-    proof = get_proof_by_proof_key(db, proof_key=proof_key)
+    proof = await get_proof_by_proof_key(db, proof_key=proof_key)
     if proof:
         raise HTTPException(status_code=400, detail="The proof already generated")
     
-    data_hash, output_filepath = await download_and_modify_zip(item.link)
-    print("Data hash:", data_hash)
-    if data_hash is None:
+    admission = await admit_or_reject(item.link)
+    signer = new_order_history_signer() if item.user_id else None
+    result = await download_and_modify_zip(item.link, admission, signer)
+    if result is None:
+        admission.release()
         raise HTTPException(status_code=400, detail="Failed to download or hash data.")
+    data_hash, output_filepath = result
+    admission.hold_output(output_filepath)
+    logger.info(f"Data hash: {data_hash}")
 
-    print("Proof key:", proof_key)
-    create_proof(db, Proof(proof_key=proof_key, data_hash=data_hash))
+    logger.info(f"Proof key: {proof_key}")
+    try:
+        await create_proof(db, Proof(proof_key=proof_key, data_hash=data_hash))
+    except Exception:
+        remove_file(output_filepath, admission)
+        raise
 
     headers = {
         "X-Proof-Key": proof_key,
         "X-Link": item.link,
         "Access-Control-Expose-Headers": "X-Proof-Key, X-Link",
     }
+    minhash_id = await save_export_signature(item.user_id, signer) if signer is not None else None
+    if minhash_id is not None:
+        headers["X-Minhash-Id"] = str(minhash_id)
+        headers["Access-Control-Expose-Headers"] += ", X-Minhash-Id"
 
-    background_tasks.add_task(remove_file, output_filepath)
+    response = TempFileResponse(output_filepath, admission, headers=headers, media_type="application/zip")
+    response.chunk_size = settings.IO_BUFFER_SIZE
+    return response
 
-    return FileResponse(output_filepath, headers=headers, media_type="application/zip")
+def job_output(job) -> ProofJobOutput:
+    return ProofJobOutput(
+        job_id=job.job_id,
+        proof_key=job.proof_key,
+        status=job.status,
+        data_hash=job.data_hash,
+        minhash_id=job.minhash_id,
+        error=job.error,
+    )
+
+@router.post("/jobs", response_model=ProofJobOutput, status_code=status.HTTP_202_ACCEPTED)
+async def submit_proof_job(
+    item: GenerateProofInput,
+    api_key: str = Depends(get_optional_api_key),
+    db: AsyncSession = Depends(get_async_db),
+):
+    check_user_id_allowed(item, api_key)
+    logger.info(f"Amazon link to generate proof: {item.link}")
+    if not is_valid_amazon_link(item.link):
+        raise HTTPException(status_code=400, detail="Invalid Amazon link")
+
+    proof_key = hashlib.sha3_256(item.link.encode('utf-8')).hexdigest()
+    proof_jobs = get_proof_jobs()
+    # A proof key being generated right now isn't in the table yet
+    if not proof_jobs.in_flight(proof_key) and await get_proof_by_proof_key(db, proof_key=proof_key):
+        raise HTTPException(status_code=400, detail="The proof already generated")
+
+    if proof_jobs.in_flight(proof_key):
+        return job_output(proof_jobs.submit(proof_key, item.link))
+
+    admission = await admit_or_reject(item.link)
+    try:
+        job = proof_jobs.submit(proof_key, item.link, admission, item.user_id)
+    except QueueFullError as e:
+        admission.release()
+        raise HTTPException(status_code=status.HTTP_429_TOO_MANY_REQUESTS, detail=str(e))
+    # Submitted by someone else while the export was probed
+    if job.admission is not admission:
+        admission.release()
+    return job_output(job)
+
+def get_job_or_404(job_id: str):
+    job = get_proof_jobs().get(job_id)
+    if not job:
+        raise HTTPException(status_code=status.HTTP_404_NOT_FOUND, detail="Job not found")
+    return job
+
+@router.get("/jobs/{job_id}", response_model=ProofJobOutput, response_model_exclude_none=True)
+def get_proof_job(job_id: str):
+    return job_output(get_job_or_404(job_id))
+
+@router.get("/jobs/{job_id}/result")
+def get_proof_job_result(job_id: str):
+    job = get_job_or_404(job_id)
+    if job.status == JOB_FAILED:
+        raise HTTPException(status_code=400, detail=job.error)
+    if job.status != JOB_DONE or not job.file_path:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=f"Job is {job.status}")
+
+    headers = {
+        "X-Proof-Key": job.proof_key,
+        "X-Link": job.link,
+        "Access-Control-Expose-Headers": "X-Proof-Key, X-Link",
+    }
+    response = FileResponse(job.file_path, headers=headers, media_type="application/zip")
+    response.chunk_size = settings.IO_BUFFER_SIZE
+    return response
@@ -6,22 +6,136 @@ import os
 
 class Settings(BaseModel):
     API_KEY: str
+    API_WORKERS: int
+    LOG_LEVEL: str
     GMAPS_API_KEY: str
     POSTGRES_USER: str
     POSTGRES_PASSWORD: str
     POSTGRES_DB: str
     MINHASH_LSH_THRESHOLD: float
     MINHASH_NUM_PERM: int
+    MINHASH_LSH_SNAPSHOT_PATH: str
+    MINHASH_LSH_LOAD_BATCH_SIZE: int
+    MINHASH_LSH_STORAGE_CONFIG: str
+    MINHASH_LSH_REFRESH_INTERVAL: float
+    MINHASH_TTL: int
+    MINHASH_COMPACTION_INTERVAL: float
+    MINHASH_BATCH_MAX_ITEMS: int
+    MINHASH_FOREST_ENABLED: bool
+    MINHASH_FOREST_L: int
+    MINHASH_TOPK_OVERSAMPLE: int
+    MINHASH_SHINGLE_WORDS: int
+    MINHASH_HASH_BATCH_SIZE: int
+    CSV_CHUNK_ROWS: int
+    ZIP_COMPRESSLEVEL: int
+    IO_BUFFER_SIZE: int
+    DOWNLOAD_PART_SIZE: int
+    DOWNLOAD_CONCURRENCY: int
+    DOWNLOAD_MAX_RETRIES: int
+    PROOF_MAX_EXPORT_SIZE: int
+    PROOF_MEMORY_BUDGET: int
+    PROOF_WORKING_MEMORY: int
+    SPILL_DIR: str
+    SPILL_THRESHOLD: int
+    GEOCODE_CACHE_SIZE: int
+    GEOCODE_CACHE_TTL: int
+    GEOCODE_CACHE_KEY: str
+    GEOCODE_API_URL: str
+    GEOCODE_MAX_CONCURRENCY: int
+    GEOCODE_RATE_LIMIT: float
+    GEOCODE_RATE_BURST: int
+    GEOCODE_MAX_RETRIES: int
+    GEOCODE_RETRY_BACKOFF: float
+    GEOCODE_TIMEOUT: float
+    WORKER_POOL_KIND: str
+    WORKER_POOL_SIZE: int
+    PROOF_JOB_WORKERS: int
+    PROOF_JOB_QUEUE_SIZE: int
+    PROOF_JOB_RESULT_TTL: int
+    PROOF_JOB_PRUNE_INTERVAL: float
+    DB_POOL_SIZE: int
+    DB_MAX_OVERFLOW: int
+    DB_POOL_PRE_PING: bool
+    DB_POOL_RECYCLE: int
+    DB_PREPARED_STATEMENT_CACHE_SIZE: int
+    DB_MIGRATE_ON_STARTUP: bool
+    PROOF_CACHE_SIZE: int
+    PROOF_NEGATIVE_CACHE_TTL: float
+    PROOF_LOOKUP_MAX_KEYS: int
+    PROOF_LOG_BUFFER_SIZE: int
+    PROOF_LOG_BUFFER_BYTES: int
+    PROOF_LOG_MAX_ENTRY_BYTES: int
+    PROOF_LOG_BATCH_SIZE: int
+    PROOF_LOG_FLUSH_INTERVAL: float
+    PROOF_LOG_COMPRESS_MIN_BYTES: int
+    PROOF_LOG_PAGE_MAX_SIZE: int
 
 
 load_dotenv()
 
 settings = Settings(
     API_KEY=os.getenv("API_KEY"),
+    API_WORKERS=int(os.getenv("API_WORKERS", "1")),
+    LOG_LEVEL=os.getenv("LOG_LEVEL", "WARNING"),
     GMAPS_API_KEY=os.getenv("GMAPS_API_KEY"),
     POSTGRES_USER=os.getenv("POSTGRES_USER"),
     POSTGRES_PASSWORD=os.getenv("POSTGRES_PASSWORD"),
     POSTGRES_DB=os.getenv("POSTGRES_DB"),
     MINHASH_LSH_THRESHOLD=float(os.getenv("MINHASH_LSH_THRESHOLD", "0.7")),
     MINHASH_NUM_PERM=int(os.getenv("MINHASH_NUM_PERM", "128")),
+    MINHASH_LSH_SNAPSHOT_PATH=os.getenv("MINHASH_LSH_SNAPSHOT_PATH", ""),
+    MINHASH_LSH_LOAD_BATCH_SIZE=int(os.getenv("MINHASH_LSH_LOAD_BATCH_SIZE", "10000")),
+    MINHASH_LSH_STORAGE_CONFIG=os.getenv("MINHASH_LSH_STORAGE_CONFIG", ""),
+    MINHASH_LSH_REFRESH_INTERVAL=float(os.getenv("MINHASH_LSH_REFRESH_INTERVAL", "5")),
+    MINHASH_TTL=int(os.getenv("MINHASH_TTL", "0")),
+    MINHASH_COMPACTION_INTERVAL=float(os.getenv("MINHASH_COMPACTION_INTERVAL", "3600")),
+    MINHASH_BATCH_MAX_ITEMS=int(os.getenv("MINHASH_BATCH_MAX_ITEMS", "5000")),
+    MINHASH_FOREST_ENABLED=os.getenv("MINHASH_FOREST_ENABLED", "1") == "1",
+    MINHASH_FOREST_L=int(os.getenv("MINHASH_FOREST_L", "8")),
+    MINHASH_TOPK_OVERSAMPLE=int(os.getenv("MINHASH_TOPK_OVERSAMPLE", "4")),
+    MINHASH_SHINGLE_WORDS=int(os.getenv("MINHASH_SHINGLE_WORDS", "3")),
+    MINHASH_HASH_BATCH_SIZE=int(os.getenv("MINHASH_HASH_BATCH_SIZE", "4096")),
+    CSV_CHUNK_ROWS=int(os.getenv("CSV_CHUNK_ROWS", "20000")),
+    ZIP_COMPRESSLEVEL=int(os.getenv("ZIP_COMPRESSLEVEL", "6")),
+    IO_BUFFER_SIZE=int(os.getenv("IO_BUFFER_SIZE", str(1024 * 1024))),
+    DOWNLOAD_PART_SIZE=int(os.getenv("DOWNLOAD_PART_SIZE", str(16 * 1024 * 1024))),
+    DOWNLOAD_CONCURRENCY=int(os.getenv("DOWNLOAD_CONCURRENCY", "8")),
+    DOWNLOAD_MAX_RETRIES=int(os.getenv("DOWNLOAD_MAX_RETRIES", "3")),
+    PROOF_MAX_EXPORT_SIZE=int(os.getenv("PROOF_MAX_EXPORT_SIZE", str(16 * 1024 ** 3))),
+    PROOF_MEMORY_BUDGET=int(os.getenv("PROOF_MEMORY_BUDGET", str(40 * 1024 ** 3))),
+    PROOF_WORKING_MEMORY=int(os.getenv("PROOF_WORKING_MEMORY", str(512 * 1024 ** 2))),
+    SPILL_DIR=os.getenv("SPILL_DIR", ""),
+    SPILL_THRESHOLD=int(os.getenv("SPILL_THRESHOLD", str(256 * 1024 ** 2))),
+    GEOCODE_CACHE_SIZE=int(os.getenv("GEOCODE_CACHE_SIZE", "100000")),
+    GEOCODE_CACHE_TTL=int(os.getenv("GEOCODE_CACHE_TTL", str(30 * 24 * 3600))),
+    GEOCODE_CACHE_KEY=os.getenv("GEOCODE_CACHE_KEY", ""),
+    GEOCODE_API_URL=os.getenv("GEOCODE_API_URL", "https://maps.googleapis.com/maps/api/geocode/json"),
+    GEOCODE_MAX_CONCURRENCY=int(os.getenv("GEOCODE_MAX_CONCURRENCY", "10")),
+    GEOCODE_RATE_LIMIT=float(os.getenv("GEOCODE_RATE_LIMIT", "40")),
+    GEOCODE_RATE_BURST=int(os.getenv("GEOCODE_RATE_BURST", "40")),
+    GEOCODE_MAX_RETRIES=int(os.getenv("GEOCODE_MAX_RETRIES", "3")),
+    GEOCODE_RETRY_BACKOFF=float(os.getenv("GEOCODE_RETRY_BACKOFF", "0.5")),
+    GEOCODE_TIMEOUT=float(os.getenv("GEOCODE_TIMEOUT", "10")),
+    WORKER_POOL_KIND=os.getenv("WORKER_POOL_KIND", "thread"),
+    WORKER_POOL_SIZE=int(os.getenv("WORKER_POOL_SIZE", "0")),
+    PROOF_JOB_WORKERS=int(os.getenv("PROOF_JOB_WORKERS", "2")),
+    PROOF_JOB_QUEUE_SIZE=int(os.getenv("PROOF_JOB_QUEUE_SIZE", "16")),
+    PROOF_JOB_RESULT_TTL=int(os.getenv("PROOF_JOB_RESULT_TTL", "3600")),
+    PROOF_JOB_PRUNE_INTERVAL=float(os.getenv("PROOF_JOB_PRUNE_INTERVAL", "60")),
+    DB_POOL_SIZE=int(os.getenv("DB_POOL_SIZE", "10")),
+    DB_MAX_OVERFLOW=int(os.getenv("DB_MAX_OVERFLOW", "20")),
+    DB_POOL_PRE_PING=os.getenv("DB_POOL_PRE_PING", "1") == "1",
+    DB_POOL_RECYCLE=int(os.getenv("DB_POOL_RECYCLE", "1800")),
+    DB_PREPARED_STATEMENT_CACHE_SIZE=int(os.getenv("DB_PREPARED_STATEMENT_CACHE_SIZE", "500")),
+    DB_MIGRATE_ON_STARTUP=os.getenv("DB_MIGRATE_ON_STARTUP", "1") == "1",
+    PROOF_CACHE_SIZE=int(os.getenv("PROOF_CACHE_SIZE", "100000")),
+    PROOF_NEGATIVE_CACHE_TTL=float(os.getenv("PROOF_NEGATIVE_CACHE_TTL", "5")),
+    PROOF_LOOKUP_MAX_KEYS=int(os.getenv("PROOF_LOOKUP_MAX_KEYS", "10000")),
+    PROOF_LOG_BUFFER_SIZE=int(os.getenv("PROOF_LOG_BUFFER_SIZE", "10000")),
+    PROOF_LOG_BUFFER_BYTES=int(os.getenv("PROOF_LOG_BUFFER_BYTES", str(64 * 1024 ** 2))),
+    PROOF_LOG_MAX_ENTRY_BYTES=int(os.getenv("PROOF_LOG_MAX_ENTRY_BYTES", str(1024 ** 2))),
+    PROOF_LOG_BATCH_SIZE=int(os.getenv("PROOF_LOG_BATCH_SIZE", "500")),
+    PROOF_LOG_FLUSH_INTERVAL=float(os.getenv("PROOF_LOG_FLUSH_INTERVAL", "1.0")),
+    PROOF_LOG_COMPRESS_MIN_BYTES=int(os.getenv("PROOF_LOG_COMPRESS_MIN_BYTES", "4096")),
+    PROOF_LOG_PAGE_MAX_SIZE=int(os.getenv("PROOF_LOG_PAGE_MAX_SIZE", "1000")),
 )
@@ -0,0 +1,127 @@
+# app/db/migrate.py
+from sqlalchemy import inspect, text, BigInteger, Integer, LargeBinary, DateTime
+from sqlalchemy.engine import Engine
+from app.utils.minhash import deserialize_minhash, minhash_to_columns
+from app.db.base import Base
+from app.db.models.minhash import utcnow
+# Every model, so `create_all` knows every table
+from app.db.models import geocode_cache, minhash, order_history, proof, proof_log
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Move `minhashes` from the indexed JSON `minhash_data` column to raw binary columns
+def migrate_minhash_storage(engine: Engine, batch_size: int = 1000) -> None:
+    inspector = inspect(engine)
+    if not inspector.has_table("minhashes"):
+        return
+    columns = {column["name"] for column in inspector.get_columns("minhashes")}
+    if "minhash_data" not in columns:
+        return
+
+    logger.info("Migrating minhashes to binary storage")
+    dialect = engine.dialect
+    with engine.begin() as conn:
+        # The B-tree over the JSON blobs was never used for lookups
+        conn.execute(text("DROP INDEX IF EXISTS ix_minhashes_minhash_data"))
+        for name, type_ in (("seed", BigInteger()), ("num_perm", Integer()), ("hashvalues", LargeBinary())):
+            if name not in columns:
+                conn.execute(text(f"ALTER TABLE minhashes ADD COLUMN {name} {type_.compile(dialect=dialect)}"))
+
+    # Convert the existing rows in batches, each in its own transaction
+    last_id = 0
+    while True:
+        with engine.begin() as conn:
+            rows = conn.execute(
+                text(
+                    "SELECT id, minhash_data FROM minhashes "
+                    "WHERE id > :last_id AND hashvalues IS NULL ORDER BY id LIMIT :limit"
+                ),
+                {"last_id": last_id, "limit": batch_size},
+            ).all()
+            if not rows:
+                break
+            conn.execute(
+                text("UPDATE minhashes SET seed = :seed, num_perm = :num_perm, hashvalues = :hashvalues WHERE id = :id"),
+                [{"id": row.id, **minhash_to_columns(deserialize_minhash(row.minhash_data))} for row in rows],
+            )
+            last_id = rows[-1].id
+
+    with engine.begin() as conn:
+        conn.execute(text("ALTER TABLE minhashes DROP COLUMN minhash_data"))
+        if dialect.name == "postgresql":
+            conn.execute(text(
+                "ALTER TABLE minhashes "
+                "ALTER COLUMN seed SET NOT NULL, "
+                "ALTER COLUMN num_perm SET NOT NULL, "
+                "ALTER COLUMN hashvalues SET NOT NULL"
+            ))
+    logger.info("Migrated minhashes to binary storage")
+
+# Add `minhashes.created_at`, counting existing entries as saved now
+def migrate_minhash_created_at(engine: Engine) -> None:
+    inspector = inspect(engine)
+    if not inspector.has_table("minhashes"):
+        return
+    if "created_at" in {column["name"] for column in inspector.get_columns("minhashes")}:
+        return
+
+    logger.info("Adding minhashes.created_at")
+    dialect = engine.dialect
+    with engine.begin() as conn:
+        conn.execute(text(f"ALTER TABLE minhashes ADD COLUMN created_at {DateTime().compile(dialect=dialect)}"))
+        conn.execute(text("UPDATE minhashes SET created_at = :now"), {"now": utcnow()})
+        conn.execute(text("CREATE INDEX IF NOT EXISTS ix_minhashes_created_at ON minhashes (created_at)"))
+        if dialect.name == "postgresql":
+            conn.execute(text("ALTER TABLE minhashes ALTER COLUMN created_at SET NOT NULL"))
+
+# Replace a `geocode_cache` keyed by plaintext addresses with one keyed by their
+# digests. It is only a cache, so the old rows are dropped rather than converted.
+def migrate_geocode_cache_digests(engine: Engine) -> None:
+    inspector = inspect(engine)
+    if not inspector.has_table("geocode_cache"):
+        return
+    if "address_key" not in {column["name"] for column in inspector.get_columns("geocode_cache")}:
+        return
+
+    logger.info("Replacing the plaintext geocode cache")
+    with engine.begin() as conn:
+        conn.execute(text("DROP TABLE geocode_cache"))
+    geocode_cache.GeocodeCache.__table__.create(bind=engine)
+
+# Point `order_history` at the signature in `minhashes` instead of keeping an
+# indexed JSON copy of it. Entries written before have no signature to point at.
+def migrate_order_history_minhash_id(engine: Engine) -> None:
+    inspector = inspect(engine)
+    if not inspector.has_table("order_history"):
+        return
+    columns = {column["name"] for column in inspector.get_columns("order_history")}
+    if "minhash" not in columns:
+        return
+
+    logger.info("Replacing order_history.minhash with minhash_id")
+    with engine.begin() as conn:
+        conn.execute(text("DROP INDEX IF EXISTS ix_order_history_minhash"))
+        if "minhash_id" not in columns:
+            conn.execute(text(
+                "ALTER TABLE order_history ADD COLUMN minhash_id INTEGER "
+                "REFERENCES minhashes (id) ON DELETE CASCADE"
+            ))
+        conn.execute(text("CREATE INDEX IF NOT EXISTS ix_order_history_minhash_id ON order_history (minhash_id)"))
+        conn.execute(text("ALTER TABLE order_history DROP COLUMN minhash"))
+
+# Bring an existing database up to the current models
+def run_migrations(engine: Engine) -> None:
+    migrate_minhash_storage(engine)
+    migrate_minhash_created_at(engine)
+    migrate_geocode_cache_digests(engine)
+    migrate_order_history_minhash_id(engine)
+
+# Create missing tables, then migrate the existing ones
+def init_db(engine: Engine) -> None:
+    Base.metadata.create_all(bind=engine)
+    run_migrations(engine)
+
+if __name__ == "__main__":
+    from app.db.session import engine
+    init_db(engine)
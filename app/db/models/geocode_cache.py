@@ -0,0 +1,11 @@
+from sqlalchemy import Column, String, DateTime
+from app.db.base import Base
+
+class GeocodeCache(Base):
+    __tablename__ = "geocode_cache"
+
+    # HMAC-SHA256 hex digest of the normalized address, the address itself never leaves the enclave
+    address_digest = Column(String(64), primary_key=True)
+    postal_code = Column(String, nullable=False)
+    # UTC time the postal code was fetched, for expiring it
+    updated_at = Column(DateTime, nullable=False, index=True)
@@ -1,9 +1,20 @@
-from sqlalchemy import Column, Integer, String
+from sqlalchemy import Column, Integer, BigInteger, String, LargeBinary, DateTime
+from datetime import datetime, timezone
 from app.db.base import Base
 
+def utcnow() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
 class MinHash(Base):
     __tablename__ = "minhashes"
+    # LSH keys embed the ID, so IDs must never be reused (SQLite would otherwise)
+    __table_args__ = {"sqlite_autoincrement": True}
 
     id = Column(Integer, primary_key=True, index=True, autoincrement=True)
     user_id = Column(String, index=True)
-    minhash_data = Column(String, index=True)
+    seed = Column(BigInteger, nullable=False)
+    num_perm = Column(Integer, nullable=False)
+    # Raw little-endian uint64 hash values, never looked up by content
+    hashvalues = Column(LargeBinary, nullable=False)
+    # UTC time the entry was saved, for expiring it
+    created_at = Column(DateTime, nullable=False, default=utcnow, index=True)
@@ -1,4 +1,4 @@
-from sqlalchemy import Column, String, Integer
+from sqlalchemy import Column, String, Integer, ForeignKey
 from app.db.base import Base
 
 class OrderHistory(Base):
@@ -6,4 +6,5 @@ class OrderHistory(Base):
 
     id=Column(Integer, autoincrement=True, primary_key=True, index=True)
     user_id = Column(String, index=True)
-    minhash = Column(String, index=True)
+    # The signature of the order history, stored once in `minhashes`
+    minhash_id = Column(Integer, ForeignKey("minhashes.id", ondelete="CASCADE"), index=True)
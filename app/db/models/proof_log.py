@@ -0,0 +1,19 @@
+from sqlalchemy import Column, Integer, String, LargeBinary, Boolean, DateTime, Index
+from app.db.base import Base
+from app.db.models.minhash import utcnow
+
+class ProofLog(Base):
+    __tablename__ = "proof_logs"
+    # Pages are read by proof key in ID order, from this index alone
+    __table_args__ = (
+        Index("ix_proof_logs_proof_key_id", "proof_key", "id"),
+        {"sqlite_autoincrement": True},
+    )
+
+    id = Column(Integer, primary_key=True, autoincrement=True)
+    proof_key = Column(String, nullable=False)
+    # UTF-8 log content, zlib-compressed when `compressed` is set
+    content = Column(LargeBinary, nullable=False)
+    compressed = Column(Boolean, nullable=False, default=False)
+    # UTC time the entry was received
+    created_at = Column(DateTime, nullable=False, default=utcnow)
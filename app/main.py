@@ -1,13 +1,76 @@
 from fastapi import FastAPI, HTTPException, Query, Security, Depends
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.security.api_key import APIKeyHeader
-from app.api.endpoints import proof, minhash, log
-from app.db.session import engine
-from app.db.base import Base
+from app.api.endpoints import proof, minhash, log, metrics
+from app.db.session import engine, async_engine, SessionLocal
+from app.db.migrate import init_db
+from app.services.minhash import warm_start_lsh, snapshot_shared_lsh, refresh_shared_index, lsh_storage_shared
+from app.services.minhash import run_compaction
+from app.core.config import settings
+from app.utils.geocoder import close_geocoder
+from app.utils.download import close_downloader
+from app.utils.workers import shutdown_executor
+from app.services.proof_jobs import stop_proof_jobs, prune_proof_jobs_periodically
+from app.services.proof_logs import stop_proof_log_buffer
+from contextlib import asynccontextmanager
+import asyncio
+import logging
+import os
 
-Base.metadata.create_all(bind=engine)
+logging.basicConfig(level=settings.LOG_LEVEL, format="%(asctime)s %(levelname)s %(name)s: %(message)s")
+logger = logging.getLogger(__name__)
 
-app = FastAPI()
+def with_session(fn) -> None:
+    db = SessionLocal()
+    try:
+        fn(db)
+    finally:
+        db.close()
+
+# Run `fn(db)` in a thread every `interval` seconds until cancelled
+async def run_periodically(fn, interval: float) -> None:
+    while True:
+        await asyncio.sleep(interval)
+        try:
+            await asyncio.to_thread(with_session, fn)
+        except Exception as e:
+            logger.error(f"Failed to run {fn.__name__}: {e}")
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Off when the schema is set up once before the workers start
+    if settings.DB_MIGRATE_ON_STARTUP:
+        init_db(engine)
+
+    # Rebuild the LSH index before serving any query
+    db = SessionLocal()
+    try:
+        warm_start_lsh(db)
+    finally:
+        db.close()
+
+    tasks = list()
+    # Keep this worker's signatures and forest in step with the other workers
+    if lsh_storage_shared():
+        tasks.append(asyncio.create_task(run_periodically(refresh_shared_index, settings.MINHASH_LSH_REFRESH_INTERVAL)))
+    if settings.MINHASH_COMPACTION_INTERVAL > 0:
+        tasks.append(asyncio.create_task(run_periodically(run_compaction, settings.MINHASH_COMPACTION_INTERVAL)))
+    if settings.PROOF_JOB_PRUNE_INTERVAL > 0:
+        tasks.append(asyncio.create_task(prune_proof_jobs_periodically(settings.PROOF_JOB_PRUNE_INTERVAL)))
+
+    yield
+
+    for task in tasks:
+        task.cancel()
+    await stop_proof_jobs()
+    await stop_proof_log_buffer()
+    snapshot_shared_lsh()
+    await close_geocoder()
+    await close_downloader()
+    shutdown_executor()
+    await async_engine.dispose()
+
+app = FastAPI(lifespan=lifespan)
 
 app.add_middleware(
     CORSMiddleware,
@@ -20,11 +83,20 @@ app.add_middleware(
 app.include_router(proof.router, prefix="/api/proof", tags=["proof"])
 app.include_router(minhash.router, prefix="/api/minhash", tags=["minhash"])
 app.include_router(log.router, prefix="/api/log", tags=["log"])
+app.include_router(metrics.router, prefix="/metrics", tags=["metrics"])
 
 if __name__ == "__main__":
     import uvicorn
+    if settings.API_WORKERS > 1 and not lsh_storage_shared():
+        raise SystemExit("API_WORKERS > 1 requires MINHASH_LSH_STORAGE_CONFIG, each worker would hold a partial index")
+    if settings.API_WORKERS > 1:
+        # Set up the schema once here rather than racing in every worker
+        init_db(engine)
+        os.environ["DB_MIGRATE_ON_STARTUP"] = "0"
     uvicorn.run(
-        app, 
+        # Workers import the app themselves, after this process has set up the database
+        "app.main:app" if settings.API_WORKERS > 1 else app,
+        workers=settings.API_WORKERS,
         host="0.0.0.0",
         port=8888,
         forwarded_allow_ips="*",
@@ -1,7 +1,19 @@
 from pydantic import BaseModel
-from typing import List
+from datetime import datetime
+from typing import List, Optional
 
 # The request format for both minhash endpoints
 class LogInput(BaseModel):
     proof_key: str
     log_content: str
+
+class LogEntryOutput(BaseModel):
+    id: int
+    created_at: datetime
+    log_content: str
+
+class LogPageOutput(BaseModel):
+    proof_key: str
+    entries: List[LogEntryOutput]
+    # Pass as `after` to get the next page, None on the last page
+    next_after: Optional[int] = None
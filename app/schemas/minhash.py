@@ -1,23 +1,54 @@
-from pydantic import BaseModel
-from typing import List
+from pydantic import BaseModel, Field
+from typing import List, Optional
 
 # The request format for both minhash endpoints
 class MinHashInput(BaseModel):
     user_id: str
     minhash_data: str
 
+# The request format for the `/minhash/query/top` endpoint
+class QueryTopMinHashInput(MinHashInput):
+    k: int = Field(10, ge=1, le=1000)
+    min_similarity: float = Field(0.0, ge=0.0, le=1.0)
+    include_signatures: bool = False
+
 # The response format for the `/minhash` endpoint
 class SaveMinHashOutput(BaseModel):
     id: int
 
+# The response format for the `DELETE /minhash` endpoints
+class DeleteMinHashOutput(BaseModel):
+    ids: List[int]
+
+# The request format for the `/minhash/batch` endpoint
+class MinHashBatchInput(BaseModel):
+    items: List[MinHashInput]
+
+# A single result for the `/minhash/batch` endpoints, either an ID or an error
+class SaveMinHashBatchOutputOne(BaseModel):
+    id: Optional[int] = None
+    error: Optional[str] = None
+
+# The response format for the `/minhash/batch` endpoints, in input order
+class SaveMinHashBatchOutput(BaseModel):
+    results: List[SaveMinHashBatchOutputOne]
+
 # A single candidate for the `/minhash/query` endpoint
 class QueryMinHashOutputOne(BaseModel):
     id: int
     user_id: str
-    minhash: str
+    minhash: Optional[str] = None
     similarity: float
 
 # The response format for the `/minhash/query` endpoint
 class QueryMinHashOutput(BaseModel):
     candidates: List[QueryMinHashOutputOne]
 
+# A single result for the `/minhash/query/batch` endpoint, either candidates or an error
+class QueryMinHashBatchOutputOne(BaseModel):
+    candidates: List[QueryMinHashOutputOne]
+    error: Optional[str] = None
+
+# The response format for the `/minhash/query/batch` endpoint, in input order
+class QueryMinHashBatchOutput(BaseModel):
+    results: List[QueryMinHashBatchOutputOne]
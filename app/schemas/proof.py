@@ -1,7 +1,10 @@
 from pydantic import BaseModel
+from typing import List, Optional
 
 class GenerateProofInput(BaseModel):
     link: str
+    # When set, the order history is shingled into a MinHash signature saved for this user
+    user_id: Optional[str] = None
 
 class GenerateProofOutput(BaseModel):
     link: str
@@ -11,3 +14,18 @@ class GenerateProofOutput(BaseModel):
 class GetProofOutput(BaseModel):
     proof_key: str
     data_hash: str
+
+class ProofLookupInput(BaseModel):
+    proof_keys: List[str]
+
+class ProofLookupOutput(BaseModel):
+    proofs: List[GetProofOutput]
+    missing: List[str]
+
+class ProofJobOutput(BaseModel):
+    job_id: str
+    proof_key: str
+    status: str
+    data_hash: Optional[str] = None
+    minhash_id: Optional[int] = None
+    error: Optional[str] = None
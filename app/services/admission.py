@@ -0,0 +1,130 @@
+from app.core.config import settings
+from app.utils.download import ExportInfo, get_downloader
+from app.utils.metrics import ADMISSION_REJECTIONS
+import os
+import threading
+
+class ExportTooLargeError(Exception):
+    pass
+
+class MemoryBudgetExceededError(Exception):
+    pass
+
+
+class MemoryBudget:
+    """Bytes of enclave memory handed out to concurrent proof generations.
+
+    Reservations that would take the total above `total` are refused, so
+    generations are turned away up front instead of pushing the enclave into
+    paging halfway through.
+    """
+
+    def __init__(self, total: int):
+        self.total = total
+        self.reserved = 0
+        self._lock = threading.Lock()
+
+    def reserve(self, nbytes: int) -> "Reservation":
+        with self._lock:
+            if self.reserved + nbytes > self.total:
+                raise MemoryBudgetExceededError(
+                    f"{self.reserved} of {self.total} bytes of proof memory are in use, {nbytes} more requested"
+                )
+            self.reserved += nbytes
+        return Reservation(self, nbytes)
+
+    def _release(self, nbytes: int) -> None:
+        with self._lock:
+            self.reserved -= nbytes
+
+
+class Reservation:
+    def __init__(self, budget: MemoryBudget, nbytes: int):
+        self.budget = budget
+        self.nbytes = nbytes
+
+    def release(self) -> None:
+        # Safe to call more than once
+        nbytes, self.nbytes = self.nbytes, 0
+        if nbytes:
+            self.budget._release(nbytes)
+
+    def shrink(self, nbytes: int) -> None:
+        """Give back everything above `nbytes`, never grows the reservation."""
+        freed = self.nbytes - max(0, nbytes)
+        if freed > 0:
+            self.nbytes -= freed
+            self.budget._release(freed)
+
+
+class Admission:
+    """A proof generation let in: what the probe found, where to stage its files, and its reservation."""
+
+    def __init__(self, info: ExportInfo, directory: str, reservation: Reservation):
+        self.info = info
+        self.directory = directory
+        self.reservation = reservation
+
+    def release(self) -> None:
+        self.reservation.release()
+
+    def hold_output(self, path: str) -> None:
+        """Keep only what the redacted ZIP at `path` takes, once generation is over.
+
+        The working memory and the input are gone by then. On the encrypted
+        mount the output takes no enclave memory at all.
+        """
+        self.reservation.shrink(0 if self.directory is not None else os.path.getsize(path))
+
+
+# Large exports are staged on the encrypted mount, out of enclave memory.
+# Exports of unknown size are staged there too, in case they are large.
+def staging_directory(size: int):
+    if not settings.SPILL_DIR:
+        return None
+    if size is None or size >= settings.SPILL_THRESHOLD:
+        return settings.SPILL_DIR
+    return None
+
+# Enclave memory a generation needs: its buffers and CSV chunks, plus the
+# input and the redacted output when they are staged on the tmpfs.
+def estimate_memory(size: int, directory: str) -> int:
+    if directory is not None:
+        return settings.PROOF_WORKING_MEMORY
+    return settings.PROOF_WORKING_MEMORY + 2 * size
+
+
+_memory_budget = None
+
+def get_memory_budget() -> MemoryBudget:
+    global _memory_budget
+    if _memory_budget is None:
+        # Every worker process admits on its own, so each gets its share of the total
+        _memory_budget = MemoryBudget(settings.PROOF_MEMORY_BUDGET // max(1, settings.API_WORKERS))
+    return _memory_budget
+
+async def admit_export(url: str) -> Admission:
+    """Probe `url` and reserve what generating its proof will take.
+
+    Raises ExportTooLargeError when it could never be admitted, and
+    MemoryBudgetExceededError when it can't be admitted right now.
+    """
+    info = await get_downloader().probe(url)
+    if info.size is not None and info.size > settings.PROOF_MAX_EXPORT_SIZE:
+        ADMISSION_REJECTIONS.inc(reason="too_large")
+        raise ExportTooLargeError(f"The export is {info.size} bytes, at most {settings.PROOF_MAX_EXPORT_SIZE} are accepted")
+
+    directory = staging_directory(info.size)
+    # Without a size or a spill directory, assume the largest export we accept
+    nbytes = estimate_memory(info.size if info.size is not None else settings.PROOF_MAX_EXPORT_SIZE, directory)
+    if nbytes > get_memory_budget().total:
+        ADMISSION_REJECTIONS.inc(reason="too_large")
+        raise ExportTooLargeError(f"The export needs {nbytes} bytes of memory, more than the whole budget")
+    try:
+        reservation = get_memory_budget().reserve(nbytes)
+    except MemoryBudgetExceededError:
+        ADMISSION_REJECTIONS.inc(reason="busy")
+        raise
+    if directory is not None:
+        os.makedirs(directory, exist_ok=True)
+    return Admission(info, directory, reservation)
@@ -0,0 +1,139 @@
+from sqlalchemy import select
+from sqlalchemy.orm import Session
+from datetime import datetime, timedelta, timezone
+from app.core.config import settings
+from app.db.models.geocode_cache import GeocodeCache
+from app.db.session import SessionLocal
+from app.utils.cache import LRUCache, MISSING
+from app.utils.geocoder import UNKNOWN_POSTAL_CODE
+from app.utils.metrics import GEOCODE_LOOKUPS
+import asyncio
+import hashlib
+import hmac
+import logging
+import re
+
+logger = logging.getLogger(__name__)
+
+# Placeholder values Amazon exports instead of an address
+PASSTHROUGH_LOCATIONS = ("Not Applicable", "Not Available")
+
+# In-process tier, in front of the `geocode_cache` table, the only place addresses are kept in the clear
+memory_cache = LRUCache(settings.GEOCODE_CACHE_SIZE, ttl=settings.GEOCODE_CACHE_TTL)
+
+# Normalize an address so formatting differences share one cache entry
+def normalize_address(address: str) -> str:
+    address = re.sub(r"\s+", " ", address.strip().casefold())
+    return re.sub(r"\s*,\s*", ", ", address)
+
+def _utcnow() -> datetime:
+    return datetime.now(timezone.utc).replace(tzinfo=None)
+
+# The database runs outside the enclave, so it only ever sees a keyed digest
+# of an address. Without the key, digests can't be matched to guessed addresses.
+def address_digest(address_key: str) -> str:
+    key = (settings.GEOCODE_CACHE_KEY or settings.GMAPS_API_KEY or "").encode("utf-8")
+    return hmac.new(key, address_key.encode("utf-8"), hashlib.sha256).hexdigest()
+
+# Look up postal codes of normalized addresses that haven't expired yet
+def get_cached_postal_codes(db: Session, address_keys) -> dict:
+    if not address_keys:
+        return {}
+    digests = {address_digest(key): key for key in address_keys}
+    cutoff = _utcnow() - timedelta(seconds=settings.GEOCODE_CACHE_TTL)
+    rows = db.execute(
+        select(GeocodeCache.address_digest, GeocodeCache.postal_code)
+        .where(GeocodeCache.address_digest.in_(list(digests)))
+        .where(GeocodeCache.updated_at >= cutoff)
+    ).all()
+    return {digests[row.address_digest]: row.postal_code for row in rows}
+
+# Insert or refresh postal codes of normalized addresses, stored under their digests
+def save_postal_codes(db: Session, postal_codes: dict) -> None:
+    if not postal_codes:
+        return
+    if db.bind.dialect.name == "postgresql":
+        from sqlalchemy.dialects.postgresql import insert
+    else:
+        from sqlalchemy.dialects.sqlite import insert
+    now = _utcnow()
+    stmt = insert(GeocodeCache).values([
+        {"address_digest": address_digest(key), "postal_code": postal_code, "updated_at": now}
+        for key, postal_code in postal_codes.items()
+    ])
+    db.execute(stmt.on_conflict_do_update(
+        index_elements=[GeocodeCache.address_digest],
+        set_={"postal_code": stmt.excluded.postal_code, "updated_at": stmt.excluded.updated_at},
+    ))
+    db.commit()
+
+def _load_from_db(address_keys) -> dict:
+    db = SessionLocal()
+    try:
+        return get_cached_postal_codes(db, address_keys)
+    finally:
+        db.close()
+
+def _save_to_db(postal_codes: dict) -> None:
+    db = SessionLocal()
+    try:
+        save_postal_codes(db, postal_codes)
+    finally:
+        db.close()
+
+# Resolve the postal codes of many addresses at once, checking the in-process
+# cache, then the database, and only then calling `fetch` for the rest.
+# `fetch` takes a list of addresses and returns a dict of address to postal code.
+async def resolve_postal_codes(addresses, fetch) -> dict:
+    results = dict()
+    pending = dict()
+    memory_hits = 0
+    for address in set(addresses):
+        # Blank cells have no address to geocode, and would never be cached
+        if not isinstance(address, str) or address in PASSTHROUGH_LOCATIONS or not address.strip():
+            results[address] = address
+            continue
+        key = normalize_address(address)
+        postal_code = memory_cache.get(key)
+        if postal_code is not MISSING:
+            results[address] = postal_code
+            memory_hits += 1
+        else:
+            pending.setdefault(key, []).append(address)
+
+    if memory_hits:
+        GEOCODE_LOOKUPS.inc(memory_hits, source="memory")
+
+    if pending:
+        try:
+            stored = await asyncio.to_thread(_load_from_db, list(pending))
+        except Exception as e:
+            logger.warning(f"Failed to read the geocode cache: {e}")
+            stored = dict()
+        if stored:
+            GEOCODE_LOOKUPS.inc(len(stored), source="database")
+        for key, postal_code in stored.items():
+            memory_cache.set(key, postal_code)
+            for address in pending.pop(key):
+                results[address] = postal_code
+
+    if pending:
+        # Fetch one representative address per normalized key
+        # Postal codes that couldn't be fetched are never cached
+        GEOCODE_LOOKUPS.inc(len(pending), source="upstream")
+        fetched = await fetch([addresses[0] for addresses in pending.values()])
+        found = dict()
+        for key, addresses in pending.items():
+            postal_code = fetched.get(addresses[0], UNKNOWN_POSTAL_CODE)
+            for address in addresses:
+                results[address] = postal_code
+            if postal_code != UNKNOWN_POSTAL_CODE:
+                found[key] = postal_code
+                memory_cache.set(key, postal_code)
+        if found:
+            try:
+                await asyncio.to_thread(_save_to_db, found)
+            except Exception as e:
+                logger.warning(f"Failed to write the geocode cache: {e}")
+
+    return results
@@ -1,23 +1,92 @@
+from sqlalchemy import insert, select, delete, bindparam
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy.orm import Session
 from fastapi import HTTPException, status
-from app.utils.minhash import serialize_minhash, deserialize_minhash
+from app.utils.minhash import minhash_to_columns, minhash_from_columns, SignatureMatrix, ForestIndex
 from app.core.config import settings
-from app.db.models.minhash import MinHash as MinHashDb
+from app.utils.metrics import LSH_CANDIDATES
+from app.db.models.minhash import MinHash as MinHashDb, utcnow
+from datetime import timedelta
+import numpy as np
 from datasketch import MinHash, MinHashLSH
+import asyncio
+import heapq
+import json
+import logging
+import os
+import pickle
+import time
+
+logger = logging.getLogger(__name__)
+
+# Bump this whenever the snapshot layout changes
+LSH_SNAPSHOT_VERSION = 3
+
+# The datasketch storage config of the LSH, or None to keep it in this process.
+# A shared store (e.g. redis) lets every worker on a node use the same index.
+def lsh_storage_config():
+    if not settings.MINHASH_LSH_STORAGE_CONFIG:
+        return None
+    config = json.loads(settings.MINHASH_LSH_STORAGE_CONFIG)
+    # Indexes built with other parameters must not share buckets
+    basename = config.get("basename", f"minhash_lsh_{settings.MINHASH_LSH_THRESHOLD}_{settings.MINHASH_NUM_PERM}")
+    config["basename"] = basename.encode() if isinstance(basename, str) else basename
+    return config
+
+def lsh_storage_shared() -> bool:
+    return bool(settings.MINHASH_LSH_STORAGE_CONFIG)
+
+def new_lsh() -> MinHashLSH:
+    return MinHashLSH(
+        threshold=settings.MINHASH_LSH_THRESHOLD,
+        num_perm=settings.MINHASH_NUM_PERM,
+        storage_config=lsh_storage_config()
+    )
+
+def new_forest():
+    if not settings.MINHASH_FOREST_ENABLED:
+        return None
+    return ForestIndex(num_perm=settings.MINHASH_NUM_PERM, l=settings.MINHASH_FOREST_L)
 
 # Create the MinHashLSH object
-shared_lsh = MinHashLSH(
-    threshold=settings.MINHASH_LSH_THRESHOLD,
-    num_perm=settings.MINHASH_NUM_PERM
-)
+shared_lsh = new_lsh()
+
+# Every indexed signature, for scoring candidates without a database round trip
+shared_signatures = SignatureMatrix(settings.MINHASH_NUM_PERM)
+
+# The top-k index over the same keys as `shared_lsh`, if enabled
+shared_forest = new_forest()
+
+# The highest minhash ID inserted into `shared_lsh`
+shared_lsh_last_id = 0
+
+# With shared LSH storage, the highest minhash ID read back from the table by
+# `refresh_shared_index`. Other workers insert concurrently, so this only
+# moves forward by reading the table, never by local inserts.
+shared_refresh_last_id = 0
+
+def get_shared_lsh() -> MinHashLSH:
+    return shared_lsh
+
+def get_shared_signatures() -> SignatureMatrix:
+    return shared_signatures
+
+def get_shared_forest() -> ForestIndex:
+    return shared_forest
+
+# The LSH key is the user ID and the minhash ID
+def minhash_key(user_id: str, minhash_id: int) -> str:
+    return f"{user_id}_{minhash_id}"
+
+# Split an LSH key back into the user ID and the minhash ID
+def parse_minhash_key(key: str):
+    user_id, id_str = key.rsplit("_", 1)
+    return user_id, int(id_str)
 
 # Insert a minhash entry into the database
 def save_minhash(db: Session, user_id, minhash) -> int:
-    # Serialize the minhash
-    minhash_data = serialize_minhash(minhash)
-
     # Create the minhash entry to insert
-    db_item = MinHashDb(user_id=user_id, minhash_data=minhash_data)
+    db_item = MinHashDb(user_id=user_id, **minhash_to_columns(minhash))
 
     # Add the minhash entry to the session and commit
     db.add(db_item)
@@ -27,10 +96,450 @@ def save_minhash(db: Session, user_id, minhash) -> int:
     # Return the ID of the inserted entry
     return db_item.id
 
+# Insert many minhash entries with a single multi-row insert.
+# Takes `(user_id, minhash)` pairs and returns their IDs in the same order.
+def save_minhashes(db: Session, entries) -> list:
+    rows = [
+        {"user_id": user_id, **minhash_to_columns(minhash)}
+        for user_id, minhash in entries
+    ]
+    if not rows:
+        return []
+
+    ids = db.scalars(
+        insert(MinHashDb).returning(MinHashDb.id, sort_by_parameter_order=True),
+        rows
+    ).all()
+    db.commit()
+
+    return list(ids)
+
+# Delete minhash entries by ID, by user, and/or saved before a time, without committing.
+# Returns the `(minhash_id, user_id)` pairs of the deleted entries.
+def _delete_minhashes(db: Session, ids=None, user_ids=None, before=None) -> list:
+    stmt = delete(MinHashDb).returning(MinHashDb.id, MinHashDb.user_id)
+    if ids is not None:
+        stmt = stmt.where(MinHashDb.id.in_(list(ids)))
+    if user_ids is not None:
+        stmt = stmt.where(MinHashDb.user_id.in_(list(user_ids)))
+    if before is not None:
+        stmt = stmt.where(MinHashDb.created_at < before)
+    return [(row.id, row.user_id) for row in db.execute(stmt).all()]
+
+def delete_minhashes(db: Session, ids=None, user_ids=None, before=None) -> list:
+    if ids is None and user_ids is None and before is None:
+        raise ValueError("Refusing to delete every minhash entry")
+    deleted = _delete_minhashes(db, ids, user_ids, before)
+    db.commit()
+    return deleted
+
+# Replace every stored entry of each user by the given one, in one transaction.
+# Takes `(user_id, minhash)` pairs with distinct users, returns the new IDs in the
+# same order and the `(minhash_id, user_id)` pairs of the replaced entries.
+def replace_user_minhashes(db: Session, entries):
+    if not entries:
+        return [], []
+    replaced = _delete_minhashes(db, user_ids={user_id for user_id, _ in entries})
+    ids = db.scalars(
+        insert(MinHashDb).returning(MinHashDb.id, sort_by_parameter_order=True),
+        [{"user_id": user_id, **minhash_to_columns(minhash)} for user_id, minhash in entries]
+    ).all()
+    db.commit()
+    return list(ids), replaced
+
+# Insert a saved minhash entry into the LSH
+def index_minhash(lsh: MinHashLSH, user_id: str, minhash_id: int, minhash) -> None:
+    global shared_lsh_last_id
+
+    key = minhash_key(user_id, minhash_id)
+    lsh.insert(key, minhash)
+    if lsh is shared_lsh:
+        shared_signatures.add(minhash_id, user_id, minhash)
+        if shared_forest is not None:
+            shared_forest.add(key, minhash)
+        shared_lsh_last_id = max(shared_lsh_last_id, minhash_id)
+
+# Insert many saved `(minhash_id, user_id, minhash)` entries into the LSH
+def index_minhashes(lsh: MinHashLSH, entries) -> None:
+    global shared_lsh_last_id
+
+    if not entries:
+        return
+    with lsh.insertion_session(buffer_size=len(entries)) as session:
+        for minhash_id, user_id, minhash in entries:
+            # Fresh IDs from the database can't be in the index already
+            session.insert(minhash_key(user_id, minhash_id), minhash, check_duplication=False)
+    if lsh is shared_lsh:
+        shared_signatures.add_many(entries)
+        if shared_forest is not None:
+            shared_forest.add_many(
+                (minhash_key(user_id, minhash_id), minhash)
+                for minhash_id, user_id, minhash in entries
+            )
+        shared_lsh_last_id = max(shared_lsh_last_id, max(entry[0] for entry in entries))
+
+# Remove deleted `(minhash_id, user_id)` entries from the LSH
+def unindex_minhashes(lsh: MinHashLSH, entries) -> None:
+    keys = [minhash_key(user_id, minhash_id) for minhash_id, user_id in entries]
+    for key in keys:
+        if key in lsh:
+            lsh.remove(key)
+    if lsh is shared_lsh:
+        shared_signatures.remove_many(minhash_id for minhash_id, _ in entries)
+        if shared_forest is not None:
+            shared_forest.remove_many(keys)
+
+# Built once, so every lookup compiles to the same SQL and reuses its prepared statement
+_minhash_by_id = select(MinHashDb.seed, MinHashDb.hashvalues).where(MinHashDb.id == bindparam("id"))
+_minhashes_by_ids = (
+    select(MinHashDb.id, MinHashDb.user_id, MinHashDb.seed, MinHashDb.hashvalues)
+    .where(MinHashDb.id.in_(bindparam("ids", expanding=True)))
+)
+
 # Query a minhash entry by its ID
 def get_minhash_by_id(db: Session, entry_id: int) -> MinHash:
     # Query the minhash entry by its ID
-    entry = db.query(MinHashDb).filter(MinHashDb.id == entry_id).first()
+    entry = db.execute(_minhash_by_id, {"id": entry_id}).first()
 
     # Deserialize the minhash
-    return deserialize_minhash(entry.minhash_data)
+    return minhash_from_columns(entry.seed, entry.hashvalues)
+
+async def get_minhash_by_id_async(db: AsyncSession, entry_id: int) -> MinHash:
+    entry = (await db.execute(_minhash_by_id, {"id": entry_id})).first()
+    return minhash_from_columns(entry.seed, entry.hashvalues)
+
+# Query many minhash entries with a single `IN` query.
+# Returns a dict of minhash ID to `(user_id, minhash)`.
+def get_minhashes_by_ids(db: Session, entry_ids) -> dict:
+    if not entry_ids:
+        return {}
+    rows = db.execute(_minhashes_by_ids, {"ids": list(entry_ids)}).all()
+    return {row.id: (row.user_id, minhash_from_columns(row.seed, row.hashvalues)) for row in rows}
+
+async def get_minhashes_by_ids_async(db: AsyncSession, entry_ids) -> dict:
+    if not entry_ids:
+        return {}
+    rows = (await db.execute(_minhashes_by_ids, {"ids": list(entry_ids)})).all()
+    return {row.id: (row.user_id, minhash_from_columns(row.seed, row.hashvalues)) for row in rows}
+
+# Score LSH candidates against the query minhash.
+# Returns `(minhash_id, user_id, similarity)` tuples.
+def score_candidates(db: Session, minhash, candidate_keys, signatures: SignatureMatrix = None):
+    return score_candidates_batch(db, [minhash], [candidate_keys], signatures)[0]
+
+async def score_candidates_async(db: AsyncSession, minhash, candidate_keys, signatures: SignatureMatrix = None):
+    return (await score_candidates_batch_async(db, [minhash], [candidate_keys], signatures))[0]
+
+# Parse the candidate keys of every query, each distinct key once.
+# Returns the candidate IDs per query, the user of every candidate, and the
+# candidates the signature matrix doesn't hold yet.
+def _parse_candidates(candidate_keys_list, signatures: SignatureMatrix):
+    parsed = dict()
+    candidate_ids_list = list()
+    for candidate_keys in candidate_keys_list:
+        candidate_ids = list()
+        for key in candidate_keys:
+            if key not in parsed:
+                try:
+                    parsed[key] = parse_minhash_key(key)
+                except ValueError:
+                    logger.warning(f"Ignoring malformed LSH key: {key}")
+                    parsed[key] = None
+            if parsed[key] is not None:
+                candidate_ids.append(parsed[key][1])
+        candidate_ids_list.append(candidate_ids)
+    user_ids = {minhash_id: user_id for user_id, minhash_id in filter(None, parsed.values())}
+    missing = [minhash_id for minhash_id in user_ids if minhash_id not in signatures]
+    return candidate_ids_list, user_ids, missing
+
+def _score_parsed(minhashes, candidate_ids_list, user_ids, signatures: SignatureMatrix):
+    results = list()
+    for minhash, candidate_ids in zip(minhashes, candidate_ids_list):
+        LSH_CANDIDATES.observe(len(candidate_ids))
+        similarities = signatures.jaccard(minhash, candidate_ids)
+        results.append([
+            (minhash_id, user_ids[minhash_id], similarity)
+            for minhash_id, similarity in similarities.items()
+        ])
+    return results
+
+def _add_entries(signatures: SignatureMatrix, entries: dict) -> None:
+    signatures.add_many(
+        (minhash_id, user_id, entry_minhash)
+        for minhash_id, (user_id, entry_minhash) in entries.items()
+    )
+
+# Score the LSH candidates of many query minhashes at once. Every distinct
+# candidate is parsed and, if needed, read from the database only once.
+# Returns one list of `(minhash_id, user_id, similarity)` tuples per query.
+def score_candidates_batch(db: Session, minhashes, candidate_keys_list, signatures: SignatureMatrix = None):
+    signatures = signatures if signatures is not None else shared_signatures
+    candidate_ids_list, user_ids, missing = _parse_candidates(candidate_keys_list, signatures)
+
+    # Read through to the database for anything the matrix doesn't hold yet
+    if missing:
+        _add_entries(signatures, get_minhashes_by_ids(db, missing))
+
+    return _score_parsed(minhashes, candidate_ids_list, user_ids, signatures)
+
+async def score_candidates_batch_async(db: AsyncSession, minhashes, candidate_keys_list,
+                                       signatures: SignatureMatrix = None):
+    signatures = signatures if signatures is not None else shared_signatures
+    candidate_ids_list, user_ids, missing = _parse_candidates(candidate_keys_list, signatures)
+    if missing:
+        _add_entries(signatures, await get_minhashes_by_ids_async(db, missing))
+    return _score_parsed(minhashes, candidate_ids_list, user_ids, signatures)
+
+# The LSH finds everything above its threshold, the forest ranks by prefix
+# matches below it. Both are rescored exactly, so over-fetching is cheap.
+def _top_k_candidates(lsh: MinHashLSH, forest: ForestIndex, minhash, k: int) -> set:
+    candidate_keys = set(lsh.query(minhash))
+    if forest is not None:
+        forest_keys = set(forest.query(minhash, k * settings.MINHASH_TOPK_OVERSAMPLE)) - candidate_keys
+        # This worker's forest only learns of other workers' deletes on compaction,
+        # the shared store is current, so keep what is still in it
+        if forest_keys and lsh_storage_shared():
+            forest_keys = existing_lsh_keys(lsh, list(forest_keys))
+        candidate_keys |= forest_keys
+    return candidate_keys
+
+# Query an LSH from the event loop. With shared storage every band is a
+# blocking round trip to the store, so that runs in a thread.
+async def query_lsh_async(lsh: MinHashLSH, minhash) -> list:
+    if lsh_storage_shared():
+        return await asyncio.to_thread(lsh.query, minhash)
+    return lsh.query(minhash)
+
+def _best_k(scored, k: int, min_similarity: float):
+    results = [result for result in scored if result[2] >= min_similarity]
+    return heapq.nsmallest(k, results, key=lambda result: (-result[2], result[0]))
+
+# Find the `k` most similar entries with at least `min_similarity`.
+# Returns `(minhash_id, user_id, similarity)` tuples, best first.
+def query_top_k(db: Session, lsh: MinHashLSH, forest: ForestIndex, signatures: SignatureMatrix,
+                minhash, k: int, min_similarity: float = 0.0):
+    candidate_keys = _top_k_candidates(lsh, forest, minhash, k)
+    return _best_k(score_candidates(db, minhash, candidate_keys, signatures), k, min_similarity)
+
+async def query_top_k_async(db: AsyncSession, lsh: MinHashLSH, forest: ForestIndex, signatures: SignatureMatrix,
+                            minhash, k: int, min_similarity: float = 0.0):
+    if lsh_storage_shared():
+        candidate_keys = await asyncio.to_thread(_top_k_candidates, lsh, forest, minhash, k)
+    else:
+        candidate_keys = _top_k_candidates(lsh, forest, minhash, k)
+    return _best_k(await score_candidates_async(db, minhash, candidate_keys, signatures), k, min_similarity)
+
+# Stream the minhash table in ID order, one page at a time
+def iter_minhash_pages(db: Session, after_id: int = 0, batch_size: int = None):
+    batch_size = batch_size or settings.MINHASH_LSH_LOAD_BATCH_SIZE
+    while True:
+        # Keyset pagination keeps every page an index range scan
+        rows = db.execute(
+            select(MinHashDb.id, MinHashDb.user_id, MinHashDb.seed, MinHashDb.hashvalues)
+            .where(MinHashDb.id > after_id)
+            .order_by(MinHashDb.id)
+            .limit(batch_size)
+        ).all()
+        if not rows:
+            return
+        yield rows
+        after_id = rows[-1].id
+
+# The keys of `keys` already in a shared LSH store, checked in one round trip
+def existing_lsh_keys(lsh: MinHashLSH, keys) -> set:
+    if not keys:
+        return set()
+    stored = [pickle.dumps(key) if lsh.prepickle else key for key in keys]
+    return {key for key, hashes in zip(keys, lsh.keys.getmany(*stored)) if hashes}
+
+# Insert every stored minhash with an ID above `after_id` into the LSH, the
+# signature matrix and the forest. Returns the highest ID seen and the number of inserted entries.
+# With `lsh=None` only the signature matrix and the forest are filled. With
+# `skip_existing`, keys another worker already put in a shared LSH are left alone.
+def load_minhashes_into_lsh(db: Session, lsh: MinHashLSH, signatures: SignatureMatrix, forest: ForestIndex = None,
+                            after_id: int = 0, batch_size: int = None, skip_existing: bool = False):
+    batch_size = batch_size or settings.MINHASH_LSH_LOAD_BATCH_SIZE
+    last_id = after_id
+    count = 0
+    for rows in iter_minhash_pages(db, after_id, batch_size):
+        entries = list()
+        for row in rows:
+            try:
+                entries.append((row.id, row.user_id, minhash_from_columns(row.seed, row.hashvalues)))
+            except Exception as e:
+                logger.error(f"Failed to load minhash {row.id}: {e}")
+
+        if lsh is not None:
+            keys = [minhash_key(user_id, minhash_id) for minhash_id, user_id, _ in entries]
+            existing = existing_lsh_keys(lsh, keys) if skip_existing else set()
+            with lsh.insertion_session(buffer_size=batch_size) as session:
+                for key, (_, _, minhash) in zip(keys, entries):
+                    if key not in existing:
+                        # IDs are unique, so no key can be in the index already
+                        session.insert(key, minhash, check_duplication=False)
+
+        signatures.add_many(entries)
+        if forest is not None:
+            forest.add_many(
+                (minhash_key(user_id, minhash_id), minhash)
+                for minhash_id, user_id, minhash in entries
+            )
+        count += len(entries)
+        last_id = rows[-1].id
+    return last_id, count
+
+# Every key in an LSH, whatever its storage. The keys are copied up front in
+# one call, the endpoints insert and remove keys from other threads meanwhile.
+def iter_lsh_keys(lsh: MinHashLSH):
+    for key in list(lsh.keys.keys()):
+        yield pickle.loads(key) if lsh.prepickle else key
+
+# Remove `key` from an LSH, unless another thread removed it first
+def _discard_lsh_key(lsh: MinHashLSH, key) -> None:
+    try:
+        lsh.remove(key)
+    except ValueError:
+        pass
+
+# Delete the entries older than `ttl` seconds from the table and the shared index.
+# Returns the number of deleted entries.
+def expire_minhashes(db: Session, ttl: float) -> int:
+    expired = delete_minhashes(db, before=utcnow() - timedelta(seconds=ttl))
+    unindex_minhashes(shared_lsh, expired)
+    return len(expired)
+
+# Drop the keys of the shared index whose entries are gone from the table, e.g.
+# deleted by another worker, and reclaim the space of removed signatures.
+# Returns the number of orphaned entries dropped.
+def compact_shared_index(db: Session, batch_size: int = None) -> int:
+    batch_size = batch_size or settings.MINHASH_LSH_LOAD_BATCH_SIZE
+    lsh_keys = dict()
+    for key in iter_lsh_keys(shared_lsh):
+        try:
+            lsh_keys[parse_minhash_key(key)[1]] = key
+        except ValueError:
+            logger.warning(f"Removing malformed LSH key: {key}")
+            _discard_lsh_key(shared_lsh, key)
+    local_ids = np.unique(np.fromiter(
+        list(lsh_keys) + shared_signatures.ids(), dtype=np.int64
+    ))
+
+    # Check the known IDs against the table, one `IN` query per batch
+    orphaned = list()
+    for start in range(0, len(local_ids), batch_size):
+        batch = local_ids[start:start + batch_size].tolist()
+        live = set(db.scalars(select(MinHashDb.id).where(MinHashDb.id.in_(batch))).all())
+        orphaned.extend(minhash_id for minhash_id in batch if minhash_id not in live)
+
+    orphaned_keys = list()
+    for minhash_id in orphaned:
+        key = lsh_keys.get(minhash_id)
+        if key is None:
+            entry = shared_signatures.get(minhash_id)
+            if entry is None:
+                # Removed by a delete since the IDs were collected
+                continue
+            key = minhash_key(entry[0], minhash_id)
+        orphaned_keys.append(key)
+        _discard_lsh_key(shared_lsh, key)
+    shared_signatures.remove_many(orphaned)
+    shared_signatures.compact()
+
+    if shared_forest is not None:
+        shared_forest.remove_many(orphaned_keys)
+        if shared_forest.removed:
+            shared_forest.rebuild(
+                (minhash_key(user_id, minhash_id), minhash)
+                for minhash_id, user_id, minhash in shared_signatures.entries()
+            )
+    return len(orphaned)
+
+# Expire old entries if a TTL is set, then compact the shared index
+def run_compaction(db: Session) -> None:
+    start_time = time.time()
+    expired = expire_minhashes(db, settings.MINHASH_TTL) if settings.MINHASH_TTL > 0 else 0
+    orphaned = compact_shared_index(db)
+    logger.info(f"MinHash compaction: {expired} expired, {orphaned} orphaned, {time.time() - start_time} seconds")
+
+# Write the LSH, the signature matrix, the forest and the last inserted ID to disk
+def save_lsh_snapshot(path: str, lsh: MinHashLSH, signatures: SignatureMatrix, forest: ForestIndex, last_id: int) -> None:
+    snapshot = {
+        "version": LSH_SNAPSHOT_VERSION,
+        "threshold": settings.MINHASH_LSH_THRESHOLD,
+        "num_perm": settings.MINHASH_NUM_PERM,
+        "last_id": last_id,
+        "lsh": lsh,
+        "signatures": signatures,
+        "forest": forest,
+    }
+
+    # Write to a temporary file first so a crash never leaves a torn snapshot
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "wb") as f:
+        pickle.dump(snapshot, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(tmp_path, path)
+
+# Read an LSH snapshot back from disk.
+# Returns None if there is no usable snapshot for the current settings.
+def load_lsh_snapshot(path: str):
+    if not os.path.exists(path):
+        return None
+    try:
+        with open(path, "rb") as f:
+            snapshot = pickle.load(f)
+    except Exception as e:
+        logger.warning(f"Failed to read LSH snapshot {path}: {e}")
+        return None
+
+    if (snapshot.get("version") != LSH_SNAPSHOT_VERSION
+            or snapshot.get("threshold") != settings.MINHASH_LSH_THRESHOLD
+            or snapshot.get("num_perm") != settings.MINHASH_NUM_PERM
+            or (snapshot.get("forest") is None) == settings.MINHASH_FOREST_ENABLED):
+        logger.warning(f"Ignoring LSH snapshot {path}: built with different settings")
+        return None
+
+    return snapshot["lsh"], snapshot["signatures"], snapshot["forest"], snapshot["last_id"]
+
+# Rebuild `shared_lsh`, `shared_signatures` and `shared_forest` from the snapshot and the minhash table
+def warm_start_lsh(db: Session) -> None:
+    global shared_lsh, shared_signatures, shared_forest, shared_lsh_last_id, shared_refresh_last_id
+
+    start_time = time.time()
+    # A shared LSH store outlives the process, and can't be pickled
+    shared = lsh_storage_shared()
+    snapshot_path = "" if shared else settings.MINHASH_LSH_SNAPSHOT_PATH
+
+    lsh, signatures, forest, last_id = new_lsh(), SignatureMatrix(settings.MINHASH_NUM_PERM), new_forest(), 0
+    if snapshot_path:
+        snapshot = load_lsh_snapshot(snapshot_path)
+        if snapshot:
+            lsh, signatures, forest, last_id = snapshot
+
+    # Catch up with everything inserted after the snapshot was taken
+    last_id, count = load_minhashes_into_lsh(db, lsh, signatures, forest, after_id=last_id, skip_existing=shared)
+
+    shared_lsh, shared_signatures, shared_forest, shared_lsh_last_id = lsh, signatures, forest, last_id
+    shared_refresh_last_id = last_id
+
+    if snapshot_path and count:
+        save_lsh_snapshot(snapshot_path, shared_lsh, shared_signatures, shared_forest, shared_lsh_last_id)
+
+    logger.info(f"LSH warm start: {count} new entries, last ID {last_id}, {time.time() - start_time} seconds")
+
+# With shared LSH storage, pick up the entries other workers inserted since
+# the last refresh into this worker's signature matrix and forest.
+# Returns the number of entries read.
+def refresh_shared_index(db: Session) -> int:
+    global shared_refresh_last_id, shared_lsh_last_id
+
+    if not lsh_storage_shared():
+        return 0
+    last_id, count = load_minhashes_into_lsh(db, None, shared_signatures, shared_forest, after_id=shared_refresh_last_id)
+    shared_refresh_last_id = last_id
+    shared_lsh_last_id = max(shared_lsh_last_id, last_id)
+    return count
+
+# Persist `shared_lsh` if snapshots are enabled
+def snapshot_shared_lsh() -> None:
+    if settings.MINHASH_LSH_SNAPSHOT_PATH and not lsh_storage_shared():
+        save_lsh_snapshot(settings.MINHASH_LSH_SNAPSHOT_PATH, shared_lsh, shared_signatures, shared_forest, shared_lsh_last_id)
@@ -0,0 +1,50 @@
+from sqlalchemy.orm import Session
+from datasketch import MinHashLSH
+from app.core.config import settings
+from app.db.models.minhash import MinHash as MinHashDb
+from app.db.models.order_history import OrderHistory
+from app.db.session import SessionLocal
+from app.services.minhash import index_minhash, get_shared_lsh
+from app.utils.minhash import SignatureBuilder, minhash_to_columns
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+def new_order_history_signer() -> SignatureBuilder:
+    """A signature builder for the order history of an export being redacted."""
+    return SignatureBuilder(batch_size=settings.MINHASH_HASH_BATCH_SIZE)
+
+# Store the signature of a user's order history in `minhashes`, and an
+# `order_history` entry pointing at it, in one transaction. Then insert it
+# into the LSH. Returns the ID of the minhash entry.
+def save_order_history(db: Session, lsh: MinHashLSH, user_id: str, minhash) -> int:
+    db_item = MinHashDb(user_id=user_id, **minhash_to_columns(minhash))
+    db.add(db_item)
+    db.flush()
+    db.add(OrderHistory(user_id=user_id, minhash_id=db_item.id))
+    db.commit()
+
+    index_minhash(lsh, user_id, db_item.id, minhash)
+    return db_item.id
+
+def _save(user_id: str, minhash) -> int:
+    db = SessionLocal()
+    try:
+        return save_order_history(db, get_shared_lsh(), user_id, minhash)
+    finally:
+        db.close()
+
+async def save_export_signature(user_id: str, signer: SignatureBuilder):
+    """Save and index the signature shingled from an export, returning its minhash ID.
+
+    Returns None when the export had no order history, or when saving failed:
+    the proof is valid either way, so a failure here doesn't fail it.
+    """
+    if signer.empty:
+        return None
+    try:
+        return await asyncio.to_thread(_save, user_id, signer.minhash())
+    except Exception as e:
+        logger.error(f"Failed to save the order history signature of {user_id}: {e}")
+        return None
@@ -1,12 +1,74 @@
-from sqlalchemy.orm import Session
+from sqlalchemy import select, bindparam
+from sqlalchemy.ext.asyncio import AsyncSession
 from fastapi import HTTPException, status
+from app.core.config import settings
 from app.db.models.proof import Proof
+from app.utils.cache import LRUCache, MISSING
 
-def get_proof_by_proof_key(db: Session, proof_key: str):
-    return db.query(Proof).filter(Proof.proof_key == proof_key).first()
+# Built once, so every lookup compiles to the same SQL and reuses its prepared statement
+_proof_by_key = select(Proof).where(Proof.proof_key == bindparam("proof_key")).limit(1)
+_proofs_by_keys = (
+    select(Proof.proof_key, Proof.data_hash)
+    .where(Proof.proof_key.in_(bindparam("proof_keys", expanding=True)))
+)
 
-def create_proof(db: Session, proof: Proof):
+# Proofs never change once created, so their data hashes are cached without expiry.
+# Misses are cached briefly, and forgotten by this worker as soon as it creates the proof.
+proof_cache = LRUCache(settings.PROOF_CACHE_SIZE)
+missing_proof_cache = LRUCache(settings.PROOF_CACHE_SIZE, ttl=settings.PROOF_NEGATIVE_CACHE_TTL)
+
+def proof_cache_stats() -> dict:
+    return {"proofs": proof_cache.stats(), "missing_proofs": missing_proof_cache.stats()}
+
+def _cached_proof(proof_key: str):
+    """The cached proof, None for a cached miss, or MISSING when not cached."""
+    data_hash = proof_cache.get(proof_key)
+    if data_hash is not MISSING:
+        return Proof(proof_key=proof_key, data_hash=data_hash)
+    if missing_proof_cache.get(proof_key) is not MISSING:
+        return None
+    return MISSING
+
+async def get_proof_by_proof_key(db: AsyncSession, proof_key: str):
+    proof = _cached_proof(proof_key)
+    if proof is not MISSING:
+        return proof
+
+    result = await db.execute(_proof_by_key, {"proof_key": proof_key})
+    proof = result.scalars().first()
+    if proof is None:
+        missing_proof_cache.set(proof_key, True)
+    else:
+        proof_cache.set(proof_key, proof.data_hash)
+    return proof
+
+# Look up many proofs with a single `IN` query for whatever isn't cached.
+# Returns a dict of proof key to data hash, without the keys that have no proof.
+async def get_data_hashes_by_proof_keys(db: AsyncSession, proof_keys) -> dict:
+    results = dict()
+    pending = list()
+    for proof_key in dict.fromkeys(proof_keys):
+        proof = _cached_proof(proof_key)
+        if proof is MISSING:
+            pending.append(proof_key)
+        elif proof is not None:
+            results[proof_key] = proof.data_hash
+
+    if pending:
+        rows = (await db.execute(_proofs_by_keys, {"proof_keys": pending})).all()
+        found = {row.proof_key: row.data_hash for row in rows}
+        for proof_key in pending:
+            if proof_key in found:
+                proof_cache.set(proof_key, found[proof_key])
+            else:
+                missing_proof_cache.set(proof_key, True)
+        results.update(found)
+    return results
+
+async def create_proof(db: AsyncSession, proof: Proof):
     db.add(proof)
-    db.commit()
-    db.refresh(proof)
+    await db.commit()
+    await db.refresh(proof)
+    missing_proof_cache.delete(proof.proof_key)
+    proof_cache.set(proof.proof_key, proof.data_hash)
     return proof
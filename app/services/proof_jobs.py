@@ -0,0 +1,211 @@
+from app.core.config import settings
+from app.db.models.proof import Proof
+from app.db.session import AsyncSessionLocal
+from app.services.proof import get_proof_by_proof_key, create_proof
+from app.services.order_history import new_order_history_signer, save_export_signature
+from app.utils.misc import download_and_modify_zip
+import asyncio
+import logging
+import os
+import time
+import uuid
+
+logger = logging.getLogger(__name__)
+
+JOB_QUEUED = "queued"
+JOB_RUNNING = "running"
+JOB_DONE = "done"
+JOB_FAILED = "failed"
+JOB_STATUSES = (JOB_QUEUED, JOB_RUNNING, JOB_DONE, JOB_FAILED)
+
+class QueueFullError(Exception):
+    pass
+
+class ProofJob:
+    def __init__(self, proof_key: str, link: str, admission=None, user_id: str = None):
+        self.job_id = uuid.uuid4().hex
+        self.proof_key = proof_key
+        self.link = link
+        # Whose order history signature to save, if any
+        self.user_id = user_id
+        self.minhash_id = None
+        # Released once the job's files are gone
+        self.admission = admission
+        self.status = JOB_QUEUED
+        self.data_hash = None
+        self.file_path = None
+        self.error = None
+        self.finished_at = None
+
+    @property
+    def finished(self) -> bool:
+        return self.status in (JOB_DONE, JOB_FAILED)
+
+
+class ProofJobManager:
+    """Runs proof generations on a fixed number of workers fed by a bounded queue.
+
+    `run` is the pipeline, an async function taking a job and returning the
+    data hash and the path of the redacted ZIP. Submissions of a proof key that
+    is already queued or running get the existing job instead of a new run.
+    Finished jobs and their files are kept for `result_ttl` seconds.
+    """
+
+    def __init__(self, run, workers: int = 2, max_queue: int = 16, result_ttl: float = 3600):
+        self.run = run
+        self.workers = workers
+        self.max_queue = max_queue
+        self.result_ttl = result_ttl
+        self.jobs = dict()
+        self._inflight = dict()
+        self._loop = None
+        self._tasks = []
+
+    def _start(self) -> None:
+        loop = asyncio.get_running_loop()
+        if self._loop is loop:
+            return
+        self._loop = loop
+        self._queue = asyncio.Queue(maxsize=self.max_queue)
+        self._tasks = [loop.create_task(self._work()) for _ in range(self.workers)]
+
+    async def stop(self) -> None:
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+        self._loop = None
+        for job in self.jobs.values():
+            self._remove_file(job)
+        self.jobs.clear()
+        self._inflight.clear()
+
+    def submit(self, proof_key: str, link: str, admission=None, user_id: str = None) -> ProofJob:
+        """Queue a proof generation, or return the job already generating `proof_key`.
+
+        Raises QueueFullError when the queue is full.
+        """
+        self._start()
+        self.prune()
+        job = self._inflight.get(proof_key)
+        if job is not None:
+            return job
+        job = ProofJob(proof_key, link, admission, user_id)
+        try:
+            self._queue.put_nowait(job)
+        except asyncio.QueueFull:
+            raise QueueFullError(f"{self.max_queue} proof generations are already queued")
+        self.jobs[job.job_id] = job
+        self._inflight[proof_key] = job
+        return job
+
+    def in_flight(self, proof_key: str) -> bool:
+        return proof_key in self._inflight
+
+    def counts(self) -> dict:
+        """The number of known jobs in each status."""
+        counts = dict.fromkeys(JOB_STATUSES, 0)
+        for job in list(self.jobs.values()):
+            counts[job.status] += 1
+        return counts
+
+    def get(self, job_id: str) -> ProofJob:
+        self.prune()
+        return self.jobs.get(job_id)
+
+    def prune(self) -> None:
+        """Forget finished jobs older than the result TTL and delete their files."""
+        cutoff = time.monotonic() - self.result_ttl
+        for job_id in [job_id for job_id, job in self.jobs.items() if job.finished and job.finished_at < cutoff]:
+            self._remove_file(self.jobs.pop(job_id))
+
+    def _remove_file(self, job: ProofJob) -> None:
+        if job.file_path and os.path.exists(job.file_path):
+            os.unlink(job.file_path)
+            logger.debug(f"Deleted temp file: {job.file_path}")
+        job.file_path = None
+        if job.admission is not None:
+            job.admission.release()
+
+    async def _work(self) -> None:
+        while True:
+            job = await self._queue.get()
+            job.status = JOB_RUNNING
+            try:
+                job.data_hash, job.file_path = await self.run(job)
+                # Results wait up to the TTL, they only hold on to their output
+                if job.admission is not None:
+                    job.admission.hold_output(job.file_path)
+                job.status = JOB_DONE
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Proof job {job.job_id} failed: {e}")
+                job.error = str(e)
+                job.status = JOB_FAILED
+                self._remove_file(job)
+            finally:
+                job.finished_at = time.monotonic()
+                self._inflight.pop(job.proof_key, None)
+                self._queue.task_done()
+
+
+async def _save_proof(proof_key: str, data_hash: str) -> None:
+    async with AsyncSessionLocal() as db:
+        if await get_proof_by_proof_key(db, proof_key=proof_key):
+            raise Exception("The proof already generated")
+        await create_proof(db, Proof(proof_key=proof_key, data_hash=data_hash))
+
+async def run_proof_pipeline(job: ProofJob):
+    """Download and redact the export of a job, then record its proof and its order history signature."""
+    signer = new_order_history_signer() if job.user_id else None
+    result = await download_and_modify_zip(job.link, job.admission, signer)
+    if result is None:
+        raise Exception("Failed to download or hash data.")
+    data_hash, output_filepath = result
+    logger.info(f"Data hash: {data_hash}")
+    try:
+        await _save_proof(job.proof_key, data_hash)
+    except Exception:
+        os.unlink(output_filepath)
+        raise
+    if signer is not None:
+        job.minhash_id = await save_export_signature(job.user_id, signer)
+    return data_hash, output_filepath
+
+
+_proof_jobs = None
+
+def get_proof_jobs() -> ProofJobManager:
+    global _proof_jobs
+    if _proof_jobs is None:
+        _proof_jobs = ProofJobManager(
+            run_proof_pipeline,
+            workers=settings.PROOF_JOB_WORKERS,
+            max_queue=settings.PROOF_JOB_QUEUE_SIZE,
+            result_ttl=settings.PROOF_JOB_RESULT_TTL,
+        )
+    return _proof_jobs
+
+def proof_job_counts() -> dict:
+    # Don't start the job manager just to report that it is idle
+    if _proof_jobs is None:
+        return dict.fromkeys(JOB_STATUSES, 0)
+    return _proof_jobs.counts()
+
+# Expire finished jobs every `interval` seconds until cancelled, so their
+# files and reservations go even when no job requests come in
+async def prune_proof_jobs_periodically(interval: float) -> None:
+    while True:
+        await asyncio.sleep(interval)
+        if _proof_jobs is not None:
+            try:
+                _proof_jobs.prune()
+            except Exception as e:
+                logger.error(f"Failed to prune proof jobs: {e}")
+
+async def stop_proof_jobs() -> None:
+    global _proof_jobs
+    if _proof_jobs is not None:
+        await _proof_jobs.stop()
+        _proof_jobs = None
@@ -0,0 +1,203 @@
+from sqlalchemy import insert, select, bindparam
+from sqlalchemy.ext.asyncio import AsyncSession
+from app.core.config import settings
+from app.db.models.minhash import utcnow
+from app.db.models.proof_log import ProofLog
+from app.db.session import AsyncSessionLocal
+from app.utils.metrics import PROOF_LOG_ENTRIES
+import asyncio
+import logging
+import zlib
+
+logger = logging.getLogger(__name__)
+
+# Built once, so every page compiles to the same SQL and reuses its prepared statement
+_proof_logs_page = (
+    select(ProofLog)
+    .where(ProofLog.proof_key == bindparam("proof_key"), ProofLog.id > bindparam("after_id"))
+    .order_by(ProofLog.id)
+    .limit(bindparam("limit"))
+)
+
+class LogBufferFullError(Exception):
+    pass
+
+class LogEntryTooLargeError(Exception):
+    pass
+
+# Encode log content for storage, compressing it from `min_bytes` up (0 = never).
+# Returns the stored bytes and whether they are compressed.
+def encode_log_content(content: str, min_bytes: int):
+    data = content.encode("utf-8")
+    if min_bytes > 0 and len(data) >= min_bytes:
+        compressed = zlib.compress(data, 6)
+        # Already compressed or random content can come out larger
+        if len(compressed) < len(data):
+            return compressed, True
+    return data, False
+
+# The UTF-8 size of log content, what the buffer is bounded by
+def content_bytes(content: str) -> int:
+    return len(content.encode("utf-8"))
+
+def decode_log_content(entry: ProofLog) -> str:
+    data = zlib.decompress(entry.content) if entry.compressed else entry.content
+    return data.decode("utf-8")
+
+def _encode_entries(entries, min_bytes: int) -> list:
+    rows = list()
+    for proof_key, content, created_at in entries:
+        data, compressed = encode_log_content(content, min_bytes)
+        rows.append({"proof_key": proof_key, "content": data, "compressed": compressed, "created_at": created_at})
+    return rows
+
+# Insert `(proof_key, content, created_at)` entries with one batched statement
+async def save_proof_logs(db: AsyncSession, entries) -> None:
+    # zlib releases the GIL, compressing in a thread keeps the event loop free
+    rows = await asyncio.to_thread(_encode_entries, entries, settings.PROOF_LOG_COMPRESS_MIN_BYTES)
+    await db.execute(insert(ProofLog), rows)
+    await db.commit()
+
+# Read the entries of a proof key after `after_id`, oldest first
+async def get_proof_logs(db: AsyncSession, proof_key: str, after_id: int = 0, limit: int = 100) -> list:
+    result = await db.execute(_proof_logs_page, {"proof_key": proof_key, "after_id": after_id, "limit": limit})
+    return list(result.scalars().all())
+
+
+class ProofLogBuffer:
+    """Collects log entries in a bounded buffer and writes them in batches.
+
+    `write` is an async function taking a list of `(proof_key, content,
+    created_at)` entries. A batch is written once it holds `batch_size`
+    entries, or `flush_interval` seconds after its first entry arrived,
+    whichever comes first. The buffer holds at most `max_size` entries and
+    `max_bytes` bytes of content: adding to a full buffer raises
+    LogBufferFullError, adding an entry over `max_entry_bytes` raises
+    LogEntryTooLargeError.
+    """
+
+    def __init__(self, write, max_size: int = 10000, batch_size: int = 500, flush_interval: float = 1.0,
+                 max_bytes: int = 64 * 1024 ** 2, max_entry_bytes: int = 1024 ** 2):
+        self.write = write
+        self.max_size = max_size
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = max_entry_bytes
+        self.buffered_bytes = 0
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self._loop = None
+        self._task = None
+
+    def _start(self) -> None:
+        loop = asyncio.get_running_loop()
+        if self._loop is loop:
+            return
+        self._loop = loop
+        self._queue = asyncio.Queue(maxsize=self.max_size)
+        self._ready = asyncio.Event()
+        self._wanted = self.batch_size
+        self._task = loop.create_task(self._run())
+
+    def add(self, proof_key: str, content: str) -> None:
+        self._start()
+        nbytes = content_bytes(content)
+        if nbytes > self.max_entry_bytes:
+            PROOF_LOG_ENTRIES.inc(outcome="rejected")
+            raise LogEntryTooLargeError(f"The log entry is {nbytes} bytes, at most {self.max_entry_bytes} are accepted")
+        if self.buffered_bytes + nbytes > self.max_bytes:
+            PROOF_LOG_ENTRIES.inc(outcome="rejected")
+            raise LogBufferFullError(f"{self.buffered_bytes} bytes of log entries are already waiting to be written")
+        try:
+            self._queue.put_nowait((proof_key, content, utcnow()))
+        except asyncio.QueueFull:
+            PROOF_LOG_ENTRIES.inc(outcome="rejected")
+            raise LogBufferFullError(f"{self.max_size} log entries are already waiting to be written")
+        self.buffered_bytes += nbytes
+        PROOF_LOG_ENTRIES.inc(outcome="received")
+        if self._queue.qsize() >= self._wanted:
+            self._ready.set()
+
+    def pending(self) -> int:
+        return self._queue.qsize() if self._loop is not None else 0
+
+    async def stop(self) -> None:
+        """Write everything still buffered, then stop the writer."""
+        if self._task is None:
+            return
+        # The writer flushes its batch when it reaches the end marker
+        await self._queue.put(None)
+        self._ready.set()
+        await self._task
+        self._task = None
+        self._loop = None
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            entry = await self._queue.get()
+            if entry is None:
+                return
+            batch = [entry]
+            deadline = loop.time() + self.flush_interval
+            stopping = False
+            while True:
+                while len(batch) < self.batch_size and not self._queue.empty():
+                    entry = self._queue.get_nowait()
+                    if entry is None:
+                        stopping = True
+                        break
+                    batch.append(entry)
+                timeout = deadline - loop.time()
+                if stopping or len(batch) >= self.batch_size or timeout <= 0:
+                    break
+                # Wake up early once the rest of the batch has arrived
+                self._wanted = self.batch_size - len(batch)
+                self._ready.clear()
+                try:
+                    await asyncio.wait_for(self._ready.wait(), timeout)
+                except asyncio.TimeoutError:
+                    pass
+            self._wanted = self.batch_size
+            await self._flush(batch)
+            if stopping:
+                return
+
+    async def _flush(self, batch) -> None:
+        try:
+            await self.write(batch)
+            PROOF_LOG_ENTRIES.inc(len(batch), outcome="written")
+        except Exception as e:
+            PROOF_LOG_ENTRIES.inc(len(batch), outcome="dropped")
+            logger.error(f"Failed to write {len(batch)} log entries: {e}")
+        finally:
+            self.buffered_bytes -= sum(content_bytes(content) for _, content, _ in batch)
+
+
+async def write_proof_logs(entries) -> None:
+    async with AsyncSessionLocal() as db:
+        await save_proof_logs(db, entries)
+
+
+_proof_logs = None
+
+def get_proof_log_buffer() -> ProofLogBuffer:
+    global _proof_logs
+    if _proof_logs is None:
+        _proof_logs = ProofLogBuffer(
+            write_proof_logs,
+            max_size=settings.PROOF_LOG_BUFFER_SIZE,
+            max_bytes=settings.PROOF_LOG_BUFFER_BYTES,
+            max_entry_bytes=settings.PROOF_LOG_MAX_ENTRY_BYTES,
+            batch_size=settings.PROOF_LOG_BATCH_SIZE,
+            flush_interval=settings.PROOF_LOG_FLUSH_INTERVAL,
+        )
+    return _proof_logs
+
+def proof_log_buffer_pending() -> int:
+    return _proof_logs.pending() if _proof_logs is not None else 0
+
+async def stop_proof_log_buffer() -> None:
+    global _proof_logs
+    if _proof_logs is not None:
+        await _proof_logs.stop()
+        _proof_logs = None
@@ -0,0 +1,125 @@
+import hashlib
+import io
+import struct
+import time
+import zipfile
+
+# Size of the buffer reused for copying member data
+COPY_BUFFER_SIZE = 1024 * 1024
+
+# Data descriptor and filename encoding flags describe the source entry only
+_PASSTHROUGH_FLAG_MASK = 0x06
+
+def _copy_exact(src, dst, size: int, buffer: bytearray) -> None:
+    """Copy exactly `size` bytes from `src` to `dst` through `buffer`."""
+    view = memoryview(buffer)
+    while size > 0:
+        read = src.readinto(view[:min(size, len(view))])
+        if not read:
+            raise zipfile.BadZipFile("Truncated ZIP member data")
+        dst.write(view[:read])
+        size -= read
+
+def copy_member_raw(src_fp, info: zipfile.ZipInfo, dst_zip: zipfile.ZipFile, arcname: str,
+                    buffer: bytearray = None) -> None:
+    """Copy a member's compressed bytes verbatim from one ZIP into another.
+
+    `src_fp` is a binary file object over the source archive that `info` was
+    read from. The data is neither inflated nor deflated again: the CRC,
+    sizes and compression method of the source entry are kept as they are,
+    only the name changes to `arcname`.
+    """
+    if info.flag_bits & 0x01:
+        raise ValueError(f"Cannot copy encrypted ZIP member {info.filename}")
+    buffer = buffer if buffer is not None else bytearray(COPY_BUFFER_SIZE)
+
+    # Skip the source local file header to find where the data starts
+    src_fp.seek(info.header_offset)
+    header = src_fp.read(zipfile.sizeFileHeader)
+    if len(header) != zipfile.sizeFileHeader or header[:4] != zipfile.stringFileHeader:
+        raise zipfile.BadZipFile(f"Bad local file header for {info.filename}")
+    name_length, extra_length = struct.unpack("<HH", header[26:30])
+    src_fp.seek(info.header_offset + zipfile.sizeFileHeader + name_length + extra_length)
+
+    zinfo = zipfile.ZipInfo(arcname, date_time=info.date_time)
+    zinfo.compress_type = info.compress_type
+    zinfo.flag_bits = info.flag_bits & _PASSTHROUGH_FLAG_MASK
+    zinfo.external_attr = info.external_attr
+    zinfo.CRC = info.CRC
+    zinfo.compress_size = info.compress_size
+    zinfo.file_size = info.file_size
+    zip64 = max(info.file_size, info.compress_size) > zipfile.ZIP64_LIMIT
+
+    # Mirrors what ZipFile.write does for a member, minus the compressor
+    with dst_zip._lock:
+        if dst_zip._seekable:
+            dst_zip.fp.seek(dst_zip.start_dir)
+        zinfo.header_offset = dst_zip.fp.tell()
+        dst_zip._writecheck(zinfo)
+        dst_zip._didModify = True
+        dst_zip.fp.write(zinfo.FileHeader(zip64))
+        _copy_exact(src_fp, dst_zip.fp, info.compress_size, buffer)
+        dst_zip.filelist.append(zinfo)
+        dst_zip.NameToInfo[zinfo.filename] = zinfo
+        dst_zip.start_dir = dst_zip.fp.tell()
+
+
+class HashingWriter(io.RawIOBase):
+    """Write-only file wrapper that hashes every byte on its way to `fp`.
+
+    It reports itself as not seekable, so ZipFile streams members with data
+    descriptors instead of seeking back to patch headers, and the digest is
+    always that of the bytes in the file. Small writes are gathered into one
+    reused buffer before they are hashed and written. `hash_seconds` is the
+    time spent hashing.
+    """
+
+    def __init__(self, fp, hash_obj=None, buffer_size: int = COPY_BUFFER_SIZE):
+        self._fp = fp
+        self._hash = hash_obj if hash_obj is not None else hashlib.sha3_256()
+        self._buffer = bytearray(buffer_size)
+        self._view = memoryview(self._buffer)
+        self._pending = 0
+        self._offset = 0
+        self.hash_seconds = 0.0
+
+    def writable(self) -> bool:
+        return True
+
+    def tell(self) -> int:
+        return self._offset
+
+    def write(self, b) -> int:
+        data = memoryview(b).cast("B")
+        size = len(data)
+        if self._pending + size > len(self._buffer):
+            self._flush_buffer()
+        if size >= len(self._buffer):
+            self._update(data)
+            self._fp.write(data)
+        else:
+            self._view[self._pending:self._pending + size] = data
+            self._pending += size
+        self._offset += size
+        return size
+
+    def _update(self, data) -> None:
+        start = time.perf_counter()
+        self._hash.update(data)
+        self.hash_seconds += time.perf_counter() - start
+
+    def _flush_buffer(self) -> None:
+        if self._pending:
+            chunk = self._view[:self._pending]
+            self._update(chunk)
+            self._fp.write(chunk)
+            self._pending = 0
+
+    def flush(self) -> None:
+        self._flush_buffer()
+        self._fp.flush()
+
+    def hexdigest(self) -> str:
+        """The digest of everything written so far."""
+        self._flush_buffer()
+        return self._hash.hexdigest()
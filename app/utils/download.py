@@ -0,0 +1,228 @@
+import asyncio
+import logging
+import os
+import re
+from app.core.config import settings
+
+logger = logging.getLogger(__name__)
+
+_CONTENT_RANGE = re.compile(r"bytes (\d+)-(\d+)/(\d+)")
+
+class DownloadError(Exception):
+    pass
+
+class DownloadTooLargeError(DownloadError):
+    pass
+
+class ExportInfo:
+    """What a probe learnt about a download: its size if known, and whether it can be fetched in ranges."""
+
+    def __init__(self, size: int = None, ranges: bool = False):
+        self.size = size
+        self.ranges = ranges
+
+
+class _BufferedFileWriter:
+    """Gathers the chunks of one byte range in a reused buffer and writes it at its offset.
+
+    Disk writes run in a thread with `os.pwrite`, so parts write concurrently
+    into the same file without seeking and without blocking the event loop.
+    """
+
+    def __init__(self, fd: int, buffer: bytearray):
+        self.fd = fd
+        self.buffer = buffer
+        self.view = memoryview(buffer)
+        self.offset = 0
+        self.pending = 0
+
+    def start(self, offset: int) -> None:
+        self.offset = offset
+        self.pending = 0
+
+    async def write(self, chunk: bytes) -> None:
+        chunk = memoryview(chunk)
+        while chunk:
+            size = min(len(chunk), len(self.buffer) - self.pending)
+            self.view[self.pending:self.pending + size] = chunk[:size]
+            self.pending += size
+            chunk = chunk[size:]
+            if self.pending == len(self.buffer):
+                await self.flush()
+
+    async def flush(self) -> None:
+        written = 0
+        while written < self.pending:
+            written += await asyncio.to_thread(
+                os.pwrite, self.fd, self.view[written:self.pending], self.offset + written
+            )
+        self.offset += self.pending
+        self.pending = 0
+
+
+class Downloader:
+    """Application-lifetime HTTP downloader for export archives.
+
+    Servers that answer a one-byte range request with `206` get the file
+    fetched as `part_size` byte ranges, `concurrency` at a time, each written
+    at its offset into a preallocated file. Anything else is streamed over
+    a single connection. Failed ranges are retried from where they stopped,
+    up to `max_retries` times.
+    """
+
+    def __init__(self, part_size: int = 16 * 1024 * 1024, concurrency: int = 8, buffer_size: int = 1024 * 1024,
+                 max_retries: int = 3):
+        self.part_size = part_size
+        self.concurrency = max(1, concurrency)
+        self.buffer_size = buffer_size
+        self.max_retries = max_retries
+        self._loop = None
+        self._session = None
+
+    def _start(self) -> None:
+        # Sessions belong to one event loop, start over if it changed
+        loop = asyncio.get_running_loop()
+        if self._loop is loop and self._session is not None and not self._session.closed:
+            return
+        # Imported on first use, so startup doesn't pay for it
+        import aiohttp
+        self._loop = loop
+        self._session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=0, ttl_dns_cache=300),
+            timeout=aiohttp.ClientTimeout(total=None, sock_connect=30, sock_read=60),
+        )
+
+    async def close(self) -> None:
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+        self._loop = None
+
+    async def probe(self, url: str) -> ExportInfo:
+        """Find the size of `url` and whether it can be downloaded in ranges, without downloading it."""
+        self._start()
+        # A ranged GET rather than a HEAD, presigned S3 links are only signed for GET
+        async with self._session.get(url, headers={"Range": "bytes=0-0"}, ssl=False) as resp:
+            if resp.status == 206:
+                match = _CONTENT_RANGE.fullmatch(resp.headers.get("Content-Range", ""))
+                await resp.read()
+                return ExportInfo(int(match.group(3)) if match else None, ranges=match is not None)
+            if resp.status == 200:
+                # No range support, leave the body unread
+                resp.release()
+                return ExportInfo(resp.content_length, ranges=False)
+            raise DownloadError(f"HTTP {resp.status} downloading the export")
+
+    async def download(self, url: str, path: str, info: ExportInfo = None, max_size: int = None) -> int:
+        """Download `url` into the file at `path`, returning its size in bytes.
+
+        `info` is the result of an earlier probe of `url`. Downloads larger
+        than `max_size` raise DownloadTooLargeError, before anything is
+        fetched when the size is known up front.
+        """
+        self._start()
+        info = info if info is not None else await self.probe(url)
+        if max_size is not None and info.size is not None and info.size > max_size:
+            raise DownloadTooLargeError(f"The export is {info.size} bytes, more than {max_size}")
+
+        if info.ranges and self.concurrency > 1 and info.size > self.part_size:
+            return await self._download_ranges(url, path, info.size)
+
+        # No range support, or one part is all it takes
+        async with self._session.get(url, ssl=False) as resp:
+            if resp.status != 200:
+                raise DownloadError(f"HTTP {resp.status} downloading the export")
+            return await self._stream(resp, path, max_size)
+
+    async def _stream(self, resp, path: str, max_size: int = None) -> int:
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        try:
+            writer = _BufferedFileWriter(fd, bytearray(self.buffer_size))
+            async for chunk in resp.content.iter_chunked(self.buffer_size):
+                # Servers that don't announce a size are held to the limit as they send
+                if max_size is not None and writer.offset + writer.pending + len(chunk) > max_size:
+                    raise DownloadTooLargeError(f"The export is more than {max_size} bytes")
+                await writer.write(chunk)
+            await writer.flush()
+            size = writer.offset
+        finally:
+            os.close(fd)
+        if resp.content_length is not None and size != resp.content_length:
+            raise DownloadError(f"Downloaded {size} of {resp.content_length} bytes")
+        return size
+
+    async def _download_ranges(self, url: str, path: str, size: int) -> int:
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC, 0o600)
+        try:
+            # Reserve the whole file up front, so parts never extend it concurrently
+            if hasattr(os, "posix_fallocate"):
+                try:
+                    os.posix_fallocate(fd, 0, size)
+                except OSError:
+                    os.ftruncate(fd, size)
+            else:
+                os.ftruncate(fd, size)
+
+            ranges = iter(range(0, size, self.part_size))
+
+            async def worker():
+                writer = _BufferedFileWriter(fd, bytearray(self.buffer_size))
+                for start in ranges:
+                    await self._download_range(url, writer, start, min(start + self.part_size, size) - 1)
+
+            workers = [asyncio.ensure_future(worker()) for _ in range(min(self.concurrency, -(-size // self.part_size)))]
+            try:
+                await asyncio.gather(*workers)
+            except BaseException:
+                for task in workers:
+                    task.cancel()
+                await asyncio.gather(*workers, return_exceptions=True)
+                raise
+        finally:
+            os.close(fd)
+        return size
+
+    async def _download_range(self, url: str, writer: _BufferedFileWriter, start: int, end: int) -> None:
+        import aiohttp
+        offset = start
+        for attempt in range(self.max_retries + 1):
+            writer.start(offset)
+            try:
+                async with self._session.get(url, headers={"Range": f"bytes={offset}-{end}"}, ssl=False) as resp:
+                    if resp.status != 206:
+                        raise DownloadError(f"HTTP {resp.status} for bytes {offset}-{end}")
+                    async for chunk in resp.content.iter_chunked(self.buffer_size):
+                        await writer.write(chunk)
+                await writer.flush()
+                if writer.offset == end + 1:
+                    return
+                raise DownloadError(f"Range {offset}-{end} ended at {writer.offset}")
+            except (DownloadError, aiohttp.ClientError, asyncio.TimeoutError) as e:
+                # Keep what was received and ask for the rest
+                await writer.flush()
+                offset = writer.offset
+                if attempt == self.max_retries:
+                    raise DownloadError(f"Failed to download bytes {start}-{end}: {e}")
+                logger.warning(f"Retrying bytes {offset}-{end}: {e}")
+                await asyncio.sleep(0.5 * 2 ** attempt)
+
+
+_downloader = None
+
+def get_downloader() -> Downloader:
+    """The downloader shared by every proof generation."""
+    global _downloader
+    if _downloader is None:
+        _downloader = Downloader(
+            part_size=settings.DOWNLOAD_PART_SIZE,
+            concurrency=settings.DOWNLOAD_CONCURRENCY,
+            buffer_size=settings.IO_BUFFER_SIZE,
+            max_retries=settings.DOWNLOAD_MAX_RETRIES,
+        )
+    return _downloader
+
+async def close_downloader() -> None:
+    global _downloader
+    if _downloader is not None:
+        await _downloader.close()
+        _downloader = None
@@ -0,0 +1,186 @@
+import asyncio
+import logging
+import random
+import time
+from app.core.config import settings
+from app.utils.metrics import GEOCODE_UPSTREAM_REQUESTS
+
+logger = logging.getLogger(__name__)
+
+# Returned when a postal code could not be fetched
+UNKNOWN_POSTAL_CODE = "UNKNOWN"
+
+# Geocoder statuses worth asking again after a pause
+RETRY_STATUSES = ("OVER_QUERY_LIMIT", "UNKNOWN_ERROR")
+
+class TokenBucket:
+    """Async token bucket allowing `rate` acquisitions per second, in bursts of up to `burst`."""
+
+    def __init__(self, rate: float, burst: int):
+        self.rate = rate
+        self.burst = max(1, burst)
+        self._tokens = float(self.burst)
+        self._updated_at = time.monotonic()
+        self._lock = asyncio.Lock()
+
+    async def acquire(self) -> None:
+        if self.rate <= 0:
+            return
+        async with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(self.burst, self._tokens + (now - self._updated_at) * self.rate)
+                self._updated_at = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                await asyncio.sleep((1 - self._tokens) / self.rate)
+
+
+class _RetryableError(Exception):
+    pass
+
+
+class GeocodingClient:
+    """Application-lifetime client for the Google Geocoding API.
+
+    All requests share one pooled connection, are capped at `max_concurrency`
+    in flight and `rate` per second, and are retried with exponential backoff
+    when the geocoder asks us to slow down. Concurrent lookups of the same
+    location share a single upstream call.
+    """
+
+    def __init__(
+        self,
+        api_key: str,
+        url: str,
+        max_concurrency: int = 10,
+        rate: float = 40,
+        burst: int = 40,
+        max_retries: int = 3,
+        backoff: float = 0.5,
+        timeout: float = 10,
+    ):
+        self.api_key = api_key
+        self.url = url
+        self.max_concurrency = max_concurrency
+        self.rate = rate
+        self.burst = burst
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.timeout = timeout
+        self.upstream_calls = 0
+        self._loop = None
+        self._session = None
+
+    def _start(self) -> None:
+        # Sessions and locks belong to one event loop, start over if it changed
+        loop = asyncio.get_running_loop()
+        if self._loop is loop and self._session is not None and not self._session.closed:
+            return
+        # Imported on first use, so startup doesn't pay for it
+        import aiohttp
+        self._loop = loop
+        self._session = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(limit=self.max_concurrency, ttl_dns_cache=300),
+            timeout=aiohttp.ClientTimeout(total=self.timeout),
+        )
+        self._semaphore = asyncio.Semaphore(self.max_concurrency)
+        self._bucket = TokenBucket(self.rate, self.burst)
+        self._inflight = dict()
+
+    async def close(self) -> None:
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+        self._loop = None
+
+    async def postal_code(self, location: str) -> str:
+        """Fetch the postal code of a single location, or "UNKNOWN"."""
+        self._start()
+        future = self._inflight.get(location)
+        if future is None:
+            future = asyncio.ensure_future(self._fetch(location))
+            self._inflight[location] = future
+            future.add_done_callback(lambda _: self._inflight.pop(location, None))
+        # Shield the shared call from the cancellation of any one waiter
+        return await asyncio.shield(future)
+
+    async def postal_codes(self, locations) -> dict:
+        """Fetch the postal codes of many locations, returning a dict of location to postal code."""
+        locations = list(locations)
+        results = await asyncio.gather(*(self.postal_code(location) for location in locations))
+        return dict(zip(locations, results))
+
+    async def _fetch(self, location: str) -> str:
+        import aiohttp
+        for attempt in range(self.max_retries + 1):
+            if attempt:
+                # Exponential backoff with jitter, so retries don't arrive together
+                await asyncio.sleep(self.backoff * 2 ** (attempt - 1) * (0.5 + random.random()))
+            try:
+                return await self._request(location)
+            except _RetryableError as e:
+                GEOCODE_UPSTREAM_REQUESTS.inc(outcome="retry")
+                error = e
+            except (aiohttp.ClientError, asyncio.TimeoutError) as e:
+                GEOCODE_UPSTREAM_REQUESTS.inc(outcome="error")
+                error = e
+            except (ValueError, KeyError, IndexError, TypeError) as e:
+                # A body that isn't JSON, or not shaped like a geocoding
+                # response, won't get better on a retry
+                GEOCODE_UPSTREAM_REQUESTS.inc(outcome="error")
+                logger.warning(f"Malformed geocoding response for {location}: {e!r}")
+                return UNKNOWN_POSTAL_CODE
+        logger.warning(f"Error fetching postal code for {location}: {error}")
+        return UNKNOWN_POSTAL_CODE
+
+    async def _request(self, location: str) -> str:
+        await self._bucket.acquire()
+        async with self._semaphore:
+            self.upstream_calls += 1
+            async with self._session.get(self.url, params={"address": location, "key": self.api_key}) as response:
+                if response.status == 429 or response.status >= 500:
+                    raise _RetryableError(f"HTTP {response.status}")
+                data = await response.json(content_type=None)
+
+        if data["status"] == "OK":
+            for component in data["results"][0]["address_components"]:
+                if "postal_code" in component["types"]:
+                    GEOCODE_UPSTREAM_REQUESTS.inc(outcome="ok")
+                    return component["long_name"]
+            GEOCODE_UPSTREAM_REQUESTS.inc(outcome="not_found")
+            return UNKNOWN_POSTAL_CODE
+        if data["status"] in RETRY_STATUSES:
+            raise _RetryableError(data["status"])
+        if data["status"] == "ZERO_RESULTS":
+            GEOCODE_UPSTREAM_REQUESTS.inc(outcome="not_found")
+        else:
+            GEOCODE_UPSTREAM_REQUESTS.inc(outcome="error")
+            logger.error(f"Error fetching postal code for {location}: {data['status']} (check the GoogleMaps API Key)")
+        return UNKNOWN_POSTAL_CODE
+
+
+_geocoder = None
+
+def get_geocoder() -> GeocodingClient:
+    """The geocoding client shared by every request."""
+    global _geocoder
+    if _geocoder is None:
+        _geocoder = GeocodingClient(
+            api_key=settings.GMAPS_API_KEY,
+            url=settings.GEOCODE_API_URL,
+            max_concurrency=settings.GEOCODE_MAX_CONCURRENCY,
+            rate=settings.GEOCODE_RATE_LIMIT,
+            burst=settings.GEOCODE_RATE_BURST,
+            max_retries=settings.GEOCODE_MAX_RETRIES,
+            backoff=settings.GEOCODE_RETRY_BACKOFF,
+            timeout=settings.GEOCODE_TIMEOUT,
+        )
+    return _geocoder
+
+async def close_geocoder() -> None:
+    global _geocoder
+    if _geocoder is not None:
+        await _geocoder.close()
+        _geocoder = None
@@ -1,20 +1,353 @@
-from datasketch import MinHash
+from datasketch import MinHash, LeanMinHash, MinHashLSHForest
+from datasketch.hashfunc import sha1_hash32
+from functools import lru_cache
+from app.core.config import settings
 import base64
 import json
 import numpy as np
-import os
+import threading
+import time
+
+# Signatures are stored and sent as little-endian uint64 hash values
+HASHVALUES_DTYPE = np.dtype('<u8')
+
+# Checked once here instead of on every signature
+NUM_PERM = settings.MINHASH_NUM_PERM
+if NUM_PERM < 2:
+    raise ValueError(f"MINHASH_NUM_PERM must be at least 2, got {NUM_PERM}")
 
 def serialize_minhash(minhash: MinHash) -> str:
     """Serialize a MinHash object to a JSON string."""
-    minhash_dict = {
-        'seed': minhash.seed,
-        'hashvalues': base64.b64encode(minhash.hashvalues.tobytes()).decode('ascii')
-    }
-    return json.dumps(minhash_dict)
+    return serialize_signature(minhash.seed, minhash.hashvalues)
 
 def deserialize_minhash(json_str: str) -> MinHash:
     """Deserialize a JSON string to a MinHash object."""
     minhash_dict = json.loads(json_str)
-    minhash = MinHash(num_perm=int(os.getenv('NUM_PERM', 128)), seed=minhash_dict['seed'])
-    minhash.hashvalues = np.frombuffer(base64.b64decode(minhash_dict['hashvalues']), dtype=np.uint64)
-    return minhash
\ No newline at end of file
+    return build_minhash(minhash_dict['seed'], decode_hashvalues(base64.b64decode(minhash_dict['hashvalues'])))
+
+def build_minhash(seed: int, hashvalues: np.ndarray) -> LeanMinHash:
+    """Wrap stored hash values in a LeanMinHash without copying them.
+
+    Stored signatures are only compared and indexed, never updated, so they
+    don't need the permutation tables a full MinHash generates on creation.
+    """
+    if len(hashvalues) != NUM_PERM:
+        raise ValueError(f"Expected {NUM_PERM} hash values, got {len(hashvalues)}")
+    minhash = LeanMinHash.__new__(LeanMinHash)
+    minhash.seed = int(seed)
+    minhash.hashvalues = hashvalues
+    return minhash
+
+@lru_cache(maxsize=16)
+def get_permutations(seed: int, num_perm: int) -> np.ndarray:
+    """Permutation tables for a (seed, num_perm) pair, generated once."""
+    permutations = MinHash(num_perm=num_perm, seed=seed).permutations
+    permutations.setflags(write=False)
+    return permutations
+
+def new_minhash(seed: int = 1) -> MinHash:
+    """Create an empty, updatable MinHash that reuses the cached permutation tables."""
+    return MinHash(num_perm=NUM_PERM, seed=seed, permutations=get_permutations(seed, NUM_PERM))
+
+def encode_hashvalues(hashvalues: np.ndarray) -> bytes:
+    """Encode hash values as raw little-endian uint64 bytes for storage."""
+    return np.asarray(hashvalues, dtype=HASHVALUES_DTYPE).tobytes()
+
+def decode_hashvalues(buf) -> np.ndarray:
+    """View raw stored bytes as hash values, without copying them."""
+    return np.frombuffer(buf, dtype=HASHVALUES_DTYPE)
+
+def minhash_to_columns(minhash: MinHash) -> dict:
+    """Split a MinHash object into the columns of the `minhashes` table."""
+    return {
+        'seed': int(minhash.seed),
+        'num_perm': len(minhash.hashvalues),
+        'hashvalues': encode_hashvalues(minhash.hashvalues),
+    }
+
+def minhash_from_columns(seed: int, hashvalues) -> MinHash:
+    """Build a MinHash object from the columns of the `minhashes` table."""
+    return build_minhash(seed, decode_hashvalues(hashvalues))
+
+def serialize_signature(seed: int, hashvalues: np.ndarray) -> str:
+    """Serialize a raw signature to the same JSON string as `serialize_minhash`."""
+    minhash_dict = {
+        'seed': int(seed),
+        'hashvalues': base64.b64encode(hashvalues.tobytes()).decode('ascii')
+    }
+    return json.dumps(minhash_dict)
+
+
+# The universal hashing datasketch applies to every 32-bit hash, one row per permutation
+_MERSENNE_PRIME = np.uint64((1 << 61) - 1)
+_MAX_HASH = np.uint64((1 << 32) - 1)
+
+class SignatureBuilder:
+    """Builds a MinHash signature from batches of shingles.
+
+    Every shingle is hashed once, then whole batches go through all the
+    permutations as one `(num_perm, batch_size)` matrix operation instead of
+    a Python loop per shingle. The result equals a datasketch MinHash updated
+    with every shingle as UTF-8 bytes, so it compares with the signatures
+    clients compute with datasketch defaults. `seconds` is the time spent
+    hashing.
+    """
+
+    def __init__(self, seed: int = 1, num_perm: int = NUM_PERM, batch_size: int = 4096):
+        self.seed = seed
+        self.batch_size = max(1, batch_size)
+        self.hashvalues = np.full(num_perm, _MAX_HASH, dtype=np.uint64)
+        self.shingles = 0
+        self.seconds = 0.0
+        self._a, self._b = get_permutations(seed, num_perm)
+
+    @property
+    def empty(self) -> bool:
+        return self.shingles == 0
+
+    def update(self, shingles) -> None:
+        """Add an iterable of distinct string shingles to the signature."""
+        start = time.perf_counter()
+        hv = np.fromiter((sha1_hash32(shingle.encode("utf-8")) for shingle in shingles), dtype=np.uint64)
+        a, b = self._a[:, np.newaxis], self._b[:, np.newaxis]
+        for offset in range(0, len(hv), self.batch_size):
+            # Wraps around on overflow exactly like datasketch does
+            phv = (a * hv[np.newaxis, offset:offset + self.batch_size] + b) % _MERSENNE_PRIME & _MAX_HASH
+            np.minimum(self.hashvalues, phv.min(axis=1), out=self.hashvalues)
+        self.shingles += len(hv)
+        self.seconds += time.perf_counter() - start
+
+    def merge(self, other: "SignatureBuilder") -> None:
+        """Fold in a builder of the same seed, e.g. the copy a worker process sent back."""
+        if other is self:
+            return
+        if other.seed != self.seed or len(other.hashvalues) != len(self.hashvalues):
+            raise ValueError("Cannot merge signatures of different seeds or sizes")
+        np.minimum(self.hashvalues, other.hashvalues, out=self.hashvalues)
+        self.shingles += other.shingles
+        self.seconds += other.seconds
+
+    def minhash(self) -> LeanMinHash:
+        return build_minhash(self.seed, self.hashvalues.astype(HASHVALUES_DTYPE))
+
+
+class SignatureMatrix:
+    """All stored signatures in one contiguous uint64 matrix, keyed by minhash ID.
+
+    Row `i` holds the hash values of one signature, so the similarity of a
+    query against any set of candidates is a single vectorized comparison.
+    """
+
+    def __init__(self, num_perm: int, capacity: int = 1024):
+        self.num_perm = num_perm
+        self._hashvalues = np.empty((capacity, num_perm), dtype=np.uint64)
+        self._seeds = np.empty(capacity, dtype=np.int64)
+        self._user_ids = []
+        self._rows = {}
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._rows)
+
+    def __contains__(self, minhash_id: int) -> bool:
+        return minhash_id in self._rows
+
+    def __getstate__(self):
+        size = len(self._user_ids)
+        return {
+            'num_perm': self.num_perm,
+            'hashvalues': self._hashvalues[:size],
+            'seeds': self._seeds[:size],
+            'user_ids': self._user_ids,
+            'rows': self._rows,
+        }
+
+    def __setstate__(self, state):
+        self.num_perm = state['num_perm']
+        self._hashvalues = np.array(state['hashvalues'], dtype=np.uint64)
+        self._seeds = np.array(state['seeds'], dtype=np.int64)
+        self._user_ids = state['user_ids']
+        self._rows = state['rows']
+        self._lock = threading.Lock()
+
+    def _reserve(self, extra: int) -> None:
+        """Grow the matrix so `extra` more rows fit. Caller holds the lock."""
+        needed = len(self._user_ids) + extra
+        capacity = len(self._hashvalues)
+        if needed <= capacity:
+            return
+        while capacity < needed:
+            capacity = max(capacity * 2, 1)
+        hashvalues = np.empty((capacity, self.num_perm), dtype=np.uint64)
+        seeds = np.empty(capacity, dtype=np.int64)
+        size = len(self._user_ids)
+        hashvalues[:size] = self._hashvalues[:size]
+        seeds[:size] = self._seeds[:size]
+        # Swap in whole arrays so concurrent readers keep a consistent view
+        self._hashvalues, self._seeds = hashvalues, seeds
+
+    def add_many(self, entries) -> None:
+        """Add `(minhash_id, user_id, minhash)` entries, skipping known IDs."""
+        entries = [entry for entry in entries if entry[0] not in self._rows]
+        with self._lock:
+            self._reserve(len(entries))
+            for minhash_id, user_id, minhash in entries:
+                if minhash_id in self._rows or len(minhash.hashvalues) != self.num_perm:
+                    continue
+                row = len(self._user_ids)
+                self._hashvalues[row] = minhash.hashvalues
+                self._seeds[row] = minhash.seed
+                self._user_ids.append(user_id)
+                self._rows[minhash_id] = row
+
+    def add(self, minhash_id: int, user_id: str, minhash: MinHash) -> None:
+        self.add_many([(minhash_id, user_id, minhash)])
+
+    def remove_many(self, minhash_ids) -> None:
+        """Forget signatures. Their rows stay allocated until `compact()`."""
+        with self._lock:
+            for minhash_id in minhash_ids:
+                self._rows.pop(minhash_id, None)
+
+    def ids(self) -> list:
+        with self._lock:
+            return list(self._rows)
+
+    @property
+    def dead_rows(self) -> int:
+        return len(self._user_ids) - len(self._rows)
+
+    def compact(self) -> None:
+        """Drop the rows of removed signatures, renumbering the rest."""
+        with self._lock:
+            if not self.dead_rows:
+                return
+            ids = list(self._rows)
+            old_rows = np.fromiter((self._rows[minhash_id] for minhash_id in ids), dtype=np.intp, count=len(ids))
+            capacity = max(len(ids), 1)
+            hashvalues = np.empty((capacity, self.num_perm), dtype=np.uint64)
+            seeds = np.empty(capacity, dtype=np.int64)
+            hashvalues[:len(ids)] = self._hashvalues[old_rows]
+            seeds[:len(ids)] = self._seeds[old_rows]
+            self._user_ids = [self._user_ids[row] for row in old_rows]
+            self._rows = {minhash_id: row for row, minhash_id in enumerate(ids)}
+            self._hashvalues, self._seeds = hashvalues, seeds
+
+    def get(self, minhash_id: int):
+        """Return `(user_id, seed, hashvalues)` for a stored signature, or None."""
+        with self._lock:
+            row = self._rows.get(minhash_id)
+            if row is None:
+                return None
+            return self._user_ids[row], int(self._seeds[row]), self._hashvalues[row]
+
+    def entries(self):
+        """Yield `(minhash_id, user_id, minhash)` for every stored signature."""
+        with self._lock:
+            rows, user_ids, seeds, hashvalues = dict(self._rows), self._user_ids, self._seeds, self._hashvalues
+        for minhash_id, row in rows.items():
+            yield minhash_id, user_ids[row], build_minhash(int(seeds[row]), hashvalues[row])
+
+    def jaccard(self, minhash: MinHash, minhash_ids) -> dict:
+        """Estimate the Jaccard similarity of `minhash` against stored signatures.
+
+        Returns a dict of minhash ID to similarity. IDs that are not stored, or
+        whose seed differs from the query's, are left out.
+        """
+        if len(minhash.hashvalues) != self.num_perm:
+            return {}
+        # Writers update `_rows` in place and `compact()` renumbers rows, so
+        # resolve the rows and copy them out under the lock, as `get` does
+        with self._lock:
+            ids, indices = [], []
+            for minhash_id in minhash_ids:
+                row = self._rows.get(minhash_id)
+                if row is not None:
+                    ids.append(minhash_id)
+                    indices.append(row)
+            if not ids:
+                return {}
+            indices = np.asarray(indices, dtype=np.intp)
+            hashvalues, seeds = self._hashvalues[indices], self._seeds[indices]
+
+        matches = np.count_nonzero(hashvalues == minhash.hashvalues, axis=1)
+        similarities = matches / float(self.num_perm)
+        same_seed = seeds == minhash.seed
+        return {
+            minhash_id: float(similarity)
+            for minhash_id, similarity, ok in zip(ids, similarities, same_seed)
+            if ok
+        }
+
+
+class ForestIndex:
+    """A MinHashLSHForest for top-k queries that can be shared between threads.
+
+    New entries are only searchable after `index()` re-sorts the prefix
+    trees, so that is deferred until the next query after a change.
+    """
+
+    def __init__(self, num_perm: int, l: int):
+        self.num_perm = num_perm
+        self.l = l
+        self.forest = MinHashLSHForest(num_perm=num_perm, l=l)
+        self._removed = set()
+        self._dirty = False
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self.forest.keys) - len(self._removed)
+
+    def __getstate__(self):
+        return {'forest': self.forest, 'dirty': self._dirty, 'removed': self._removed}
+
+    def __setstate__(self, state):
+        self.forest = state['forest']
+        self.num_perm = self.forest.k * self.forest.l
+        self.l = self.forest.l
+        self._dirty = state['dirty']
+        self._removed = state.get('removed', set())
+        self._lock = threading.Lock()
+
+    def add_many(self, entries) -> None:
+        """Add `(key, minhash)` entries, skipping known keys."""
+        with self._lock:
+            for key, minhash in entries:
+                if key not in self.forest.keys:
+                    self.forest.add(key, minhash)
+                    self._dirty = True
+                else:
+                    # Keys are never reused for another signature
+                    self._removed.discard(key)
+
+    def remove_many(self, keys) -> None:
+        """Hide keys from queries. The prefix trees keep them until `rebuild()`."""
+        with self._lock:
+            self._removed.update(key for key in keys if key in self.forest.keys)
+
+    @property
+    def removed(self) -> int:
+        return len(self._removed)
+
+    def rebuild(self, entries) -> None:
+        """Replace the index with one over the `(key, minhash)` entries."""
+        forest = MinHashLSHForest(num_perm=self.num_perm, l=self.l)
+        for key, minhash in entries:
+            forest.add(key, minhash)
+        forest.index()
+        with self._lock:
+            self.forest, self._removed, self._dirty = forest, set(), False
+
+    def add(self, key, minhash: MinHash) -> None:
+        self.add_many([(key, minhash)])
+
+    def query(self, minhash: MinHash, k: int) -> list:
+        with self._lock:
+            if self._dirty:
+                self.forest.index()
+                self._dirty = False
+            if not self._removed:
+                return self.forest.query(minhash, k)
+            # Ask for enough keys that removed ones don't crowd out live ones
+            keys = self.forest.query(minhash, k + len(self._removed))
+            return [key for key in keys if key not in self._removed][:k]
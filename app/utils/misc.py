@@ -1,146 +1,260 @@
 import hashlib
-import aiohttp
+import re
 import time
 import tempfile
-import aiofiles
 import zipfile
 import os
-import pandas as pd
 import io
-import asyncio
+import logging
 from app.core.config import settings
+from app.utils.archive import copy_member_raw, HashingWriter
+from app.utils.geocoder import get_geocoder
+from app.utils.download import get_downloader
+from app.utils.workers import run_in_worker
+from app.utils.metrics import STAGE_SECONDS, BYTES_PROCESSED
+from app.services.geocode import resolve_postal_codes
 from urllib.parse import urlparse
 
-GMAPS_API_KEY = settings.GMAPS_API_KEY
+logger = logging.getLogger(__name__)
 
-async def fetch_postal_code(session, location):
-    if location in ["Not Applicable", "Not Available"]:
-        return location
-    
-    """Fetch postal code for a single location."""
-    try:
-        async with session.get(
-            "https://maps.googleapis.com/maps/api/geocode/json",
-            params={"address": location, "key": GMAPS_API_KEY},
-        ) as response:
-            data = await response.json()
-            if data["status"] == "OK":
-                for component in data["results"][0]["address_components"]:
-                    if "postal_code" in component["types"]:
-                        return component["long_name"]
-            else:
-                raise Exception("Invalid GoogleMaps API Key")
-    except Exception as e:
-        print(f"Error fetching postal code for {location}: {e}")
-    return "UNKNOWN"
-
-async def get_postal_codes(locations: pd.Series) -> pd.Series:
-    """Fetch postal codes for multiple locations concurrently."""
-    unique_locations = locations.unique()
-    async with aiohttp.ClientSession() as session:
-        tasks = [fetch_postal_code(session, loc) for loc in unique_locations]
-        postal_code_results = await asyncio.gather(*tasks)
-    postal_code_dict = dict(zip(unique_locations, postal_code_results))
-    return locations.map(postal_code_dict)
-
-async def modify_zip(input_zip_path, output_zip_path):
-    """Modify the ZIP file by removing or adding files."""
-    interested_files = [
-        "Retail.CartItems.1.csv",
-        "Digital Items.csv",
-        "Retail.OrderHistory.1.csv",
-        "Retail.OrderHistory.2.csv",
-        "Audible.PurchaseHistory.csv",
-        "Audible.Library.csv",
-        "Audible.MembershipBillings.csv",
-        "PrimeVideo.ViewingHistory.csv",
-    ]
-    
-    column_modifications = {
-        "Digital Items.csv": [
-            "ShipFrom",
-            "ShipTo",
-        ],
-        "Retail.OrderHistory.1.csv": {
-            "Shipping Address",
-            "Billing Address",
-        },
-        "Retail.OrderHistory.2.csv": {
-            "Shipping Address",
-            "Billing Address",
-        },
-    }
-    
+async def fetch_postal_codes(locations) -> dict:
+    """Fetch postal codes for multiple locations through the shared geocoding client."""
+    return await get_geocoder().postal_codes(locations)
+
+async def get_postal_codes(locations) -> dict:
+    """Resolve postal codes for multiple locations, going through the geocode cache.
+
+    Returns a dict mapping every location to its postal code.
+    """
+    return await resolve_postal_codes(list(locations), fetch_postal_codes)
+
+def collect_locations(original_zip, file_name, columns) -> set:
+    """Collect the distinct values of `columns` in a CSV member, chunk by chunk."""
+    # Imported on first use, pandas adds a fifth to the enclave's startup time
+    import pandas as pd
+    locations = set()
+    with original_zip.open(file_name) as file_data:
+        try:
+            chunks = pd.read_csv(
+                file_data,
+                chunksize=settings.CSV_CHUNK_ROWS,
+                dtype=str,
+                keep_default_na=False,
+                encoding="utf-8",
+                usecols=lambda col: col in columns,
+            )
+            for df in chunks:
+                for col in df.columns:
+                    locations.update(df[col].unique())
+        except pd.errors.EmptyDataError:
+            pass
+    return locations
+
+_WORD = re.compile(r"\w+")
+
+def order_history_shingles(df, words: int) -> set:
+    """The shingles of an order history chunk: its ASINs, and runs of `words` words of its product titles."""
+    shingles = set()
+    if "ASIN" in df.columns:
+        asins = df["ASIN"].str.strip().str.upper().unique()
+        shingles.update("asin:" + asin for asin in asins if asin)
+    if "Product Name" in df.columns:
+        for title in df["Product Name"].unique():
+            tokens = _WORD.findall(title.lower())
+            if not tokens:
+                continue
+            # Titles shorter than a shingle are one shingle
+            for i in range(max(1, len(tokens) - words + 1)):
+                shingles.add("title:" + " ".join(tokens[i:i + words]))
+    return shingles
+
+def redact_csv(original_zip, file_name, new_zip, arcname, columns, postal_codes: dict, signer=None):
+    """Stream a CSV member into the new ZIP, replacing `columns` with postal codes.
+
+    `postal_codes` must map every value of `columns` to its postal code. The
+    member is parsed and written back `settings.CSV_CHUNK_ROWS` rows at a
+    time, so memory use is bounded by the chunk size, not the file size.
+    The order history shingles of every chunk go into `signer`, if given.
+    """
+    import pandas as pd
+    info = original_zip.getinfo(file_name)
+    with original_zip.open(info) as file_data, \
+            new_zip.open(arcname, "w", force_zip64=info.file_size >= zipfile.ZIP64_LIMIT // 2) as out_data:
+        out_text = io.TextIOWrapper(out_data, encoding="utf-8", newline="")
+        try:
+            # Keep every cell as the exact text it was exported as
+            chunks = pd.read_csv(
+                file_data,
+                chunksize=settings.CSV_CHUNK_ROWS,
+                dtype=str,
+                keep_default_na=False,
+                encoding="utf-8",
+            )
+            header = True
+            for df in chunks:
+                # Shingle the chunk on the same pass, before it is redacted
+                if signer is not None:
+                    signer.update(order_history_shingles(df, settings.MINHASH_SHINGLE_WORDS))
+
+                # Modify the necessary columns
+                for col in columns:
+                    if col in df.columns:
+                        df[col] = df[col].map(postal_codes)
+
+                # Write the modified rows straight into the ZIP
+                df.to_csv(out_text, index=False, header=header)
+                header = False
+        except pd.errors.EmptyDataError:
+            pass
+        out_text.flush()
+        out_text.detach()
+
+# Files kept in the output ZIP
+INTERESTED_FILES = [
+    "Retail.CartItems.1.csv",
+    "Digital Items.csv",
+    "Retail.OrderHistory.1.csv",
+    "Retail.OrderHistory.2.csv",
+    "Audible.PurchaseHistory.csv",
+    "Audible.Library.csv",
+    "Audible.MembershipBillings.csv",
+    "PrimeVideo.ViewingHistory.csv",
+]
+
+# Columns replaced by postal codes, per file
+COLUMN_MODIFICATIONS = {
+    "Digital Items.csv": [
+        "ShipFrom",
+        "ShipTo",
+    ],
+    "Retail.OrderHistory.1.csv": {
+        "Shipping Address",
+        "Billing Address",
+    },
+    "Retail.OrderHistory.2.csv": {
+        "Shipping Address",
+        "Billing Address",
+    },
+}
+
+# Files shingled into the signature of the user's order history
+SHINGLED_FILES = {
+    "Retail.OrderHistory.1.csv",
+    "Retail.OrderHistory.2.csv",
+}
+
+def select_members(original_zip) -> list:
+    """Pair every member we keep with its name in the output ZIP."""
+    members = []
+    for info in original_zip.infolist():
+        for interested_file in INTERESTED_FILES:
+            if info.filename.endswith(interested_file):
+                members.append((info, interested_file))
+                break  # Stop checking once a match is found
+    return members
+
+def collect_zip_locations(input_zip_path) -> set:
+    """Collect the distinct addresses of every modified file in the ZIP."""
+    locations = set()
     with zipfile.ZipFile(input_zip_path, 'r') as original_zip:
-        with zipfile.ZipFile(output_zip_path, 'w', zipfile.ZIP_DEFLATED) as new_zip:
-            for file_name in original_zip.namelist():
-                # if a file is an interested file, add it to output zip file
-                for interested_file in interested_files:
-                    if file_name.endswith(interested_file):
-                        with original_zip.open(file_name) as file_data:
-                            if not interested_file in column_modifications:
-                                new_zip.writestr(interested_file, file_data.read())
-                            else:
-                                csv_content = file_data.read().decode("utf-8")  # Read CSV as text
-                                df = pd.read_csv(io.StringIO(csv_content))  # Convert to DataFrame
-
-                                # Modify the necessary columns
-                                for col in column_modifications[interested_file]:
-                                    if col in df.columns:
-                                        df[col] = await get_postal_codes(df[col])
-
-                                # Write the modified CSV back to ZIP
-                                csv_buffer = io.StringIO()
-                                df.to_csv(csv_buffer, index=False)
-                                new_zip.writestr(interested_file, csv_buffer.getvalue())
-                                
-                            break  # Stop checking once a match is found
-
-async def download_and_modify_zip(url):
+        for info, interested_file in select_members(original_zip):
+            if interested_file in COLUMN_MODIFICATIONS:
+                locations |= collect_locations(original_zip, info.filename, COLUMN_MODIFICATIONS[interested_file])
+    return locations
+
+def write_modified_zip(input_zip_path, output_zip_path, postal_codes: dict, signer=None):
+    """Write the output ZIP with the addresses replaced by `postal_codes`.
+
+    Returns the SHA3-256 hex digest of the output ZIP, computed while it is
+    written, the seconds spent hashing, and `signer` with the order history
+    shingled into it.
+    """
+    copy_buffer = bytearray(settings.IO_BUFFER_SIZE)
+
+    with zipfile.ZipFile(input_zip_path, 'r') as original_zip, open(input_zip_path, 'rb') as original_raw, \
+            open(output_zip_path, 'wb') as output_raw:
+        # Hash the output as it is produced instead of reading it back
+        output = HashingWriter(output_raw, hashlib.sha3_256(), settings.IO_BUFFER_SIZE)
+        with zipfile.ZipFile(output, 'w', zipfile.ZIP_DEFLATED, compresslevel=settings.ZIP_COMPRESSLEVEL) as new_zip:
+            for info, interested_file in select_members(original_zip):
+                if not interested_file in COLUMN_MODIFICATIONS:
+                    # Unmodified files keep their compressed bytes as they are
+                    copy_member_raw(original_raw, info, new_zip, interested_file, copy_buffer)
+                else:
+                    redact_csv(
+                        original_zip,
+                        info.filename,
+                        new_zip,
+                        interested_file,
+                        COLUMN_MODIFICATIONS[interested_file],
+                        postal_codes,
+                        signer if interested_file in SHINGLED_FILES else None,
+                    )
+        output.close()
+
+    return output.hexdigest(), output.hash_seconds, signer
+
+async def modify_zip(input_zip_path, output_zip_path, signer=None) -> str:
+    """Modify the ZIP file by removing or adding files.
+
+    The parsing and compression run in the worker pool, only the geocoding
+    runs on the event loop. Returns the SHA3-256 hex digest of the output ZIP.
+    With a `signer`, the order history is shingled into it while it is redacted.
+    """
+    # Resolve the addresses of all modified files in one batch before rewriting
+    with STAGE_SECONDS.time(stage="collect"):
+        locations = await run_in_worker(collect_zip_locations, input_zip_path)
+    with STAGE_SECONDS.time(stage="geocoding"):
+        postal_codes = await get_postal_codes(locations) if locations else dict()
+
+    with STAGE_SECONDS.time(stage="redaction"):
+        data_hash, hash_seconds, worker_signer = await run_in_worker(
+            write_modified_zip, input_zip_path, output_zip_path, postal_codes, signer
+        )
+    STAGE_SECONDS.observe(hash_seconds, stage="hashing")
+    if signer is not None:
+        # A process pool worker shingled into a copy
+        signer.merge(worker_signer)
+        STAGE_SECONDS.observe(signer.seconds, stage="signature")
+    BYTES_PROCESSED.inc(os.path.getsize(output_zip_path), stage="redaction")
+    return data_hash
+
+async def download_and_modify_zip(url, admission=None, signer=None):
+    """Download and redact the export at `url`, returning its data hash and the path of the redacted ZIP.
+
+    `admission` is what `admit_export` returned for `url`, if it was admitted.
+    Its files are staged in the directory it chose. The order history is
+    shingled into `signer`, if given. Returns None on failure.
+    """
+    directory = admission.directory if admission is not None else None
+    # Create temporary files to store the ZIPs
+    temp_input = tempfile.NamedTemporaryFile(delete=False, dir=directory)
+    temp_input.close()
+    temp_output = tempfile.NamedTemporaryFile(delete=False, dir=directory)
+    temp_output.close()  # Close file so it can be modified
     try:
-        async with aiohttp.ClientSession() as session:
-            async with session.get(url, ssl=False) as resp:
-                if resp.status == 200:
-                    # measure download time
-                    start_time = time.time()
-                    # Create temporary files to store the ZIPs
-                    async with aiofiles.tempfile.NamedTemporaryFile(delete=False) as temp_input:
-                        async for chunk in resp.content.iter_chunked(4096):
-                            await temp_input.write(chunk)
-
-                    temp_output = tempfile.NamedTemporaryFile(delete=False)
-                    temp_output.close()  # Close file so it can be modified
-
-                    end_time = time.time()
-                    print(f"File size: {os.path.getsize(temp_input.name) / 1024 / 1024} MB")
-                    print(f"Download time: {end_time - start_time} seconds")
-
-                    # Modify the ZIP file
-                    start_time = time.time()
-                    await modify_zip(temp_input.name, temp_output.name)
-                    end_time = time.time()
-                    print(f"Modify zip time: {end_time - start_time} seconds")
-
-                    # measure hash time
-                    start_time = time.time()
-                    # Compute the hash of the modified ZIP
-                    hash_obj = hashlib.sha3_256()
-                    async with aiofiles.open(temp_output.name, "rb") as modified_file:
-                        while chunk := await modified_file.read(4096):
-                            hash_obj.update(chunk)
-                    end_time = time.time()
-                    print(f"Hash time: {end_time - start_time} seconds")
-
-                    # Cleanup temp files
-                    os.remove(temp_input.name)
-
-                    return hash_obj.hexdigest(), temp_output.name
-                
+        # measure download time
+        start_time = time.perf_counter()
+        size = await get_downloader().download(
+            url,
+            temp_input.name,
+            info=admission.info if admission is not None else None,
+            max_size=settings.PROOF_MAX_EXPORT_SIZE,
+        )
+        STAGE_SECONDS.observe(time.perf_counter() - start_time, stage="download")
+        BYTES_PROCESSED.inc(size, stage="download")
+
+        # Modify the ZIP file, hashing it on the way out
+        data_hash = await modify_zip(temp_input.name, temp_output.name, signer)
+        return data_hash, temp_output.name
+
     except Exception as e:
-        print(f"Error downloading or hashing data: {e}")
+        logger.error(f"Error downloading or hashing data: {e}")
+        os.remove(temp_output.name)
         return None
     finally:
-        pass
+        # Cleanup temp files
+        os.remove(temp_input.name)
 
 def is_valid_amazon_link(link):
     valid_domains = [
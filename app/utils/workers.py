@@ -0,0 +1,36 @@
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from functools import partial
+from app.core.config import settings
+import asyncio
+import logging
+import os
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+
+def get_executor() -> Executor:
+    """The pool running CPU-bound work, such as parsing and compressing archives, off the event loop."""
+    global _executor
+    if _executor is None:
+        size = settings.WORKER_POOL_SIZE or min(os.cpu_count() or 1, 8)
+        if settings.WORKER_POOL_KIND == "process":
+            _executor = ProcessPoolExecutor(max_workers=size)
+        else:
+            _executor = ThreadPoolExecutor(max_workers=size, thread_name_prefix="worker")
+        logger.info(f"Started {settings.WORKER_POOL_KIND} worker pool with {size} workers")
+    return _executor
+
+async def run_in_worker(fn, *args, **kwargs):
+    """Run `fn(*args, **kwargs)` in the worker pool and wait for its result.
+
+    With a process pool, `fn` and its arguments must be picklable.
+    """
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(get_executor(), partial(fn, *args, **kwargs))
+
+def shutdown_executor() -> None:
+    global _executor
+    if _executor is not None:
+        _executor.shutdown(wait=True, cancel_futures=True)
+        _executor = None
@@ -0,0 +1,277 @@
+# benchmarks/run.py
+"""Benchmark the proof pipeline and the MinHash index, reporting JSON.
+
+Examples:
+
+    python -m benchmarks.run modify_zip --size 100MB --addresses 5000 --latency 0.02
+    python -m benchmarks.run download --size 1GB --repeat 1 --output download.json
+    python -m benchmarks.run lsh --signatures 1000000 --queries 2000
+
+Each scenario runs in a fresh process, so its peak RSS is its own. Results of
+different commits can be compared with any JSON diff.
+"""
+from concurrent.futures import ProcessPoolExecutor
+import argparse
+import json
+import multiprocessing
+import os
+import platform
+import re
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+# The app refuses to start without these, none of them is used here
+for name, value in {
+    "API_KEY": "benchmark",
+    "GMAPS_API_KEY": "benchmark",
+    "POSTGRES_USER": "benchmark",
+    "POSTGRES_PASSWORD": "benchmark",
+    "POSTGRES_DB": "benchmark",
+}.items():
+    os.environ.setdefault(name, value)
+
+SIZE_UNITS = {"": 1, "B": 1, "KB": 1024, "MB": 1024 ** 2, "GB": 1024 ** 3}
+
+def parse_size(text: str) -> int:
+    match = re.fullmatch(r"\s*([\d.]+)\s*([KMG]?B?)\s*", text.upper())
+    if not match:
+        raise argparse.ArgumentTypeError(f"Invalid size: {text}")
+    return int(float(match.group(1)) * SIZE_UNITS[match.group(2)])
+
+def peak_rss_mb() -> float:
+    # ru_maxrss is in kilobytes on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+
+def summarize(seconds: list) -> dict:
+    import numpy as np
+    values = np.asarray(seconds, dtype=np.float64)
+    return {
+        "count": len(seconds),
+        "mean": float(values.mean()),
+        "min": float(values.min()),
+        "p50": float(np.percentile(values, 50)),
+        "p99": float(np.percentile(values, 99)),
+    }
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True,
+            cwd=os.path.dirname(os.path.abspath(__file__)),
+        ).stdout.strip()
+    except Exception:
+        return None
+
+
+async def _run_pipeline(tmp: str, export_path: str, latency: float, repeat: int, warm_cache: bool, download: bool,
+                        geocode_rate: float):
+    from sqlalchemy import create_engine
+    from sqlalchemy.orm import sessionmaker
+    from app.db.base import Base
+    from app.services import geocode
+    from app.utils import geocoder, misc
+    from benchmarks.stub_geocoder import start_server, stub_geocoder_app, file_server_app
+
+    # Drop any client built with the production settings
+    await geocoder.close_geocoder()
+    stub = stub_geocoder_app(latency)
+    geocoder_runner, geocoder_url = await start_server(stub)
+    misc.settings.GEOCODE_API_URL = f"{geocoder_url}/maps/api/geocode/json"
+    misc.settings.GEOCODE_RATE_LIMIT = geocode_rate
+    file_runner, file_url = await start_server(file_server_app(export_path)) if download else (None, None)
+
+    seconds = []
+    try:
+        for run in range(repeat):
+            # A cold run starts from empty caches, as for a first-time customer
+            if run == 0 or not warm_cache:
+                engine = create_engine(f"sqlite:///{os.path.join(tmp, f'geocode_{run}.db')}")
+                Base.metadata.create_all(bind=engine)
+                geocode.SessionLocal = sessionmaker(bind=engine)
+                geocode.memory_cache.clear()
+
+            start = time.perf_counter()
+            if download:
+                data_hash, output_path = await misc.download_and_modify_zip(f"{file_url}/export.zip")
+            else:
+                output_path = os.path.join(tmp, "output.zip")
+                await misc.modify_zip(export_path, output_path)
+            seconds.append(time.perf_counter() - start)
+            output_bytes = os.path.getsize(output_path)
+            os.remove(output_path)
+    finally:
+        await geocoder.close_geocoder()
+        await geocoder_runner.cleanup()
+        if file_runner is not None:
+            await file_runner.cleanup()
+    return seconds, output_bytes, stub["requests"]
+
+def bench_pipeline(size: int, addresses: int, latency: float, repeat: int, warm_cache: bool, download: bool,
+                   geocode_rate: float = 0) -> dict:
+    """Redact a synthetic export, read from disk or downloaded from a local server."""
+    import asyncio
+    from benchmarks.synthetic import generate_export
+
+    with tempfile.TemporaryDirectory() as tmp:
+        export_path = os.path.join(tmp, "export.zip")
+        start = time.perf_counter()
+        generated = generate_export(export_path, size, addresses)
+        generate_seconds = time.perf_counter() - start
+        input_bytes = os.path.getsize(export_path)
+
+        seconds, output_bytes, geocode_requests = asyncio.run(
+            _run_pipeline(tmp, export_path, latency, repeat, warm_cache, download, geocode_rate)
+        )
+
+    summary = summarize(seconds)
+    return {
+        "params": {
+            "size": size, "addresses": addresses, "latency": latency,
+            "repeat": repeat, "warm_cache": warm_cache, "geocode_rate": geocode_rate,
+        },
+        "rows": generated["rows"],
+        "input_bytes": input_bytes,
+        "output_bytes": output_bytes,
+        "generate_seconds": generate_seconds,
+        "seconds": summary,
+        "throughput_mb_s": input_bytes / 1024 ** 2 / summary["p50"],
+        "geocode_requests": geocode_requests,
+    }
+
+def bench_lsh(signatures: int, queries: int, batch_size: int, k: int) -> dict:
+    """Insert random signatures into the LSH, the signature matrix and the forest, then query them."""
+    import numpy as np
+    from app.core.config import settings
+    from app.services.minhash import new_lsh, new_forest, minhash_key, score_candidates, query_top_k
+    from app.utils.minhash import SignatureMatrix, build_minhash
+
+    settings.MINHASH_LSH_STORAGE_CONFIG = ""
+    num_perm = settings.MINHASH_NUM_PERM
+    rng = np.random.default_rng(0)
+    lsh, forest = new_lsh(), new_forest()
+    matrix = SignatureMatrix(num_perm, capacity=signatures)
+
+    # MinHash values are below 2**32, like datasketch's own
+    insert_seconds = []
+    for start_id in range(1, signatures + 1, batch_size):
+        count = min(batch_size, signatures + 1 - start_id)
+        hashvalues = rng.integers(0, 2 ** 32, size=(count, num_perm), dtype=np.uint64)
+        entries = [
+            (start_id + i, f"user_{(start_id + i) % 50000}", build_minhash(1, hashvalues[i]))
+            for i in range(count)
+        ]
+        start = time.perf_counter()
+        with lsh.insertion_session(buffer_size=count) as session:
+            for minhash_id, user_id, minhash in entries:
+                session.insert(minhash_key(user_id, minhash_id), minhash, check_duplication=False)
+        matrix.add_many(entries)
+        if forest is not None:
+            forest.add_many((minhash_key(user_id, minhash_id), minhash) for minhash_id, user_id, minhash in entries)
+        insert_seconds.append(time.perf_counter() - start)
+
+    # Queries are stored signatures with a fifth of their values changed
+    targets = rng.integers(1, signatures + 1, size=queries)
+    query_minhashes = []
+    for minhash_id in targets:
+        hashvalues = matrix.get(int(minhash_id))[2].copy()
+        changed = rng.choice(num_perm, size=num_perm // 5, replace=False)
+        hashvalues[changed] = rng.integers(0, 2 ** 32, size=len(changed), dtype=np.uint64)
+        query_minhashes.append(build_minhash(1, hashvalues))
+
+    # The first forest query sorts the prefix trees
+    start = time.perf_counter()
+    if forest is not None:
+        forest.query(query_minhashes[0], k)
+    forest_index_seconds = time.perf_counter() - start
+
+    query_seconds, top_k_seconds, candidates = [], [], []
+    for minhash in query_minhashes:
+        start = time.perf_counter()
+        keys = lsh.query(minhash)
+        score_candidates(None, minhash, keys, matrix)
+        query_seconds.append(time.perf_counter() - start)
+        candidates.append(len(keys))
+
+        start = time.perf_counter()
+        query_top_k(None, lsh, forest, matrix, minhash, k)
+        top_k_seconds.append(time.perf_counter() - start)
+
+    total_insert = sum(insert_seconds)
+    return {
+        "params": {"signatures": signatures, "queries": queries, "batch_size": batch_size, "k": k, "num_perm": num_perm},
+        "insert_seconds": total_insert,
+        "inserts_per_second": signatures / total_insert,
+        "forest_index_seconds": forest_index_seconds,
+        "query_seconds": summarize(query_seconds),
+        "queries_per_second": queries / sum(query_seconds),
+        "top_k_seconds": summarize(top_k_seconds),
+        "candidates_per_query": float(np.mean(candidates)),
+    }
+
+def run_scenario(name: str, args: dict) -> dict:
+    """Run one scenario and record the peak RSS of the process running it."""
+    if name == "modify_zip":
+        result = bench_pipeline(args["size"], args["addresses"], args["latency"], args["repeat"],
+                                args["warm_cache"], download=False, geocode_rate=args["geocode_rate"])
+    elif name == "download":
+        result = bench_pipeline(args["size"], args["addresses"], args["latency"], args["repeat"],
+                                args["warm_cache"], download=True, geocode_rate=args["geocode_rate"])
+    elif name == "lsh":
+        result = bench_lsh(args["signatures"], args["queries"], args["batch_size"], args["k"])
+    else:
+        raise ValueError(f"Unknown scenario {name}")
+    result["scenario"] = name
+    result["peak_rss_mb"] = peak_rss_mb()
+    return result
+
+SCENARIOS = ("modify_zip", "download", "lsh")
+
+def main(argv=None) -> dict:
+    parser = argparse.ArgumentParser(description="Benchmark the proof pipeline and the MinHash index")
+    parser.add_argument("scenarios", nargs="*", choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument("--size", type=parse_size, default="10MB", help="uncompressed export size, e.g. 10MB or 2GB")
+    parser.add_argument("--addresses", type=int, default=1000, help="distinct addresses in the export")
+    parser.add_argument("--latency", type=float, default=0.02, help="stub geocoder latency in seconds")
+    parser.add_argument("--geocode-rate", type=float, default=0,
+                        help="geocoding requests per second, 0 = unlimited (GEOCODE_RATE_LIMIT in production)")
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--warm-cache", action="store_true", help="keep the geocode cache between runs")
+    parser.add_argument("--signatures", type=int, default=1_000_000)
+    parser.add_argument("--queries", type=int, default=1000)
+    parser.add_argument("--batch-size", type=int, default=10000)
+    parser.add_argument("-k", type=int, default=10)
+    parser.add_argument("--in-process", action="store_true", help="don't isolate scenarios in their own process")
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    args = parser.parse_args(argv)
+    params = vars(args)
+
+    results = []
+    for name in args.scenarios:
+        print(f"Running {name}", file=sys.stderr)
+        if args.in_process:
+            results.append(run_scenario(name, params))
+        else:
+            with ProcessPoolExecutor(max_workers=1, mp_context=multiprocessing.get_context("spawn")) as pool:
+                results.append(pool.submit(run_scenario, name, params).result())
+
+    report = {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%SZ", time.gmtime()),
+        "python": platform.python_version(),
+        "machine": platform.machine(),
+        "cpus": os.cpu_count(),
+        "results": results,
+    }
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(text + "\n")
+    else:
+        print(text)
+    return report
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,47 @@
+# benchmarks/stub_geocoder.py
+from aiohttp import web
+import asyncio
+import hashlib
+
+async def start_server(app: web.Application):
+    """Serve `app` on a free local port. Returns the runner and the base URL."""
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://127.0.0.1:{port}"
+
+def stub_geocoder_app(latency: float = 0.0) -> web.Application:
+    """A Geocoding API stand-in answering every address after `latency` seconds.
+
+    The postal code is derived from the address, so results are stable. The
+    number of requests served is kept in `app["requests"]`.
+    """
+    app = web.Application()
+    app["requests"] = 0
+
+    async def geocode(request):
+        app["requests"] += 1
+        if latency:
+            await asyncio.sleep(latency)
+        digest = hashlib.sha1(request.query["address"].encode("utf-8")).hexdigest()
+        return web.json_response({
+            "status": "OK",
+            "results": [{"address_components": [
+                {"long_name": str(int(digest[:8], 16) % 100000).zfill(5), "types": ["postal_code"]},
+            ]}],
+        })
+
+    app.router.add_get("/maps/api/geocode/json", geocode)
+    return app
+
+def file_server_app(path) -> web.Application:
+    """Serve one file at `/export.zip`, like the S3 link of an export."""
+    app = web.Application()
+
+    async def export(request):
+        return web.FileResponse(path)
+
+    app.router.add_get("/export.zip", export)
+    return app
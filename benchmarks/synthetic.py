@@ -0,0 +1,102 @@
+# benchmarks/synthetic.py
+import csv
+import io
+import random
+import zipfile
+
+STREETS = ["Main", "Elm", "Oak", "Pine", "Maple", "Cedar", "Lake", "Hill", "Park", "Washington"]
+CITIES = [
+    ("Springfield", "IL", "62701"), ("Seattle", "WA", "98101"), ("Austin", "TX", "73301"),
+    ("Denver", "CO", "80201"), ("Boston", "MA", "02108"), ("Portland", "OR", "97201"),
+]
+
+ORDER_HISTORY_COLUMNS = [
+    "Website", "Order ID", "Order Date", "Purchase Order Number", "Currency", "Unit Price",
+    "Unit Price Tax", "Shipping Charge", "Total Discounts", "Total Owed", "Shipment Item Subtotal",
+    "Shipment Item Subtotal Tax", "ASIN", "Product Condition", "Quantity", "Payment Instrument Type",
+    "Order Status", "Shipment Status", "Ship Date", "Shipping Option", "Shipping Address",
+    "Billing Address", "Carrier Name & Tracking Number", "Product Name", "Gift Message",
+    "Gift Sender Name", "Gift Recipient Contact Details",
+]
+
+def make_addresses(count: int, rng: random.Random) -> list:
+    """`count` distinct, plausible US addresses."""
+    addresses = []
+    for i in range(count):
+        city, state, zip_code = CITIES[i % len(CITIES)]
+        addresses.append(f"{i + 1} {rng.choice(STREETS)} St, {city}, {state} {zip_code}, United States")
+    return addresses
+
+def order_rows(addresses: list, rng: random.Random):
+    """An endless stream of Retail.OrderHistory rows."""
+    order = 0
+    while True:
+        order += 1
+        address = rng.choice(addresses)
+        price = f"{rng.uniform(1, 300):.2f}"
+        yield [
+            "Amazon.com", f"{rng.randrange(100, 999)}-{order:07d}-{rng.randrange(10**6, 10**7)}",
+            f"2023-{rng.randrange(1, 13):02d}-{rng.randrange(1, 29):02d}T12:00:00Z", "Not Applicable", "USD",
+            price, "0", "0", "0", price, price, "0", f"B0{rng.randrange(10**7, 10**8)}", "New",
+            str(rng.randrange(1, 4)), "Visa - 1234", "Closed", "Shipped",
+            "2023-01-02T12:00:00Z", "std-us", address,
+            address if rng.random() < 0.8 else rng.choice(addresses),
+            f"AMZN_US(TBA{rng.randrange(10**11, 10**12)})",
+            f"Synthetic product {rng.randrange(10**5)}, {rng.choice(['blue', 'red', 'large', 'small'])}",
+            "Not Available", "Not Available", "Not Available",
+        ]
+
+def write_csv_member(export: zipfile.ZipFile, name: str, columns: list, rows, target_bytes: int) -> int:
+    """Stream rows into a new member until it holds `target_bytes`. Returns the rows written."""
+    count = 0
+    written = 0
+    buffer = io.StringIO()
+    writer = csv.writer(buffer, quoting=csv.QUOTE_ALL)
+    buffer.write("\ufeff")
+    writer.writerow(columns)
+    with export.open(name, "w", force_zip64=target_bytes >= zipfile.ZIP64_LIMIT // 2) as out:
+        for row in rows:
+            writer.writerow(row)
+            count += 1
+            # Flush a thousand rows at a time
+            if count % 1000 == 0:
+                data = buffer.getvalue().encode("utf-8")
+                out.write(data)
+                written += len(data)
+                buffer.seek(0)
+                buffer.truncate()
+                if written >= target_bytes:
+                    break
+        out.write(buffer.getvalue().encode("utf-8"))
+    return count
+
+def generate_export(path, size_bytes: int, address_count: int = 1000, seed: int = 0) -> dict:
+    """Write a synthetic "All Data Categories" export of about `size_bytes` uncompressed.
+
+    Most of the size goes to the two order history files, whose addresses are
+    drawn from `address_count` distinct ones. Returns what was generated.
+    """
+    rng = random.Random(seed)
+    addresses = make_addresses(address_count, rng)
+    rows = order_rows(addresses, rng)
+    order_bytes = max(size_bytes - 64 * 1024, 1024)
+
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED, compresslevel=6) as export:
+        first = write_csv_member(export, "Retail.OrderHistory.1/Retail.OrderHistory.1.csv",
+                                 ORDER_HISTORY_COLUMNS, rows, order_bytes * 3 // 4)
+        second = write_csv_member(export, "Retail.OrderHistory.2/Retail.OrderHistory.2.csv",
+                                  ORDER_HISTORY_COLUMNS, rows, order_bytes // 4)
+        digital = [
+            [f"D01-{i:07d}", rng.choice(addresses), rng.choice(addresses), f"Ebook {i}"]
+            for i in range(200)
+        ]
+        write_csv_member(export, "Digital-Ordering.1/Digital Items.csv",
+                         ["OrderId", "ShipFrom", "ShipTo", "Title"], iter(digital), 16 * 1024)
+        export.writestr("Retail.CartItems.1/Retail.CartItems.1.csv",
+                        "ASIN,Quantity\n" + "".join(f"B0{i:08d},1\n" for i in range(1000)))
+        export.writestr("PrimeVideo.ViewingHistory/PrimeVideo.ViewingHistory.csv",
+                        "Title,Date\n" + "".join(f"Episode {i},2023-01-01\n" for i in range(1000)))
+        # Members the redaction drops
+        export.writestr("Account.Profile/Profile.csv", "Name,Email\nSynthetic,synthetic@example.com\n")
+
+    return {"rows": first + second, "addresses": address_count}
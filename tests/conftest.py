@@ -0,0 +1,8 @@
+import os
+
+# Settings are read from the environment at import time
+os.environ.setdefault("API_KEY", "test")
+os.environ.setdefault("GMAPS_API_KEY", "test")
+os.environ.setdefault("POSTGRES_USER", "postgres")
+os.environ.setdefault("POSTGRES_PASSWORD", "postgres")
+os.environ.setdefault("POSTGRES_DB", "test")
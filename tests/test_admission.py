@@ -0,0 +1,103 @@
+import asyncio
+import os
+import pytest
+from aiohttp import web
+from app.services import admission as admission_service
+from app.services.admission import admit_export, ExportTooLargeError, MemoryBudgetExceededError
+from app.utils import download, misc
+from tests.test_download import start_server
+from tests.test_redact_csv import ORDER_HISTORY, fake_geocoder, make_export
+
+
+@pytest.fixture
+def budget(monkeypatch, tmp_path):
+    monkeypatch.setattr(admission_service.settings, "PROOF_MAX_EXPORT_SIZE", 1000 * 1000)
+    monkeypatch.setattr(admission_service.settings, "PROOF_MEMORY_BUDGET", 3000 * 1000)
+    monkeypatch.setattr(admission_service.settings, "PROOF_WORKING_MEMORY", 1000)
+    monkeypatch.setattr(admission_service.settings, "SPILL_DIR", str(tmp_path / "spill"))
+    monkeypatch.setattr(admission_service.settings, "SPILL_THRESHOLD", 100 * 1000)
+    monkeypatch.setattr(admission_service, "_memory_budget", None)
+    monkeypatch.setattr(download, "_downloader", None)
+
+def serve(files):
+    app = web.Application()
+    for name, path in files.items():
+        app.router.add_get(f"/{name}", lambda request, path=path: web.FileResponse(path))
+    return app
+
+def test_admission_checks_size_and_budget(tmp_path, budget, monkeypatch):
+    # Exports below the spill threshold are staged on the tmpfs and count twice
+    monkeypatch.setattr(admission_service.settings, "SPILL_DIR", "")
+    for name, size in (("small", 1000), ("medium", 900 * 1000), ("huge", 2000 * 1000)):
+        (tmp_path / name).write_bytes(os.urandom(size))
+
+    async def scenario():
+        runner, url = await start_server(serve({name: tmp_path / name for name in ("small", "medium", "huge")}))
+        try:
+            with pytest.raises(ExportTooLargeError):
+                await admit_export(f"{url}/huge")
+            medium = await admit_export(f"{url}/medium")
+            assert medium.directory is None and medium.info.size == 900 * 1000
+            assert admission_service.get_memory_budget().reserved == 1000 + 2 * 900 * 1000
+            # Another medium export doesn't fit until the first one is released
+            with pytest.raises(MemoryBudgetExceededError):
+                await admit_export(f"{url}/medium")
+            small = await admit_export(f"{url}/small")
+            medium.release()
+            medium.release()
+            (await admit_export(f"{url}/medium")).release()
+            small.release()
+            assert admission_service.get_memory_budget().reserved == 0
+        finally:
+            await download.close_downloader()
+            await runner.cleanup()
+
+    asyncio.run(scenario())
+
+def test_large_exports_spill(tmp_path, budget, monkeypatch):
+    fake_geocoder(monkeypatch)
+    make_export(tmp_path / "export.zip", {
+        "Retail.OrderHistory.1/Retail.OrderHistory.1.csv": ORDER_HISTORY,
+        "Unrelated/padding.bin": os.urandom(200 * 1000),
+    })
+
+    async def scenario():
+        runner, url = await start_server(serve({"export.zip": tmp_path / "export.zip"}))
+        try:
+            admission = await admit_export(f"{url}/export.zip")
+            # Only the working memory counts, the files live on the encrypted mount
+            assert admission.directory == str(tmp_path / "spill")
+            assert admission_service.get_memory_budget().reserved == 1000
+            return await misc.download_and_modify_zip(f"{url}/export.zip", admission)
+        finally:
+            await download.close_downloader()
+            await runner.cleanup()
+
+    data_hash, output_path = asyncio.run(scenario())
+    assert os.listdir(tmp_path / "spill") == [os.path.basename(output_path)]
+
+def test_budget_is_split_between_workers(budget, monkeypatch):
+    monkeypatch.setattr(admission_service.settings, "API_WORKERS", 3)
+    assert admission_service.get_memory_budget().total == 1000 * 1000
+
+def test_output_released_when_the_client_disconnects(tmp_path, budget):
+    from app.api.endpoints.proof import TempFileResponse
+    path = tmp_path / "output.zip"
+    path.write_bytes(os.urandom(200 * 1000))
+    reservation = admission_service.get_memory_budget().reserve(1000)
+    admission = admission_service.Admission(None, str(tmp_path), reservation)
+
+    async def receive():
+        await asyncio.Event().wait()
+
+    async def send(message):
+        if message["type"] == "http.response.body":
+            raise OSError("Connection reset by peer")
+
+    response = TempFileResponse(str(path), admission, media_type="application/zip")
+    response.chunk_size = 1000
+    scope = {"type": "http", "method": "GET", "headers": [], "asgi": {"spec_version": "2.4"}}
+    with pytest.raises(OSError):
+        asyncio.run(response(scope, receive, send))
+    assert not path.exists()
+    assert admission_service.get_memory_budget().reserved == 0
@@ -0,0 +1,61 @@
+import hashlib
+import io
+import zipfile
+from app.utils.archive import copy_member_raw, HashingWriter
+
+
+class Unseekable(io.RawIOBase):
+    """A write-only stream, which makes ZipFile use data descriptors."""
+
+    def __init__(self):
+        self.data = bytearray()
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self.data += b
+        return len(b)
+
+def test_copy_member_raw_keeps_compressed_bytes(tmp_path):
+    payload = b"Title,Date\n" + b"Some audiobook,2024-01-01\n" * 1000
+    source = Unseekable()
+    with zipfile.ZipFile(source, "w", zipfile.ZIP_DEFLATED) as export:
+        export.writestr("Audible.Library/Audible.Library.csv", payload)
+        export.writestr("Stored/PrimeVideo.ViewingHistory.csv", b"stored", compress_type=zipfile.ZIP_STORED)
+    (tmp_path / "input.zip").write_bytes(source.data)
+
+    with zipfile.ZipFile(tmp_path / "input.zip") as original, open(tmp_path / "input.zip", "rb") as raw:
+        infos = original.infolist()
+        assert infos[0].flag_bits & 0x08
+        with zipfile.ZipFile(tmp_path / "output.zip", "w") as output:
+            output.writestr("before.txt", b"before")
+            copy_member_raw(raw, infos[0], output, "Audible.Library.csv")
+            copy_member_raw(raw, infos[1], output, "PrimeVideo.ViewingHistory.csv", bytearray(3))
+            output.writestr("after.txt", b"after")
+
+    with zipfile.ZipFile(tmp_path / "output.zip") as output:
+        assert output.testzip() is None
+        copied = output.getinfo("Audible.Library.csv")
+        assert (copied.CRC, copied.compress_size, copied.compress_type) == (
+            infos[0].CRC, infos[0].compress_size, zipfile.ZIP_DEFLATED
+        )
+        assert output.read("Audible.Library.csv") == payload
+        assert output.read("PrimeVideo.ViewingHistory.csv") == b"stored"
+        assert output.read("after.txt") == b"after"
+
+def test_hashing_writer_digest_matches_written_zip(tmp_path):
+    path = tmp_path / "output.zip"
+    with open(path, "wb") as raw:
+        output = HashingWriter(raw, buffer_size=64)
+        with zipfile.ZipFile(output, "w", zipfile.ZIP_DEFLATED) as new_zip:
+            new_zip.writestr("small.csv", b"a,b\n1,2\n")
+            with new_zip.open("large.csv", "w") as member:
+                for i in range(1000):
+                    member.write(f"{i},{i * i}\n".encode())
+        output.close()
+
+    assert output.hexdigest() == hashlib.sha3_256(path.read_bytes()).hexdigest()
+    with zipfile.ZipFile(path) as written:
+        assert written.testzip() is None
+        assert written.read("small.csv") == b"a,b\n1,2\n"
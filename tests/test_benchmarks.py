@@ -0,0 +1,28 @@
+import zipfile
+from app.core.config import settings
+from app.services import geocode
+from benchmarks.run import bench_pipeline, parse_size
+from benchmarks.synthetic import generate_export
+
+
+def test_generate_export_has_the_redacted_files(tmp_path):
+    generated = generate_export(tmp_path / "export.zip", parse_size("256KB"), address_count=20)
+    with zipfile.ZipFile(tmp_path / "export.zip") as export:
+        names = export.namelist()
+        size = sum(info.file_size for info in export.infolist())
+    assert "Retail.OrderHistory.1/Retail.OrderHistory.1.csv" in names
+    assert "Digital-Ordering.1/Digital Items.csv" in names
+    assert generated["rows"] >= 1000
+    assert size >= parse_size("192KB")
+
+def test_pipeline_benchmark_against_stub_geocoder(monkeypatch):
+    # The benchmark repoints these, restore them afterwards
+    monkeypatch.setattr(settings, "GEOCODE_API_URL", settings.GEOCODE_API_URL)
+    monkeypatch.setattr(settings, "GEOCODE_RATE_LIMIT", settings.GEOCODE_RATE_LIMIT)
+    monkeypatch.setattr(geocode, "SessionLocal", geocode.SessionLocal)
+
+    result = bench_pipeline(parse_size("128KB"), 30, latency=0, repeat=2, warm_cache=True, download=True)
+    assert result["seconds"]["count"] == 2
+    # The second run is served by the geocode cache
+    assert result["geocode_requests"] == 30
+    assert 0 < result["output_bytes"]
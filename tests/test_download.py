@@ -0,0 +1,60 @@
+import asyncio
+import os
+from aiohttp import web
+from app.utils.download import Downloader
+
+
+async def start_server(app):
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://127.0.0.1:{port}"
+
+def serve(tmp_path, data, ranges: bool):
+    path = tmp_path / "export.zip"
+    path.write_bytes(data)
+    requests = []
+
+    async def export(request):
+        requests.append(request.headers.get("Range"))
+        if ranges:
+            return web.FileResponse(path)
+        return web.Response(body=data, content_type="application/zip")
+
+    app = web.Application()
+    app.router.add_get("/export.zip", export)
+    return app, requests
+
+def download(tmp_path, app, downloader):
+    async def scenario():
+        runner, url = await start_server(app)
+        try:
+            return await downloader.download(f"{url}/export.zip", str(tmp_path / "download.zip"))
+        finally:
+            await downloader.close()
+            await runner.cleanup()
+    return asyncio.run(scenario())
+
+def test_download_in_parallel_ranges(tmp_path):
+    data = os.urandom(1000 * 1000 + 7)
+    app, requests = serve(tmp_path, data, ranges=True)
+
+    size = download(tmp_path, app, Downloader(part_size=100 * 1000, concurrency=4, buffer_size=64 * 1024))
+    assert size == len(data)
+    assert (tmp_path / "download.zip").read_bytes() == data
+    # The probe, then one request per part
+    assert requests[0] == "bytes=0-0"
+    assert sorted(requests[1:]) == sorted(f"bytes={start}-{min(start + 100 * 1000, len(data)) - 1}"
+                                          for start in range(0, len(data), 100 * 1000))
+
+def test_download_falls_back_to_a_single_stream(tmp_path):
+    data = os.urandom(300 * 1000)
+    app, requests = serve(tmp_path, data, ranges=False)
+
+    size = download(tmp_path, app, Downloader(part_size=100 * 1000, concurrency=4, buffer_size=64 * 1024))
+    assert size == len(data)
+    assert (tmp_path / "download.zip").read_bytes() == data
+    # The probe, then the whole file in one request
+    assert requests == ["bytes=0-0", None]
@@ -0,0 +1,103 @@
+import asyncio
+from aiohttp import web
+from app.utils.geocoder import GeocodingClient
+
+
+def start_stub_geocoder(handler):
+    """Serve `handler` as a geocoding API on a free local port."""
+    async def start():
+        app = web.Application()
+        app.router.add_get("/geocode/json", handler)
+        runner = web.AppRunner(app)
+        await runner.setup()
+        site = web.TCPSite(runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]
+        return runner, f"http://127.0.0.1:{port}/geocode/json"
+    return start()
+
+def ok(postal_code):
+    return web.json_response({
+        "status": "OK",
+        "results": [{"address_components": [{"long_name": postal_code, "types": ["postal_code"]}]}],
+    })
+
+def test_client_coalesces_caps_and_retries():
+    requests = []
+    in_flight = 0
+    peak = 0
+
+    async def handler(request):
+        nonlocal in_flight, peak
+        address = request.query["address"]
+        requests.append(address)
+        in_flight += 1
+        peak = max(peak, in_flight)
+        await asyncio.sleep(0.02)
+        in_flight -= 1
+        if address == "busy" and requests.count("busy") < 3:
+            return web.json_response({"status": "OVER_QUERY_LIMIT"})
+        if address == "nowhere":
+            return web.json_response({"status": "ZERO_RESULTS", "results": []})
+        return ok(address.upper())
+
+    async def run():
+        runner, url = await start_stub_geocoder(handler)
+        client = GeocodingClient("key", url, max_concurrency=2, rate=1000, burst=1000, backoff=0.01)
+        try:
+            # Two concurrent proofs asking for overlapping addresses
+            first, second = await asyncio.gather(
+                client.postal_codes(["a", "b", "c", "busy"]),
+                client.postal_codes(["a", "b", "nowhere"]),
+            )
+        finally:
+            await client.close()
+            await runner.cleanup()
+        return first, second
+
+    first, second = asyncio.run(run())
+    assert first == {"a": "A", "b": "B", "c": "C", "busy": "BUSY"}
+    assert second == {"a": "A", "b": "B", "nowhere": "UNKNOWN"}
+    assert sorted(requests) == ["a", "b", "busy", "busy", "busy", "c", "nowhere"]
+    assert peak <= 2
+
+def test_client_gives_up_after_retries():
+    async def handler(request):
+        return web.json_response({"status": "OVER_QUERY_LIMIT"}, status=429)
+
+    async def run():
+        runner, url = await start_stub_geocoder(handler)
+        client = GeocodingClient("key", url, max_retries=2, rate=0, backoff=0.01)
+        try:
+            return await client.postal_code("a"), client.upstream_calls
+        finally:
+            await client.close()
+            await runner.cleanup()
+
+    assert asyncio.run(run()) == ("UNKNOWN", 3)
+
+def test_client_survives_malformed_responses():
+    bodies = {
+        "html": web.Response(text="<html>Bad gateway</html>", content_type="text/html"),
+        "no_status": web.json_response({"results": []}),
+        "no_results": web.json_response({"status": "OK", "results": []}),
+        "no_types": web.json_response({"status": "OK", "results": [{"address_components": [{"long_name": "1"}]}]}),
+        "list": web.json_response([]),
+    }
+
+    async def handler(request):
+        return bodies[request.query["address"]]
+
+    async def run():
+        runner, url = await start_stub_geocoder(handler)
+        client = GeocodingClient("key", url, rate=0, backoff=0.01)
+        try:
+            return await client.postal_codes(list(bodies)), client.upstream_calls
+        finally:
+            await client.close()
+            await runner.cleanup()
+
+    postal_codes, upstream_calls = asyncio.run(run())
+    assert postal_codes == {address: "UNKNOWN" for address in bodies}
+    # Not retried
+    assert upstream_calls == len(bodies)
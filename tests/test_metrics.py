@@ -0,0 +1,62 @@
+import asyncio
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from app.api.endpoints import metrics
+from app.db.base import Base
+from app.services import geocode
+from app.utils import misc
+from app.utils.metrics import Registry, Counter, Histogram, STAGE_SECONDS
+from tests.test_redact_csv import ORDER_HISTORY, fake_geocoder, make_export
+
+
+def test_render_prometheus_text():
+    registry = Registry()
+    requests = Counter("requests_total", "Requests", ["path"], registry=registry)
+    latency = Histogram("latency_seconds", "Latency", buckets=(0.1, 1), registry=registry)
+    requests.inc(path='/a"b')
+    requests.inc(2, path='/a"b')
+    latency.observe(0.05)
+    latency.observe(0.5)
+    latency.observe(5)
+
+    assert registry.render().splitlines() == [
+        "# HELP requests_total Requests",
+        "# TYPE requests_total counter",
+        'requests_total{path="/a\\"b"} 3',
+        "# HELP latency_seconds Latency",
+        "# TYPE latency_seconds histogram",
+        'latency_seconds_bucket{le="0.1"} 1',
+        'latency_seconds_bucket{le="1"} 2',
+        'latency_seconds_bucket{le="+Inf"} 3',
+        "latency_seconds_sum 5.55",
+        "latency_seconds_count 3",
+    ]
+
+def test_metrics_endpoint_reports_pipeline_stages(tmp_path, monkeypatch):
+    engine = create_engine(f"sqlite:///{tmp_path / 'cache.db'}")
+    Base.metadata.create_all(bind=engine)
+    monkeypatch.setattr(geocode, "SessionLocal", sessionmaker(bind=engine))
+    geocode.memory_cache.clear()
+    fake_geocoder(monkeypatch)
+    make_export(tmp_path / "input.zip", {"Retail.OrderHistory.1/Retail.OrderHistory.1.csv": ORDER_HISTORY})
+
+    before = {stage: STAGE_SECONDS.count(stage=stage) for stage in ("collect", "geocoding", "redaction", "hashing")}
+    asyncio.run(misc.modify_zip(tmp_path / "input.zip", tmp_path / "output.zip"))
+    for stage, count in before.items():
+        assert STAGE_SECONDS.count(stage=stage) == count + 1
+
+    app = FastAPI()
+    app.include_router(metrics.router, prefix="/metrics")
+    client = TestClient(app)
+    assert client.get("/metrics", headers={"X-API-Key": "wrong"}).status_code == 403
+
+    response = client.get("/metrics", headers={"X-API-Key": "test"})
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    assert 'proof_stage_seconds_count{stage="redaction"}' in response.text
+    assert 'geocode_lookups_total{source="upstream"}' in response.text
+    assert 'cache_entries{cache="geocode"} 5' in response.text
+    assert 'proof_jobs{status="running"} 0' in response.text
+    geocode.memory_cache.clear()
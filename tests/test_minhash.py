@@ -1,5 +1,366 @@
-from datasketch import MinHash
-from app.utils.minhash import serialize_minhash, deserialize_minhash
+import asyncio
+import pytest
+from datasketch import MinHash, LeanMinHash
+from sqlalchemy import create_engine, inspect, text
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from sqlalchemy.orm import sessionmaker
+from app.db.base import Base
+from app.db.models.minhash import MinHash as MinHashDb
+from app.utils.minhash import serialize_minhash, deserialize_minhash, serialize_signature, SignatureMatrix
+from app.utils.minhash import minhash_to_columns, minhash_from_columns, new_minhash, get_permutations
+from app.utils.minhash import SignatureBuilder
+from app.services import minhash as minhash_service
+from app.db.migrate import migrate_minhash_storage, run_migrations
+
+
+def make_minhash(words):
+    minhash = MinHash(num_perm=128)
+    for word in words:
+        minhash.update(word.encode('utf-8'))
+    return minhash
+
+def make_db(url="sqlite://"):
+    engine = create_engine(url)
+    Base.metadata.create_all(bind=engine)
+    return sessionmaker(bind=engine)()
+
+def make_db_at(path):
+    return make_db(f"sqlite:///{path}")
+
+def test_warm_start_from_table_and_snapshot(tmp_path, monkeypatch):
+    db = make_db()
+    words = ["coffee", "tea", "milk", "sugar", "honey"]
+    for i in range(5):
+        db.add(MinHashDb(user_id=f"user_{i}", **minhash_to_columns(make_minhash(words))))
+    db.commit()
+
+    snapshot_path = str(tmp_path / "lsh.snapshot")
+    monkeypatch.setattr(minhash_service.settings, "MINHASH_LSH_SNAPSHOT_PATH", snapshot_path)
+    monkeypatch.setattr(minhash_service.settings, "MINHASH_LSH_LOAD_BATCH_SIZE", 2)
+
+    minhash_service.warm_start_lsh(db)
+    assert minhash_service.shared_lsh_last_id == 5
+    keys = minhash_service.get_shared_lsh().query(make_minhash(words))
+    assert sorted(minhash_service.parse_minhash_key(key) for key in keys) == [
+        (f"user_{i}", i + 1) for i in range(5)
+    ]
+
+    # A restart picks up the snapshot and only catches up on the new row
+    db.add(MinHashDb(user_id="late", **minhash_to_columns(make_minhash(words))))
+    db.commit()
+    lsh, signatures, forest, last_id = minhash_service.load_lsh_snapshot(snapshot_path)
+    assert last_id == 5 and len(signatures) == 5 and len(forest) == 5
+    assert minhash_service.load_minhashes_into_lsh(db, lsh, signatures, forest, after_id=last_id) == (6, 1)
+    assert "late_6" in lsh.query(make_minhash(words))
+    assert 6 in signatures and "late_6" in forest.query(make_minhash(words), 10)
+
+def test_signature_matrix_matches_pairwise_jaccard():
+    query = make_minhash(["a", "b", "c", "d"])
+    stored = [make_minhash(["a", "b", "c", "d"][:n] + ["x", "y"]) for n in range(4)]
+
+    signatures = SignatureMatrix(128, capacity=1)
+    signatures.add_many((i, f"user_{i}", minhash) for i, minhash in enumerate(stored))
+    signatures.add(99, "other_seed", MinHash(num_perm=128, seed=7))
+
+    similarities = signatures.jaccard(query, [0, 1, 2, 3, 42, 99])
+    assert similarities == {i: query.jaccard(minhash) for i, minhash in enumerate(stored)}
+    assert signatures.get(2)[0] == "user_2"
+    assert serialize_signature(*signatures.get(3)[1:]) == serialize_minhash(stored[3])
+
+def test_shared_lsh_storage_across_workers(tmp_path, monkeypatch):
+    fakeredis = pytest.importorskip("fakeredis")
+    import datasketch.storage
+
+    # A local stand-in for the redis server every worker connects to
+    server = fakeredis.FakeServer()
+    monkeypatch.setattr(datasketch.storage.redis, "Redis", lambda **kwargs: fakeredis.FakeRedis(server=server))
+    monkeypatch.setattr(minhash_service.settings, "MINHASH_LSH_STORAGE_CONFIG",
+                        '{"type": "redis", "redis": {"host": "redis", "port": 6379}}')
+    monkeypatch.setattr(minhash_service.settings, "MINHASH_LSH_SNAPSHOT_PATH", str(tmp_path / "lsh.snapshot"))
+
+    db = make_db()
+    words = ["coffee", "tea", "milk"]
+    ids = minhash_service.save_minhashes(db, [("user_1", make_minhash(words)), ("user_2", make_minhash(words))])
+
+    # Two workers warm up against the same store, the second finds the keys already there
+    minhash_service.warm_start_lsh(db)
+    first = minhash_service.get_shared_lsh()
+    minhash_service.warm_start_lsh(db)
+    second = minhash_service.get_shared_lsh()
+    assert first is not second
+    assert first.keys.size() == 2
+    assert not (tmp_path / "lsh.snapshot").exists()
+
+    # An insert on one worker is visible to queries on the other
+    [new_id] = minhash_service.save_minhashes(db, [("user_3", make_minhash(words))])
+    minhash_service.index_minhash(first, "user_3", new_id, make_minhash(words))
+    assert sorted(second.query(make_minhash(words))) == ["user_1_1", "user_2_2", "user_3_3"]
+
+    # Async handlers query a shared store from a thread, not the event loop
+    import threading
+    threads = []
+    query = second.query
+    monkeypatch.setattr(second, "query", lambda minhash: threads.append(threading.current_thread()) or query(minhash))
+    keys = asyncio.run(minhash_service.query_lsh_async(second, make_minhash(words)))
+    assert sorted(keys) == ["user_1_1", "user_2_2", "user_3_3"]
+    assert threads and threads[0] is not threading.main_thread()
+
+    # The other worker's signature matrix catches up on refresh
+    assert new_id not in minhash_service.get_shared_signatures()
+    assert minhash_service.refresh_shared_index(db) == 1
+    assert new_id in minhash_service.get_shared_signatures()
+
+    # A delete on the other worker is left out of top-k forest candidates right away
+    deleted = minhash_service.delete_minhashes(db, ids=[ids[0]])
+    minhash_service.unindex_minhashes(first, deleted)
+    top = minhash_service.query_top_k(db, second, minhash_service.get_shared_forest(),
+                                      minhash_service.get_shared_signatures(), make_minhash(["coffee"]), 5)
+    assert ids[0] not in [result[0] for result in top] and len(top) == 2
+
+def test_delete_upsert_expire_and_compact(monkeypatch):
+    monkeypatch.setattr(minhash_service.settings, "MINHASH_LSH_SNAPSHOT_PATH", "")
+    monkeypatch.setattr(minhash_service.settings, "MINHASH_LSH_STORAGE_CONFIG", "")
+    db = make_db()
+    words = ["coffee", "tea", "milk"]
+    ids = minhash_service.save_minhashes(db, [(f"user_{i % 2}", make_minhash(words)) for i in range(4)])
+    minhash_service.warm_start_lsh(db)
+    lsh = minhash_service.get_shared_lsh()
+    query = make_minhash(words)
+
+    # Delete by ID, then by user
+    deleted = minhash_service.delete_minhashes(db, ids=[ids[0]])
+    minhash_service.unindex_minhashes(lsh, deleted)
+    assert deleted == [(1, "user_0")]
+    deleted = minhash_service.delete_minhashes(db, user_ids=["user_1"])
+    minhash_service.unindex_minhashes(lsh, deleted)
+    assert sorted(deleted) == [(2, "user_1"), (4, "user_1")]
+    assert lsh.query(query) == ["user_0_3"]
+
+    # Upserting replaces everything the user had
+    [new_id], replaced = minhash_service.replace_user_minhashes(db, [("user_0", query)])
+    minhash_service.unindex_minhashes(lsh, replaced)
+    minhash_service.index_minhash(lsh, "user_0", new_id, query)
+    assert replaced == [(3, "user_0")]
+    assert lsh.query(query) == ["user_0_5"]
+    assert [r[0] for r in minhash_service.query_top_k(db, lsh, minhash_service.get_shared_forest(),
+                                                      minhash_service.get_shared_signatures(), query, 5)] == [5]
+
+    # Entries removed behind the index's back are dropped as orphans
+    db.query(MinHashDb).delete()
+    db.commit()
+    assert minhash_service.compact_shared_index(db) == 1
+    assert len(lsh.keys) == 0 and len(minhash_service.get_shared_signatures()) == 0
+    assert minhash_service.get_shared_signatures().dead_rows == 0
+
+    # Entries past the TTL expire from the table and the index
+    [old_id] = minhash_service.save_minhashes(db, [("user_2", query)])
+    minhash_service.index_minhash(lsh, "user_2", old_id, query)
+    assert minhash_service.expire_minhashes(db, ttl=3600) == 0
+    assert minhash_service.expire_minhashes(db, ttl=-1) == 1
+    assert lsh.query(query) == []
+
+def test_compaction_while_another_thread_inserts(monkeypatch):
+    import threading
+    monkeypatch.setattr(minhash_service.settings, "MINHASH_LSH_SNAPSHOT_PATH", "")
+    monkeypatch.setattr(minhash_service.settings, "MINHASH_LSH_STORAGE_CONFIG", "")
+    db = make_db()
+    minhash_service.warm_start_lsh(db)
+    lsh = minhash_service.get_shared_lsh()
+    minhash = make_minhash(["coffee"])
+    # Orphans, none of them is in the table
+    with lsh.insertion_session() as session:
+        for minhash_id in range(1, 50001):
+            session.insert(minhash_service.minhash_key("user", minhash_id), minhash, check_duplication=False)
+
+    stop = threading.Event()
+    def insert():
+        minhash_id = 100000
+        while not stop.is_set():
+            minhash_id += 1
+            lsh.insert(minhash_service.minhash_key("other", minhash_id), minhash, check_duplication=False)
+    inserter = threading.Thread(target=insert)
+    inserter.start()
+    try:
+        assert minhash_service.compact_shared_index(db) >= 50000
+    finally:
+        stop.set()
+        inserter.join()
+    assert not any(key.startswith("user_") for key in lsh.keys.keys())
+
+def test_score_candidates_reads_through_missing_signatures():
+    db = make_db()
+    minhash = make_minhash(["coffee", "tea"])
+    db.add(MinHashDb(user_id="user_1", **minhash_to_columns(minhash)))
+    db.commit()
+
+    signatures = SignatureMatrix(128)
+    results = minhash_service.score_candidates(db, minhash, ["user_1_1", "gone_2"], signatures)
+    assert results == [(1, "user_1", 1.0)]
+    assert 1 in signatures
+
+def test_score_candidates_async_reads_through(tmp_path):
+    db = make_db_at(tmp_path / "minhash.db")
+    minhash = make_minhash(["coffee", "tea"])
+    db.add(MinHashDb(user_id="user_1", **minhash_to_columns(minhash)))
+    db.commit()
+
+    async def query():
+        engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'minhash.db'}")
+        try:
+            async with async_sessionmaker(engine)() as session:
+                signatures = SignatureMatrix(128)
+                top = await minhash_service.query_top_k_async(
+                    session, minhash_service.new_lsh(), None, SignatureMatrix(128), minhash, 5)
+                scored = await minhash_service.score_candidates_async(session, minhash, ["user_1_1"], signatures)
+                single = await minhash_service.get_minhash_by_id_async(session, 1)
+                return top, scored, single
+        finally:
+            await engine.dispose()
+
+    top, scored, single = asyncio.run(query())
+    assert top == []
+    assert scored == [(1, "user_1", 1.0)]
+    assert single.jaccard(minhash) == 1.0
+
+def test_save_minhashes_returns_ids_in_order():
+    db = make_db()
+    minhashes = [make_minhash([str(i)]) for i in range(3)]
+    ids = minhash_service.save_minhashes(db, [(f"user_{i}", m) for i, m in enumerate(minhashes)])
+    assert ids == [1, 2, 3]
+
+    lsh = minhash_service.new_lsh()
+    minhash_service.index_minhashes(lsh, [(i, "user", m) for i, m in zip(ids, minhashes)])
+    assert lsh.query(minhashes[1]) == ["user_2"]
+
+def test_score_candidates_batch_groups_results_per_query():
+    db = make_db()
+    minhashes = [make_minhash(["coffee", "tea", str(i)]) for i in range(3)]
+    ids = minhash_service.save_minhashes(db, [("user", m) for m in minhashes])
+
+    signatures = SignatureMatrix(128)
+    keys = [minhash_service.minhash_key("user", i) for i in ids]
+    results = minhash_service.score_candidates_batch(db, minhashes[:2], [keys, keys[1:]], signatures)
+    assert [len(r) for r in results] == [3, 2]
+    assert dict((r[0], r[2]) for r in results[1])[ids[1]] == 1.0
+    assert len(signatures) == 3
+
+def test_query_top_k_ranks_below_the_lsh_threshold():
+    db = make_db()
+    words = [str(i) for i in range(40)]
+    lsh, forest, signatures = minhash_service.new_lsh(), minhash_service.new_forest(), SignatureMatrix(128)
+    for i in range(20):
+        db.add(MinHashDb(user_id=f"user_{i}", **minhash_to_columns(make_minhash(words[:40 - 2 * i]))))
+    db.commit()
+    minhash_service.load_minhashes_into_lsh(db, lsh, signatures, forest)
+
+    query = make_minhash(words)
+    results = minhash_service.query_top_k(db, lsh, forest, signatures, query, k=12, min_similarity=0.3)
+    assert len(results) == 12
+    assert [r[2] for r in results] == sorted((r[2] for r in results), reverse=True)
+    assert results[0][:2] == (1, "user_0")
+    # The forest finds candidates the LSH alone would drop at its threshold
+    assert all(r[2] >= 0.3 for r in results) and results[-1][2] < 0.7
+
+def test_query_skips_candidates_removed_after_scoring():
+    from app.api.endpoints import minhash as endpoints
+    from app.schemas.minhash import MinHashBatchInput, MinHashInput
+
+    # Entry 1 is deleted by another request between scoring and serializing
+    class RacingSignatures(SignatureMatrix):
+        def get(self, minhash_id):
+            return None if minhash_id == 1 else super().get(minhash_id)
+
+    db = make_db()
+    minhash = make_minhash(["coffee", "tea"])
+    ids = minhash_service.save_minhashes(db, [("user_1", minhash), ("user_2", minhash)])
+    lsh, signatures = minhash_service.new_lsh(), RacingSignatures(128)
+    minhash_service.index_minhashes(lsh, [(ids[0], "user_1", minhash), (ids[1], "user_2", minhash)])
+    signatures.add_many([(ids[0], "user_1", minhash), (ids[1], "user_2", minhash)])
+
+    item = MinHashBatchInput(items=[MinHashInput(user_id="query", minhash_data=serialize_minhash(minhash))])
+    output = endpoints.query_similar_minhashes_batch(item, api_key="test", db=db, lsh=lsh, signatures=signatures)
+    assert [candidate.id for candidate in output.results[0].candidates] == [ids[1]]
+
+def test_binary_columns_round_trip():
+    minhash = make_minhash(["coffee", "tea"])
+    columns = minhash_to_columns(minhash)
+    assert columns["num_perm"] == 128 and len(columns["hashvalues"]) == 128 * 8
+
+    decoded = minhash_from_columns(columns["seed"], memoryview(columns["hashvalues"]))
+    assert decoded.jaccard(minhash) == 1.0
+    assert serialize_minhash(decoded) == serialize_minhash(minhash)
+
+def test_deserialize_is_lean_and_validated():
+    minhash = make_minhash(["coffee", "tea"])
+    decoded = deserialize_minhash(serialize_minhash(minhash))
+    assert isinstance(decoded, LeanMinHash)
+    assert decoded.jaccard(minhash) == 1.0
+
+    buf = minhash_to_columns(minhash)["hashvalues"]
+    assert minhash_from_columns(1, buf).hashvalues.base is not None
+    with pytest.raises(ValueError):
+        minhash_from_columns(1, buf[:64 * 8])
+
+def test_new_minhash_reuses_permutations():
+    first, second = new_minhash(), new_minhash()
+    assert first.permutations is second.permutations is get_permutations(1, 128)
+    first.update(b"coffee")
+    assert first.jaccard(make_minhash(["coffee"])) == 1.0
+
+def test_signature_builder_matches_datasketch():
+    words = [f"word {i}" for i in range(1000)]
+    first, second = SignatureBuilder(batch_size=64), SignatureBuilder(batch_size=1000)
+    first.update(words[:300])
+    second.update(words[300:])
+    first.merge(second)
+    assert first.shingles == 1000
+    assert (first.minhash().hashvalues == make_minhash(words).hashvalues).all()
+    assert SignatureBuilder().empty
+
+def test_save_order_history_stores_and_indexes():
+    from app.db.models.order_history import OrderHistory
+    from app.services.order_history import save_order_history
+    db = make_db()
+    lsh = minhash_service.new_lsh()
+    minhash = make_minhash(["asin:B000000001", "title:coffee"])
+
+    minhash_id = save_order_history(db, lsh, "user", minhash)
+    assert lsh.query(minhash) == [f"user_{minhash_id}"]
+    assert minhash_service.get_minhash_by_id(db, minhash_id).jaccard(minhash) == 1.0
+    [row] = db.query(OrderHistory).all()
+    assert (row.user_id, row.minhash_id) == ("user", minhash_id)
+
+def test_migrate_order_history_to_minhash_ids():
+    from app.db.migrate import init_db
+    engine = create_engine("sqlite://")
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE order_history (id INTEGER PRIMARY KEY, user_id VARCHAR, minhash VARCHAR)"))
+        conn.execute(text("CREATE INDEX ix_order_history_minhash ON order_history (minhash)"))
+        conn.execute(text("INSERT INTO order_history (user_id, minhash) VALUES ('user', '{}')"))
+
+    init_db(engine)
+    inspector = inspect(engine)
+    assert {column["name"] for column in inspector.get_columns("order_history")} == {"id", "user_id", "minhash_id"}
+    assert "ix_order_history_minhash" not in {index["name"] for index in inspector.get_indexes("order_history")}
+
+def test_migrate_json_rows_to_binary_storage():
+    engine = create_engine("sqlite://")
+    minhashes = [make_minhash([str(i)]) for i in range(3)]
+    with engine.begin() as conn:
+        conn.execute(text("CREATE TABLE minhashes (id INTEGER PRIMARY KEY, user_id VARCHAR, minhash_data VARCHAR)"))
+        conn.execute(text("CREATE INDEX ix_minhashes_minhash_data ON minhashes (minhash_data)"))
+        conn.execute(
+            text("INSERT INTO minhashes (user_id, minhash_data) VALUES (:user_id, :minhash_data)"),
+            [{"user_id": f"user_{i}", "minhash_data": serialize_minhash(m)} for i, m in enumerate(minhashes)],
+        )
+
+    migrate_minhash_storage(engine, batch_size=2)
+    run_migrations(engine)
+
+    db = sessionmaker(bind=engine)()
+    for i, minhash in enumerate(minhashes):
+        assert minhash_service.get_minhash_by_id(db, i + 1).jaccard(minhash) == 1.0
+    assert db.query(MinHashDb).filter(MinHashDb.created_at.is_(None)).count() == 0
 
 if __name__ == "__main__":
     product = "Coffee"
@@ -0,0 +1,73 @@
+import asyncio
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from app.db.base import Base
+from app.db.models.proof import Proof
+from app.services import proof as proof_service
+from app.services.proof import get_proof_by_proof_key, get_data_hashes_by_proof_keys, create_proof
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from app.api.deps import get_async_db
+from app.api.endpoints import proof as proof_endpoints
+
+
+def run_with_db(tmp_path, scenario):
+    async def run():
+        engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'proofs.db'}")
+        try:
+            async with engine.begin() as conn:
+                await conn.run_sync(Base.metadata.create_all)
+            async with async_sessionmaker(engine, expire_on_commit=False)() as db:
+                return await scenario(db, engine)
+        finally:
+            await engine.dispose()
+    proof_service.proof_cache.clear()
+    proof_service.missing_proof_cache.clear()
+    return asyncio.run(run())
+
+def test_proof_services_on_async_session(tmp_path):
+    async def scenario(db, engine):
+        assert await get_proof_by_proof_key(db, proof_key="key") is None
+        await create_proof(db, Proof(proof_key="key", data_hash="hash"))
+        proof = await get_proof_by_proof_key(db, proof_key="key")
+        return proof.data_hash
+
+    assert run_with_db(tmp_path, scenario) == "hash"
+
+def test_proof_cache_and_bulk_lookup(tmp_path):
+    statements = []
+
+    async def scenario(db, engine):
+        db.add_all([Proof(proof_key=f"key{i}", data_hash=f"hash{i}") for i in range(3)])
+        await db.commit()
+        event.listen(engine.sync_engine, "before_cursor_execute", lambda *args: statements.append(args[2]))
+
+        assert (await get_proof_by_proof_key(db, proof_key="key0")).data_hash == "hash0"
+        lookup = await get_data_hashes_by_proof_keys(db, ["key0", "key1", "key2", "nope", "key1"])
+        assert lookup == {"key0": "hash0", "key1": "hash1", "key2": "hash2"}
+        # Everything, including the miss, is now served from the caches
+        assert await get_data_hashes_by_proof_keys(db, ["key2", "nope"]) == {"key2": "hash2"}
+        assert await get_proof_by_proof_key(db, proof_key="nope") is None
+        assert len(statements) == 2
+
+        # Creating a proof replaces its cached miss
+        await create_proof(db, Proof(proof_key="nope", data_hash="late"))
+        assert (await get_proof_by_proof_key(db, proof_key="nope")).data_hash == "late"
+
+    run_with_db(tmp_path, scenario)
+    assert proof_service.proof_cache_stats()["proofs"]["hits"] >= 3
+
+def test_user_id_requires_the_api_key():
+    app = FastAPI()
+    app.include_router(proof_endpoints.router, prefix="/api/proof")
+    app.dependency_overrides[get_async_db] = lambda: None
+    client = TestClient(app)
+
+    for path in ("/api/proof/", "/api/proof/jobs"):
+        # Rejected before the link is even looked at
+        body = {"link": "https://example.com/export.zip", "user_id": "user"}
+        assert client.post(path, json=body).status_code == 403
+        assert client.post(path, json=body, headers={"X-API-Key": "wrong"}).status_code == 403
+        assert client.post(path, json=body, headers={"X-API-Key": "test"}).status_code == 400
+        # Proofs without a user_id stay open
+        assert client.post(path, json={"link": body["link"]}).status_code == 400
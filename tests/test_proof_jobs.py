@@ -0,0 +1,100 @@
+import asyncio
+import pytest
+from app.services.proof_jobs import ProofJobManager, QueueFullError, JOB_DONE, JOB_FAILED
+
+
+def test_jobs_dedup_backpressure_and_results(tmp_path):
+    runs = []
+    release = None
+
+    async def run(job):
+        runs.append(job.proof_key)
+        await release.wait()
+        if job.proof_key == "bad":
+            raise Exception("Failed to download or hash data.")
+        path = tmp_path / job.proof_key
+        path.write_bytes(b"zip")
+        return "hash-" + job.proof_key, str(path)
+
+    async def scenario():
+        nonlocal release
+        release = asyncio.Event()
+        jobs = ProofJobManager(run, workers=1, max_queue=2, result_ttl=3600)
+        try:
+            first = jobs.submit("a", "link-a")
+            await asyncio.sleep(0)  # let the worker pick it up
+            # The same proof key shares the job in flight
+            assert jobs.submit("a", "link-a") is first
+            jobs.submit("b", "link-b")
+            bad = jobs.submit("bad", "link-bad")
+            with pytest.raises(QueueFullError):
+                jobs.submit("c", "link-c")
+
+            release.set()
+            while not bad.finished:
+                await asyncio.sleep(0.01)
+            assert jobs.get(first.job_id).status == JOB_DONE
+            assert first.data_hash == "hash-a" and open(first.file_path, "rb").read() == b"zip"
+            assert bad.status == JOB_FAILED and bad.error == "Failed to download or hash data."
+            assert not jobs.in_flight("a")
+
+            # Expired results are forgotten along with their files
+            jobs.result_ttl = -1
+            assert jobs.get(first.job_id) is None
+        finally:
+            await jobs.stop()
+
+    asyncio.run(scenario())
+    assert runs == ["a", "b", "bad"]
+    assert list(tmp_path.iterdir()) == []
+
+def test_completed_jobs_only_hold_their_output(tmp_path):
+    from app.services.admission import Admission, MemoryBudget
+    from app.utils.download import ExportInfo
+    budget = MemoryBudget(10000)
+
+    async def run(job):
+        path = tmp_path / job.proof_key
+        path.write_bytes(b"z" * 300)
+        return "hash", str(path)
+
+    async def scenario():
+        jobs = ProofJobManager(run, workers=1, max_queue=2, result_ttl=3600)
+        try:
+            # On the tmpfs the output still counts, spilled it doesn't
+            tmpfs = jobs.submit("tmpfs", "link", Admission(ExportInfo(1000), None, budget.reserve(1000 + 2 * 1000)))
+            spilled = jobs.submit("spilled", "link", Admission(ExportInfo(1000), str(tmp_path), budget.reserve(1000)))
+            while not (tmpfs.finished and spilled.finished):
+                await asyncio.sleep(0.01)
+            assert tmpfs.status == spilled.status == JOB_DONE
+            assert budget.reserved == 300
+        finally:
+            await jobs.stop()
+        assert budget.reserved == 0
+
+    asyncio.run(scenario())
+
+def test_expired_jobs_are_pruned_without_requests(tmp_path, monkeypatch):
+    from app.services import proof_jobs
+
+    async def run(job):
+        path = tmp_path / job.proof_key
+        path.write_bytes(b"z")
+        return "hash", str(path)
+
+    async def scenario():
+        jobs = ProofJobManager(run, workers=1, max_queue=1, result_ttl=0.05)
+        monkeypatch.setattr(proof_jobs, "_proof_jobs", jobs)
+        pruning = asyncio.create_task(proof_jobs.prune_proof_jobs_periodically(0.05))
+        try:
+            job = jobs.submit("key", "link")
+            while not job.finished:
+                await asyncio.sleep(0.01)
+            assert (tmp_path / "key").exists()
+            await asyncio.sleep(0.2)
+            assert not jobs.jobs and not (tmp_path / "key").exists()
+        finally:
+            pruning.cancel()
+            await jobs.stop()
+
+    asyncio.run(scenario())
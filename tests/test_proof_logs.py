@@ -0,0 +1,90 @@
+import asyncio
+import pytest
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+from app.db.base import Base
+from app.services import proof_logs
+from app.services.proof_logs import ProofLogBuffer, LogBufferFullError, LogEntryTooLargeError, save_proof_logs, get_proof_logs
+from app.services.proof_logs import decode_log_content
+
+
+def test_buffer_batches_on_size_and_time():
+    batches = []
+
+    async def write(entries):
+        batches.append([content for _, content, _ in entries])
+
+    async def scenario():
+        buffer = ProofLogBuffer(write, max_size=5, batch_size=3, flush_interval=0.2)
+        for i in range(5):
+            buffer.add("key", f"line {i}")
+        # The buffer is bounded
+        with pytest.raises(LogBufferFullError):
+            buffer.add("key", "line 5")
+
+        # A full batch is written right away, the rest once the interval is up
+        await asyncio.sleep(0.05)
+        assert batches == [["line 0", "line 1", "line 2"]]
+        await asyncio.sleep(0.3)
+        assert batches[1] == ["line 3", "line 4"]
+
+        # Stopping writes whatever is still buffered
+        buffer.add("key", "line 6")
+        await buffer.stop()
+        assert batches[2] == ["line 6"]
+
+    asyncio.run(scenario())
+
+def test_buffer_is_bounded_in_bytes():
+    batches = []
+
+    async def write(entries):
+        batches.append([content for _, content, _ in entries])
+
+    async def scenario():
+        buffer = ProofLogBuffer(write, max_size=100, batch_size=100, flush_interval=0.1, max_bytes=10, max_entry_bytes=6)
+        # Oversized entries are refused outright, counted in UTF-8 bytes
+        with pytest.raises(LogEntryTooLargeError):
+            buffer.add("key", "x" * 7)
+        with pytest.raises(LogEntryTooLargeError):
+            buffer.add("key", "é" * 4)
+
+        buffer.add("key", "x" * 6)
+        buffer.add("key", "é" * 2)
+        with pytest.raises(LogBufferFullError):
+            buffer.add("key", "x")
+        assert buffer.buffered_bytes == 10
+
+        # Writing the batch frees its bytes
+        await asyncio.sleep(0.2)
+        assert batches == [["x" * 6, "é" * 2]]
+        assert buffer.buffered_bytes == 0
+        buffer.add("key", "x" * 6)
+        await buffer.stop()
+
+    asyncio.run(scenario())
+
+def test_save_and_page_proof_logs(tmp_path, monkeypatch):
+    monkeypatch.setattr(proof_logs.settings, "PROOF_LOG_COMPRESS_MIN_BYTES", 1024)
+    big = "x" * 100000
+
+    async def scenario():
+        engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'logs.db'}")
+        try:
+            async with engine.begin() as conn:
+                await conn.run_sync(Base.metadata.create_all)
+            async with async_sessionmaker(engine, expire_on_commit=False)() as db:
+                entries = [("a", f"line {i}", proof_logs.utcnow()) for i in range(5)] + [("b", big, proof_logs.utcnow())]
+                await save_proof_logs(db, entries)
+
+                first = await get_proof_logs(db, "a", limit=3)
+                second = await get_proof_logs(db, "a", after_id=first[-1].id, limit=3)
+                assert [decode_log_content(entry) for entry in first + second] == [f"line {i}" for i in range(5)]
+
+                # Large entries are stored compressed
+                [stored] = await get_proof_logs(db, "b")
+                assert stored.compressed and len(stored.content) < 1000
+                assert decode_log_content(stored) == big
+        finally:
+            await engine.dispose()
+
+    asyncio.run(scenario())
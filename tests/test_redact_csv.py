@@ -0,0 +1,166 @@
+import asyncio
+import hashlib
+import io
+import re
+import zipfile
+import pandas as pd
+import pytest
+from sqlalchemy import create_engine
+from sqlalchemy.orm import sessionmaker
+from app.db.base import Base
+from app.db.models.geocode_cache import GeocodeCache
+from app.services import geocode
+from app.utils import misc
+from app.utils.minhash import SignatureBuilder, new_minhash
+
+
+ORDER_HISTORY = (
+    '﻿"Order ID","Shipping Address","Billing Address","Product Name"\n'
+    + "".join(
+        f'"{i}","{i % 3} Main St, Springfield","{i % 2} Elm St, Shelbyville","Item, {i}"\n'
+        for i in range(10)
+    )
+)
+
+def fake_geocoder(monkeypatch):
+    calls = []
+
+    async def fetch_postal_codes(locations):
+        calls.extend(locations)
+        return {location: location.split(" ")[0] * 5 for location in locations}
+
+    monkeypatch.setattr(misc, "fetch_postal_codes", fetch_postal_codes)
+    return calls
+
+@pytest.fixture(autouse=True)
+def geocode_cache_db(tmp_path, monkeypatch):
+    engine = create_engine(f"sqlite:///{tmp_path / 'cache.db'}")
+    Base.metadata.create_all(bind=engine)
+    monkeypatch.setattr(geocode, "SessionLocal", sessionmaker(bind=engine))
+    geocode.memory_cache.clear()
+    yield
+    geocode.memory_cache.clear()
+
+def make_export(path, files):
+    with zipfile.ZipFile(path, "w", zipfile.ZIP_DEFLATED) as export:
+        for name, content in files.items():
+            export.writestr(name, content)
+
+def test_modify_zip_streams_csv_in_chunks(tmp_path, monkeypatch):
+    calls = fake_geocoder(monkeypatch)
+    monkeypatch.setattr(misc.settings, "CSV_CHUNK_ROWS", 3)
+    make_export(tmp_path / "input.zip", {
+        "Retail.OrderHistory.1/Retail.OrderHistory.1.csv": ORDER_HISTORY,
+        "Retail.OrderHistory.2/Retail.OrderHistory.2.csv": '"Order ID","Shipping Address"\n',
+        "Retail.CartItems.1/Retail.CartItems.1.csv": "a,b\n1,2\n",
+        "Unrelated/file.csv": "secret\n",
+    })
+
+    data_hash = asyncio.run(misc.modify_zip(tmp_path / "input.zip", tmp_path / "output.zip"))
+    assert data_hash == hashlib.sha3_256((tmp_path / "output.zip").read_bytes()).hexdigest()
+
+    with zipfile.ZipFile(tmp_path / "output.zip") as output:
+        assert sorted(output.namelist()) == [
+            "Retail.CartItems.1.csv",
+            "Retail.OrderHistory.1.csv",
+            "Retail.OrderHistory.2.csv",
+        ]
+        df = pd.read_csv(io.BytesIO(output.read("Retail.OrderHistory.1.csv")), dtype=str)
+        assert output.read("Retail.OrderHistory.2.csv") == b"Order ID,Shipping Address\n"
+        assert output.read("Retail.CartItems.1.csv") == b"a,b\n1,2\n"
+
+    assert len(df) == 10
+    assert df["Shipping Address"].tolist() == [str(i % 3) * 5 for i in range(10)]
+    assert df["Billing Address"].tolist() == [str(i % 2) * 5 for i in range(10)]
+    assert df["Product Name"].tolist() == [f"Item, {i}" for i in range(10)]
+    # Every distinct address is geocoded once, however many chunks it spans
+    assert sorted(calls) == sorted(set(calls)) and len(calls) == 5
+
+def test_modify_zip_reuses_cached_postal_codes(tmp_path, monkeypatch):
+    calls = fake_geocoder(monkeypatch)
+    make_export(tmp_path / "input.zip", {
+        "Retail.OrderHistory.1/Retail.OrderHistory.1.csv": ORDER_HISTORY,
+        "Digital Items/Digital Items.csv": '"ShipFrom","ShipTo"\n"0  main st,  SPRINGFIELD","Not Applicable"\n',
+    })
+
+    first_hash = asyncio.run(misc.modify_zip(tmp_path / "input.zip", tmp_path / "first.zip"))
+    # Addresses are normalized, and collected across files before geocoding
+    assert len(calls) == 5
+
+    # The second request is served by the in-process cache, the third by the table
+    calls.clear()
+    assert asyncio.run(misc.modify_zip(tmp_path / "input.zip", tmp_path / "second.zip")) == first_hash
+    geocode.memory_cache.clear()
+    assert asyncio.run(misc.modify_zip(tmp_path / "input.zip", tmp_path / "third.zip")) == first_hash
+    assert calls == []
+
+    # The table, outside the enclave, only holds keyed digests of the addresses
+    db = geocode.SessionLocal()
+    digests = [row.address_digest for row in db.query(GeocodeCache).all()]
+    db.close()
+    assert len(digests) == 5 and all(re.fullmatch(r"[0-9a-f]{64}", digest) for digest in digests)
+
+    with zipfile.ZipFile(tmp_path / "third.zip") as output:
+        assert output.read("Digital Items.csv") == b"ShipFrom,ShipTo\n00000,Not Applicable\n"
+
+def test_modify_zip_passes_blank_addresses_through(tmp_path, monkeypatch):
+    calls = fake_geocoder(monkeypatch)
+    make_export(tmp_path / "input.zip", {
+        "Digital Items/Digital Items.csv": '"ShipFrom","ShipTo"\n"1 Main St",""\n"  ","1 Main St"\n',
+    })
+
+    asyncio.run(misc.modify_zip(tmp_path / "input.zip", tmp_path / "output.zip"))
+    assert calls == ["1 Main St"]
+    with zipfile.ZipFile(tmp_path / "output.zip") as output:
+        assert output.read("Digital Items.csv") == b'ShipFrom,ShipTo\n11111,\n  ,11111\n'
+
+def test_migrate_plaintext_geocode_cache(tmp_path):
+    from sqlalchemy import inspect, text
+    from app.db.migrate import init_db
+    engine = create_engine(f"sqlite:///{tmp_path / 'old.db'}")
+    with engine.begin() as conn:
+        conn.execute(text(
+            "CREATE TABLE geocode_cache (address_key VARCHAR PRIMARY KEY, postal_code VARCHAR, updated_at DATETIME)"
+        ))
+        conn.execute(text("INSERT INTO geocode_cache VALUES ('1 main st, springfield', '12345', '2024-01-01')"))
+
+    init_db(engine)
+    columns = {column["name"] for column in inspect(engine).get_columns("geocode_cache")}
+    assert "address_key" not in columns and "address_digest" in columns
+    with engine.connect() as conn:
+        assert conn.execute(text("SELECT COUNT(*) FROM geocode_cache")).scalar() == 0
+
+def test_modify_zip_in_process_pool(tmp_path, monkeypatch):
+    from app.utils import workers
+    calls = fake_geocoder(monkeypatch)
+    monkeypatch.setattr(workers, "_executor", None)
+    monkeypatch.setattr(workers.settings, "WORKER_POOL_KIND", "process")
+    monkeypatch.setattr(workers.settings, "WORKER_POOL_SIZE", 2)
+    make_export(tmp_path / "input.zip", {"Retail.OrderHistory.1/Retail.OrderHistory.1.csv": ORDER_HISTORY})
+
+    # The order history is shingled in the worker, into a copy of the signer
+    signer = SignatureBuilder()
+    try:
+        data_hash = asyncio.run(misc.modify_zip(tmp_path / "input.zip", tmp_path / "output.zip", signer))
+    finally:
+        workers.shutdown_executor()
+
+    assert data_hash == hashlib.sha3_256((tmp_path / "output.zip").read_bytes()).hexdigest()
+    assert len(calls) == 5
+    assert signer.shingles == 10
+    expected = new_minhash()
+    expected.update_batch([f"title:item {i}".encode() for i in range(10)])
+    assert (signer.hashvalues == expected.hashvalues).all()
+
+def test_order_history_shingles():
+    df = pd.DataFrame({
+        "ASIN": [" b000000001", "B000000001", ""],
+        "Product Name": ["Fresh Ground Coffee, 12 oz", "Fresh Ground Coffee, 12 oz", "Mug"],
+    })
+    assert misc.order_history_shingles(df, 3) == {
+        "asin:B000000001",
+        "title:fresh ground coffee",
+        "title:ground coffee 12",
+        "title:coffee 12 oz",
+        "title:mug",
+    }
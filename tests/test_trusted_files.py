@@ -0,0 +1,37 @@
+import os
+import sys
+
+import pytest
+
+from tools.trusted_files import rewrite_manifest, trusted_paths, library_roots, record_files, verify
+
+def test_trusted_paths_groups_packages():
+    import json
+    root = os.path.dirname(os.path.realpath(json.__file__))
+    paths = trusted_paths([os.path.realpath(json.__file__), os.path.join(root, "decoder.py")])
+    assert root in paths
+    assert not any(path.startswith(root + os.sep) for path in paths)
+
+def test_rewrite_manifest_replaces_library_directories():
+    root = library_roots()[0]
+    template = (
+        'sgx.trusted_files = [\n'
+        '    "file:{{ arch_libdir }}/",\n'
+        '    "file:/app/",\n'
+        f'    "file:{root}/",\n'
+        ']\n'
+    )
+    manifest = rewrite_manifest(template, [sys.executable])
+    assert f'"file:{root}/"' not in manifest
+    assert '"file:{{ arch_libdir }}/"' in manifest
+    assert '"file:/app/"' in manifest
+    assert f'    "file:{sys.executable}",\n]' in manifest
+
+def test_pruned_paths_still_start_the_server():
+    paths = trusted_paths(record_files())
+    verify(paths)
+
+    import uvicorn
+    uvicorn_dir = os.path.dirname(os.path.realpath(uvicorn.__file__))
+    with pytest.raises(RuntimeError, match="uvicorn"):
+        verify([path for path in paths if path != uvicorn_dir])
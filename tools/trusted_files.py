@@ -0,0 +1,366 @@
+# tools/trusted_files.py
+"""Generate a minimal `sgx.trusted_files` list from the modules a representative run imports.
+
+Gramine hashes every trusted file the enclave opens. Trusting whole Python
+library directories makes it hash far more than the app ever loads, and
+without bytecode it opens, hashes and compiles every source file on each
+start. This tool:
+
+1. runs a representative workload (serve a few requests through uvicorn,
+   redact a small synthetic export through the stub geocoder, build and
+   query a small LSH index) in a fresh interpreter and records the modules
+   and shared libraries it loaded,
+2. replaces the Python library directories of the manifest template's
+   `sgx.trusted_files` with the packages those came from, the packages the
+   entrypoint needs, and the whole standard library,
+3. checks that the app and the server still import from those alone, and
+   fails otherwise,
+4. precompiles them to bytecode that Python loads without reading the source,
+5. reports the startup time and the trusted bytes before and after.
+
+    python -m tools.trusted_files --manifest app.manifest.template --output app.manifest.template --precompile
+
+Run it where the enclave's Python lives, e.g. in the image build, since the
+paths it writes are that interpreter's.
+"""
+import argparse
+import compileall
+import importlib.metadata
+import importlib.util
+import json
+import os
+import py_compile
+import re
+import statistics
+import subprocess
+import sys
+import sysconfig
+import tempfile
+
+PROJECT_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Packages the entrypoint or the enclave needs whether or not the run imports
+# them, e.g. uvicorn's optional protocol implementations and the database drivers
+ENTRYPOINT_PACKAGES = (
+    "uvicorn", "click", "h11", "httptools", "uvloop", "websockets", "wsproto", "watchfiles", "dotenv", "yaml",
+    "anyio", "sniffio", "starlette", "fastapi", "pydantic", "pydantic_core", "sqlalchemy", "psycopg2",
+    "asyncpg", "redis", "aiohttp", "multidict", "yarl", "frozenlist", "aiosignal", "pandas", "numpy",
+    "scipy", "datasketch",
+)
+
+# Standard library directories nothing imports, left out of the trusted files
+STDLIB_EXCLUDED = ("test", "idlelib", "turtledemo", "ensurepip")
+
+def serve_requests() -> None:
+    """Start the server stack `app/main.py` runs, send it a few requests and stop it."""
+    import asyncio
+    import socket
+    import urllib.error
+    import urllib.request
+    import uvicorn
+    import uvicorn.lifespan.on  # noqa: F401 the lifespan runs against a database, not here
+    from app.main import app
+
+    def get(url: str, method: str = "GET", headers=None, data: bytes = None) -> None:
+        request = urllib.request.Request(url, method=method, headers=headers or {}, data=data)
+        try:
+            urllib.request.urlopen(request, timeout=10).read()
+        except urllib.error.HTTPError:
+            pass
+
+    async def run():
+        sock = socket.socket()
+        sock.bind(("127.0.0.1", 0))
+        url = f"http://127.0.0.1:{sock.getsockname()[1]}"
+        config = uvicorn.Config(app, lifespan="off", forwarded_allow_ips="*", proxy_headers=True, log_level="warning")
+        server = uvicorn.Server(config)
+        task = asyncio.ensure_future(server.serve(sockets=[sock]))
+        while not server.started:
+            await asyncio.sleep(0.01)
+        api_key = {"X-API-Key": os.environ.get("API_KEY", "")}
+        # A success, a missing key, a validation error and an unknown route
+        await asyncio.to_thread(get, f"{url}/metrics/", headers=api_key)
+        await asyncio.to_thread(get, f"{url}/api/proof/unknown")
+        await asyncio.to_thread(get, f"{url}/api/proof/", "POST", {"Content-Type": "application/json"}, b"{}")
+        await asyncio.to_thread(get, f"{url}/missing")
+        server.should_exit = True
+        await task
+
+    asyncio.run(run())
+
+def representative_run() -> None:
+    """Exercise the code paths of a serving worker, without a database."""
+    serve_requests()
+    from benchmarks.run import bench_pipeline, bench_lsh
+    bench_pipeline(512 * 1024, 50, latency=0, repeat=1, warm_cache=False, download=True)
+    bench_lsh(2000, 20, 1000, 5)
+
+def loaded_files() -> list:
+    """The files of every module and shared library loaded by this process."""
+    files = set()
+    for module in list(sys.modules.values()):
+        path = getattr(module, "__file__", None)
+        if path:
+            files.add(os.path.realpath(path))
+    # Libraries loaded by extension modules, e.g. numpy.libs/*.so
+    if os.path.exists("/proc/self/maps"):
+        with open("/proc/self/maps") as maps:
+            for line in maps:
+                fields = line.split()
+                if len(fields) >= 6 and fields[5].startswith("/") and ".so" in fields[5]:
+                    files.add(os.path.realpath(fields[5]))
+    return sorted(files)
+
+def record(output: str) -> None:
+    representative_run()
+    with open(output, "w") as f:
+        json.dump(loaded_files(), f)
+
+def package_files(names) -> list:
+    """The files of the packages in `names` that are installed, without importing them."""
+    files = list()
+    for name in names:
+        try:
+            spec = importlib.util.find_spec(name)
+        except (ImportError, ValueError):
+            continue
+        if spec is None:
+            continue
+        if spec.origin and os.path.isabs(spec.origin):
+            files.append(os.path.realpath(spec.origin))
+        files.extend(os.path.realpath(location) for location in spec.submodule_search_locations or ())
+    return files
+
+def site_directories() -> set:
+    paths = sysconfig.get_paths()
+    dirs = {os.path.realpath(paths[name]) for name in ("purelib", "platlib") if name in paths}
+    try:
+        import site
+        dirs.update(os.path.realpath(path) for path in site.getsitepackages())
+    except AttributeError:
+        pass
+    return dirs
+
+def stdlib_paths() -> set:
+    """Every entry of the standard library directories, bar its tests and the site directories in it.
+
+    The standard library is small next to the third-party packages, and
+    modules like `encodings.*` or `email.*` are imported lazily on paths no
+    representative run is sure to cover, so it is trusted whole.
+    """
+    site_dirs = site_directories()
+    paths = set()
+    for stdlib in {os.path.realpath(sysconfig.get_paths()[name]) for name in ("stdlib", "platstdlib")}:
+        if not os.path.isdir(stdlib):
+            continue
+        for name in os.listdir(stdlib):
+            path = os.path.join(stdlib, name)
+            if name in STDLIB_EXCLUDED or any((site + os.sep).startswith(path + os.sep) for site in site_dirs):
+                continue
+            paths.add(path)
+    return paths
+
+def library_roots() -> list:
+    """The directories Python imports from, longest first, without the project itself."""
+    roots = {os.path.realpath(path) for path in sys.path if path and os.path.isdir(path)}
+    roots.discard(PROJECT_ROOT)
+    return sorted(roots, key=len, reverse=True)
+
+def _dist_info_dirs(top_levels: set) -> set:
+    # Packages that read their own metadata at runtime need their dist-info too
+    dirs = set()
+    distributions = importlib.metadata.packages_distributions()
+    for top_level in top_levels:
+        for name in distributions.get(top_level, ()):
+            try:
+                path = importlib.metadata.distribution(name)._path
+            except Exception:
+                continue
+            dirs.add(os.path.realpath(str(path)))
+    return dirs
+
+def trusted_paths(files, extra=()) -> list:
+    """Group loaded files into the top-level packages and modules to trust.
+
+    A package is trusted as a whole, so code paths the representative run
+    missed still load. Files outside the library roots are left to the
+    manifest's own entries.
+    """
+    roots = library_roots()
+    paths, top_levels = set(), set()
+    for path in list(files) + package_files(ENTRYPOINT_PACKAGES):
+        root = next((root for root in roots if path.startswith(root + os.sep)), None)
+        if root is None:
+            continue
+        top = os.path.join(root, os.path.relpath(path, root).split(os.sep)[0])
+        paths.add(top)
+        top_levels.add(re.split(r"[.\-]", os.path.basename(top))[0] if os.path.isfile(top)
+                       else os.path.basename(top))
+        # Single-module bytecode lives apart from it, in __pycache__
+        if os.path.isfile(top) and top.endswith(".py") and os.path.exists(importlib.util.cache_from_source(top)):
+            paths.add(importlib.util.cache_from_source(top))
+    paths |= _dist_info_dirs(top_levels)
+    paths |= stdlib_paths()
+    # site reads every .pth file of the site directories at startup
+    for root in roots:
+        paths.update(os.path.join(root, name) for name in os.listdir(root) if name.endswith(".pth"))
+    paths.update(os.path.realpath(path) for path in extra)
+    return sorted(paths)
+
+# Run in a fresh interpreter: imports from the library roots outside the
+# trusted paths fail, as Gramine refuses to open untrusted files
+_VERIFY = """
+import importlib.machinery, json, os, sys
+with open(sys.argv[1]) as f:
+    trusted, roots = json.load(f)
+
+class UntrustedFinder:
+    @staticmethod
+    def find_spec(name, path=None, target=None):
+        spec = importlib.machinery.PathFinder.find_spec(name, path)
+        origin = spec and spec.origin and os.path.realpath(spec.origin)
+        if origin and any(origin.startswith(root + os.sep) for root in roots) and not any(
+            origin == path or origin.startswith(path + os.sep) for path in trusted
+        ):
+            raise ImportError(f"{origin} is not a trusted file")
+        return None
+
+sys.meta_path.insert(0, UntrustedFinder)
+import app.main
+import uvicorn
+# What uvicorn.run loads before serving: the protocols, the loop and the lifespan
+uvicorn.Config(app.main.app, lifespan="on").load()
+"""
+
+def verify(paths, env=None) -> None:
+    """Check that `app.main` and the server start with only `paths` trusted.
+
+    Raises RuntimeError with the failing import otherwise.
+    """
+    with tempfile.NamedTemporaryFile("w", suffix=".json") as f:
+        json.dump([list(paths), library_roots()], f)
+        f.flush()
+        result = subprocess.run([sys.executable, "-c", _VERIFY, f.name], capture_output=True, text=True,
+                                cwd=PROJECT_ROOT, env=env or app_environment())
+    if result.returncode != 0:
+        raise RuntimeError(f"The app doesn't start from the trusted files alone:\n{result.stderr}")
+
+def record_files(env=None) -> list:
+    """The files a representative run loads, recorded in a fresh interpreter."""
+    with tempfile.NamedTemporaryFile(suffix=".json") as recorded:
+        subprocess.run([sys.executable, "-m", "tools.trusted_files", "--record-into", recorded.name],
+                       check=True, cwd=PROJECT_ROOT, env=env or app_environment())
+        with open(recorded.name) as f:
+            return json.load(f)
+
+def manifest_entry(path: str) -> str:
+    return f'    "file:{path}/",' if os.path.isdir(path) else f'    "file:{path}",'
+
+def rewrite_manifest(template: str, paths) -> str:
+    """Swap the Python library directories of `sgx.trusted_files` for `paths`."""
+    match = re.search(r"(sgx\.trusted_files\s*=\s*\[\n)(.*?)(\n\])", template, re.S)
+    if not match:
+        raise ValueError("No sgx.trusted_files list in the manifest template")
+    roots = library_roots()
+    kept = list()
+    for line in match.group(2).splitlines():
+        entry = re.search(r'"file:([^"]*)"', line)
+        # Directories containing a library root, e.g. "file:/usr/lib/python3.10/"
+        if entry and entry.group(1).endswith("/") and "{{" not in entry.group(1) and any(
+            (root + os.sep).startswith(entry.group(1)) for root in roots
+        ):
+            continue
+        kept.append(line)
+    lines = kept + ["    # Generated by tools/trusted_files.py from a representative run"]
+    lines += [manifest_entry(path) for path in paths]
+    return template[:match.start(2)] + "\n".join(lines) + template[match.end(2):]
+
+def precompile(paths) -> int:
+    """Compile `paths` to bytecode Python trusts without reading the source back."""
+    mode = py_compile.PycInvalidationMode.UNCHECKED_HASH
+    count = 0
+    for path in list(paths) + [os.path.join(PROJECT_ROOT, "app")]:
+        if os.path.isdir(path):
+            count += compileall.compile_dir(path, quiet=2, invalidation_mode=mode, workers=0) and 1
+        elif path.endswith(".py"):
+            count += compileall.compile_file(path, quiet=2, invalidation_mode=mode) and 1
+    return count
+
+def tree_bytes(paths) -> int:
+    total = 0
+    for path in paths:
+        if os.path.isfile(path):
+            total += os.path.getsize(path)
+        for directory, _, names in os.walk(path) if os.path.isdir(path) else ():
+            total += sum(os.path.getsize(os.path.join(directory, name)) for name in names
+                         if os.path.isfile(os.path.join(directory, name)))
+    return total
+
+def startup_seconds(runs: int, env=None) -> float:
+    """Median seconds a fresh interpreter takes to import the app."""
+    code = "import time; start = time.perf_counter(); import app.main; print(time.perf_counter() - start)"
+    seconds = [
+        float(subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True,
+                             cwd=PROJECT_ROOT, env=env).stdout.strip().splitlines()[-1])
+        for _ in range(runs)
+    ]
+    return statistics.median(seconds)
+
+def app_environment() -> dict:
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join(filter(None, [PROJECT_ROOT, env.get("PYTHONPATH")]))
+    # The app refuses to start without these, none of them is used here
+    for name in ("API_KEY", "GMAPS_API_KEY", "POSTGRES_USER", "POSTGRES_PASSWORD", "POSTGRES_DB"):
+        env.setdefault(name, "trusted-files")
+    return env
+
+def main(argv=None) -> dict:
+    parser = argparse.ArgumentParser(description="Generate a minimal sgx.trusted_files list")
+    parser.add_argument("--manifest", default=os.path.join(PROJECT_ROOT, "app.manifest.template"))
+    parser.add_argument("--output", help="write the rewritten manifest template here (default: don't)")
+    parser.add_argument("--include", action="append", default=[], help="extra file or directory to trust")
+    parser.add_argument("--precompile", action="store_true", help="compile the trusted packages to bytecode")
+    parser.add_argument("--runs", type=int, default=3, help="startup time samples before and after")
+    parser.add_argument("--record-into", help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.record_into:
+        record(args.record_into)
+        return None
+
+    env = app_environment()
+    # Before: no bytecode, as in an enclave that can't write __pycache__
+    with tempfile.TemporaryDirectory() as empty_cache:
+        before = startup_seconds(args.runs, dict(env, PYTHONPYCACHEPREFIX=empty_cache, PYTHONDONTWRITEBYTECODE="1"))
+
+    files = record_files(env)
+    paths = trusted_paths(files, args.include)
+    # Fail the build rather than the enclave
+    verify(paths, env)
+    compiled = 0
+    if args.precompile:
+        compiled = precompile(paths)
+        # Now with the bytecode of single-file modules
+        paths = trusted_paths(files, args.include)
+
+    if args.output:
+        with open(args.manifest) as f:
+            template = rewrite_manifest(f.read(), paths)
+        with open(args.output, "w") as f:
+            f.write(template)
+    after = startup_seconds(args.runs, env)
+
+    report = {
+        "loaded_files": len(files),
+        "trusted_paths": len(paths),
+        "trusted_bytes_before": tree_bytes(library_roots()),
+        "trusted_bytes_after": tree_bytes(paths),
+        "precompiled_paths": compiled,
+        "startup_seconds_before": before,
+        "startup_seconds_after": after,
+    }
+    print(json.dumps(report, indent=2), file=sys.stderr)
+    return report
+
+if __name__ == "__main__":
+    main()